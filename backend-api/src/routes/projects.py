@@ -1,14 +1,31 @@
 from flask import Blueprint, request, jsonify
 from src.models.database import db, Project
+from datetime import datetime
 import json
 
 projects_bp = Blueprint('projects', __name__)
 
+# Statuts posés par le healthcheck ; les autres (maintenance...) sont fixés
+# par un administrateur et ne sont jamais écrasés par la synchronisation
+PROBE_STATUSES = ('online', 'offline', 'unknown')
+
 @projects_bp.route('/projects', methods=['GET'])
 def get_projects():
-    """Récupérer tous les projets"""
+    """Récupérer tous les projets (ou ceux modifiés depuis `updated_since`)"""
     try:
-        projects = Project.query.all()
+        query = Project.query
+        
+        # Synchronisation incrémentale : seulement les projets modifiés depuis le
+        # dernier passage (bornes incluses, les lignes déjà vues reviennent)
+        updated_since = request.args.get('updated_since')
+        if updated_since:
+            try:
+                since = datetime.fromisoformat(updated_since)
+            except ValueError:
+                return jsonify({'success': False, 'error': 'Invalid updated_since timestamp'}), 400
+            query = query.filter(Project.updated_at >= since).order_by(Project.updated_at, Project.id)
+        
+        projects = query.all()
         return jsonify({
             'success': True,
             'projects': [project.to_dict() for project in projects],
@@ -127,6 +144,52 @@ def delete_project(project_id):
         db.session.rollback()
         return jsonify({'success': False, 'error': str(e)}), 500
 
+@projects_bp.route('/projects/status', methods=['PATCH'])
+def update_projects_status():
+    """Mettre à jour le statut de plusieurs projets en une requête
+    
+    Corps : {"statuses": [{"id": 1, "status": "online"}, ...]}. Seules les
+    lignes dont le statut change réellement sont modifiées, et `updated_at`
+    est conservé : un changement de statut remonté par le healthcheck n'est
+    pas une modification du projet à resynchroniser. Les projets dont le
+    statut actuel n'est pas un statut de sonde (`maintenance`...) sont ignorés.
+    """
+    try:
+        data = request.get_json() or {}
+        statuses = data.get('statuses')
+        if not isinstance(statuses, list):
+            return jsonify({'success': False, 'error': 'Field statuses is required'}), 400
+        
+        # Regroupement par statut : un UPDATE par valeur plutôt qu'un par projet
+        ids_by_status = {}
+        for item in statuses:
+            if not isinstance(item, dict) or not isinstance(item.get('id'), int) \
+                    or not isinstance(item.get('status'), str):
+                return jsonify({'success': False, 'error': 'Each status needs an integer id and a status'}), 400
+            ids_by_status.setdefault(item['status'], set()).add(item['id'])
+        
+        updated = 0
+        for status, ids in ids_by_status.items():
+            updated += Project.query.filter(
+                Project.id.in_(ids),
+                db.or_(Project.status.in_(PROBE_STATUSES), Project.status.is_(None)),
+                db.or_(Project.status != status, Project.status.is_(None))
+            ).update(
+                {Project.status: status, Project.updated_at: Project.updated_at},
+                synchronize_session=False
+            )
+        db.session.commit()
+        
+        return jsonify({
+            'success': True,
+            'received': len(statuses),
+            'updated': updated
+        }), 200
+        
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'error': str(e)}), 500
+
 @projects_bp.route('/projects/status', methods=['GET'])
 def get_projects_status():
     """Récupérer les statistiques des projets"""
@@ -6,6 +6,7 @@ sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'src'))
 from main import app, db
 from models.database import Project, StoreItem, Contact, Content
 import json
+from datetime import datetime
 
 @pytest.fixture
 def client():
@@ -149,6 +150,78 @@ class TestProjectsAPI:
         get_response = client.get(f'/api/projects/{project_id}')
         assert get_response.status_code == 404
 
+    def test_get_projects_updated_since(self, client, auth_headers):
+        """Test the incremental listing used by the healthcheck sync."""
+        for name in ('Old Project', 'New Project'):
+            client.post('/api/projects',
+                       data=json.dumps({'name': name, 'url': 'https://example.com'}),
+                       headers=auth_headers)
+        old = Project.query.filter_by(name='Old Project').first()
+        old.updated_at = datetime(2024, 1, 1)
+        db.session.commit()
+        
+        response = client.get('/api/projects?updated_since=2025-01-01T00:00:00')
+        assert response.status_code == 200
+        data = json.loads(response.data)
+        assert [project['name'] for project in data['projects']] == ['New Project']
+        
+        # The bound is inclusive
+        response = client.get('/api/projects?updated_since=2024-01-01T00:00:00')
+        assert json.loads(response.data)['total'] == 2
+        
+        response = client.get('/api/projects?updated_since=yesterday')
+        assert response.status_code == 400
+
+    def test_update_projects_status(self, client, auth_headers):
+        """Test the bulk status update pushed by the healthcheck sync."""
+        ids = []
+        for name in ('First Project', 'Second Project'):
+            create_response = client.post('/api/projects',
+                                        data=json.dumps({'name': name, 'url': 'https://example.com',
+                                                         'status': 'online'}),
+                                        headers=auth_headers)
+            ids.append(json.loads(create_response.data)['project']['id'])
+        updated_at = Project.query.get(ids[0]).updated_at
+        
+        response = client.patch('/api/projects/status',
+                              data=json.dumps({'statuses': [{'id': ids[0], 'status': 'offline'},
+                                                            {'id': ids[1], 'status': 'online'}]}),
+                              headers=auth_headers)
+        assert response.status_code == 200
+        data = json.loads(response.data)
+        assert data['received'] == 2
+        assert data['updated'] == 1
+        
+        db.session.expire_all()
+        project = Project.query.get(ids[0])
+        assert project.status == 'offline'
+        # A status change is not a modification to sync back
+        assert project.updated_at == updated_at
+        
+        response = client.patch('/api/projects/status',
+                              data=json.dumps({'statuses': [{'id': 'x', 'status': 'online'}]}),
+                              headers=auth_headers)
+        assert response.status_code == 400
+        response = client.patch('/api/projects/status', data=json.dumps({}), headers=auth_headers)
+        assert response.status_code == 400
+
+    def test_update_projects_status_keeps_maintenance(self, client, auth_headers):
+        """Test the healthcheck sync never overwrites a status set by an admin."""
+        create_response = client.post('/api/projects',
+                                    data=json.dumps({'name': 'Maintenance Project', 'url': 'https://example.com',
+                                                     'status': 'maintenance'}),
+                                    headers=auth_headers)
+        project_id = json.loads(create_response.data)['project']['id']
+        
+        response = client.patch('/api/projects/status',
+                              data=json.dumps({'statuses': [{'id': project_id, 'status': 'offline'}]}),
+                              headers=auth_headers)
+        assert response.status_code == 200
+        assert json.loads(response.data)['updated'] == 0
+        
+        db.session.expire_all()
+        assert Project.query.get(project_id).status == 'maintenance'
+
 class TestStoreAPI:
     """Test store management endpoints."""
     
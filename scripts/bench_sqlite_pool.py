@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+"""Micro-benchmark: per-request sqlite3.connect() vs the pooled connections
+
+Runs the project-bridge route lookup query the way a request does, once
+opening and closing a fresh connection each time (the old behaviour) and
+once through src/db.py of project-bridge.
+
+Usage: python scripts/bench_sqlite_pool.py [iterations]
+"""
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'services', 'project-bridge'))
+
+from src import db  # noqa: E402
+
+QUERY = '''
+    SELECT id, name, target_url, path_prefix, enabled, auth_required, rate_limit
+    FROM services
+    WHERE ? LIKE path_prefix || '%' AND enabled = 1
+    ORDER BY LENGTH(path_prefix) DESC
+    LIMIT 1
+'''
+
+
+def setup(database):
+    conn = sqlite3.connect(database)
+    conn.execute('''
+        CREATE TABLE services (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL,
+            type TEXT NOT NULL,
+            target_url TEXT NOT NULL,
+            path_prefix TEXT NOT NULL,
+            enabled BOOLEAN DEFAULT 1,
+            auth_required BOOLEAN DEFAULT 0,
+            rate_limit INTEGER DEFAULT 100,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    conn.executemany(
+        'INSERT INTO services (name, type, target_url, path_prefix) VALUES (?, ?, ?, ?)',
+        [(f'Service {i}', 'api', f'https://svc{i}.example.com', f'/api/svc{i}') for i in range(6)]
+    )
+    conn.commit()
+    conn.close()
+
+
+def per_request_connect(database, iterations):
+    for _ in range(iterations):
+        conn = sqlite3.connect(database)
+        conn.cursor().execute(QUERY, ('/api/svc3/items',)).fetchone()
+        conn.close()
+
+
+def pooled(database, iterations):
+    for _ in range(iterations):
+        conn = db.connect(database)
+        conn.cursor().execute(QUERY, ('/api/svc3/items',)).fetchone()
+        conn.close()
+
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    with tempfile.TemporaryDirectory() as tmp:
+        database = os.path.join(tmp, 'bench.db')
+        setup(database)
+        for name, fn in (('per-request connect', per_request_connect), ('pooled', pooled)):
+            fn(database, 100)
+            start = time.perf_counter()
+            fn(database, iterations)
+            elapsed = time.perf_counter() - start
+            print(f'{name:>20}: {elapsed / iterations * 1e6:8.1f} us/request')
+        db.close_all()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,471 @@
+"""Compact, run-length encoded storage of health check results
+
+Instead of one `health_checks` row per probe, consecutive identical results
+(same status, HTTP status and error) are stored as a single run with a check
+count and first/last timestamps. Error messages are interned in a dictionary
+table and latency is kept as a periodic sample, with the phase timings of
+the same probe.
+
+The open run of a project is its latest run in the database. Checks that do
+not start a new run are kept in memory as pending checks, along with their
+rollups, latency sketch and project status, and written at checkpoints: on
+state transitions, and once the oldest pending check is CHECKPOINT_INTERVAL
+old. Pending checks are only added once their transaction committed, and
+are written as increments, so several processes can record checks of the
+same run. A crash loses the pending checks (at most CHECKPOINT_INTERVAL
+of them per project).
+"""
+import os
+import threading
+import time
+
+from src import db
+from src.db import ensure_column
+from src.probe import PHASES
+from src.rollups import (
+    GLOBAL_SKETCH_SCOPE, RollupBucket, add_to_buckets, merge_lifetime_sketch, project_scope, to_sql_timestamp,
+    write_rollups
+)
+from src.sketch import DDSketch
+
+STATUS_CODES = {'unknown': 0, 'online': 1, 'offline': 2}
+
+# Phase timing columns of latency samples
+SAMPLE_PHASES = ', '.join(f'{phase}_time' for phase in PHASES)
+STATUS_NAMES = {code: name for name, code in STATUS_CODES.items()}
+
+ERROR_NONE = 0
+ERROR_HTTP = 1
+ERROR_TIMEOUT = 2
+ERROR_CONNECTION = 3
+ERROR_CIRCUIT_OPEN = 4
+ERROR_OTHER = 5
+
+# Seconds between latency samples of a run
+SAMPLE_INTERVAL = float(os.environ.get('HEALTHCHECK_SAMPLE_INTERVAL', 300))
+# Seconds a check stays pending in memory before it is written
+CHECKPOINT_INTERVAL = float(os.environ.get('HEALTHCHECK_RUN_CHECKPOINT_INTERVAL', 300))
+
+# project id -> PendingChecks
+_pending = {}
+_error_ids = {}
+_lock = threading.Lock()
+
+
+def create_compact_tables(cursor):
+    """Create the run, sample and error dictionary tables"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS error_messages (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            message TEXT NOT NULL UNIQUE
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS health_check_runs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            project_id INTEGER NOT NULL,
+            status INTEGER NOT NULL,
+            status_code INTEGER,
+            error_kind INTEGER NOT NULL DEFAULT 0,
+            error_id INTEGER,
+            started_at REAL NOT NULL,
+            ended_at REAL NOT NULL,
+            check_count INTEGER NOT NULL DEFAULT 1,
+            FOREIGN KEY (project_id) REFERENCES projects (id),
+            FOREIGN KEY (error_id) REFERENCES error_messages (id)
+        )
+    ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_health_check_runs_project_ended
+        ON health_check_runs (project_id, ended_at)
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS health_check_samples (
+            project_id INTEGER NOT NULL,
+            sampled_at REAL NOT NULL,
+            response_time REAL NOT NULL,
+            PRIMARY KEY (project_id, sampled_at)
+        ) WITHOUT ROWID
+    ''')
+    for phase in PHASES:
+        ensure_column(cursor, 'health_check_samples', f'{phase}_time', 'REAL')
+
+
+def classify_error(error_message):
+    """Map an error message to an integer error kind"""
+    if error_message is None:
+        return ERROR_NONE
+    if error_message.startswith('HTTP '):
+        return ERROR_HTTP
+    if error_message == 'Timeout':
+        return ERROR_TIMEOUT
+    if error_message == 'Connection Error':
+        return ERROR_CONNECTION
+    if error_message == 'Circuit open':
+        return ERROR_CIRCUIT_OPEN
+    return ERROR_OTHER
+
+
+def intern_error(cursor, message):
+    """Return the dictionary id of an error message, inserting it if new"""
+    if message is None:
+        return None
+    error_id = _error_ids.get(message)
+    if error_id is not None:
+        return error_id
+    cursor.execute('SELECT id FROM error_messages WHERE message = ?', (message,))
+    row = cursor.fetchone()
+    if row:
+        error_id = row[0]
+    else:
+        cursor.execute('INSERT INTO error_messages (message) VALUES (?)', (message,))
+        error_id = cursor.lastrowid
+    # Only ids that made it to the database are reused
+    db.after_transaction(cursor, on_commit=lambda: _error_ids.setdefault(message, error_id))
+    return error_id
+
+
+class PendingChecks:
+    """Checks of one project recorded by this process since its last checkpoint"""
+
+    def __init__(self):
+        # run id -> [check_count, ended_at] not added to the run yet
+        self.runs = {}
+        self.buckets = {}
+        self.latency = DDSketch()
+        # (checked_at, status, last_checked, response_time) of the latest check
+        self.project = None
+        self.since = None
+
+    def add(self, run_id, ts, result, last_checked, timings=None):
+        run = self.runs.setdefault(run_id, [0, ts])
+        run[0] += 1
+        run[1] = max(run[1], ts)
+        add_to_buckets(self.buckets, ts, result['status'] == 'online', result['response_time'], timings)
+        self.latency.add(result['response_time'])
+        if self.project is None or ts >= self.project[0]:
+            self.project = (ts, result['status'], last_checked, result['response_time'])
+        self.since = ts if self.since is None else min(self.since, ts)
+        return self
+
+    def merge(self, other):
+        for run_id, (check_count, ended_at) in other.runs.items():
+            run = self.runs.setdefault(run_id, [0, ended_at])
+            run[0] += check_count
+            run[1] = max(run[1], ended_at)
+        for key, bucket in other.buckets.items():
+            self.buckets.setdefault(key, RollupBucket()).merge(bucket)
+        self.latency.merge(other.latency)
+        if other.project is not None and (self.project is None or other.project[0] > self.project[0]):
+            self.project = other.project
+        if other.since is not None:
+            self.since = other.since if self.since is None else min(self.since, other.since)
+        return self
+
+
+def _load_open_run(cursor, project_id):
+    cursor.execute('''
+        SELECT id, status, status_code, error_kind, error_id
+        FROM health_check_runs
+        WHERE project_id = ?
+        ORDER BY ended_at DESC, id DESC
+        LIMIT 1
+    ''', (project_id,))
+    row = cursor.fetchone()
+    if not row:
+        return None
+    return {'id': row[0], 'key': tuple(row[1:])}
+
+
+def _write_pending(cursor, project_id, pending):
+    for run_id, (check_count, ended_at) in pending.runs.items():
+        # Increments, as other processes add their own checks to the same run
+        cursor.execute(
+            'UPDATE health_check_runs SET ended_at = MAX(ended_at, ?), check_count = check_count + ? WHERE id = ?',
+            (ended_at, check_count, run_id)
+        )
+    write_rollups(cursor, project_id, pending.buckets)
+    if pending.latency.count:
+        for scope in (project_scope(project_id), GLOBAL_SKETCH_SCOPE):
+            merge_lifetime_sketch(cursor, scope, pending.latency, pending.project[0])
+    if pending.project is not None:
+        _, status, last_checked, response_time = pending.project
+        cursor.execute('''
+            UPDATE projects
+            SET status = ?, last_checked = ?, response_time = ?
+            WHERE id = ? AND (last_checked IS NULL OR last_checked <= ?)
+        ''', (status, last_checked, response_time, project_id, last_checked))
+
+
+def _stage(pending_by_project):
+    # Add committed checks, or put back those of a checkpoint that was rolled back
+    with _lock:
+        for project_id, pending in pending_by_project.items():
+            current = _pending.get(project_id)
+            _pending[project_id] = current.merge(pending) if current else pending
+
+
+def _checkpoint(cursor, detached, written):
+    # Write `written`, built from the pending checks `detached` from memory
+    for project_id, pending in written.items():
+        _write_pending(cursor, project_id, pending)
+    if detached:
+        db.after_transaction(cursor, on_rollback=lambda: _stage(detached))
+
+
+def record_compact(cursor, project_id, result, now=None, timings=None, last_checked=None, status_changed=False):
+    """Store one check result in run-length encoded form
+
+    A check starting a new run (or changing the project status) writes the
+    pending checks of the project along with it; other checks are added to
+    them once the transaction commits. Pending checks of any project older
+    than CHECKPOINT_INTERVAL are written as well. Returns True when a new
+    run was started (a state transition).
+    """
+    now = time.time() if now is None else now
+    key = (
+        STATUS_CODES.get(result['status'], 0),
+        result['status_code'],
+        classify_error(result['error_message']),
+        intern_error(cursor, result['error_message'])
+    )
+
+    # Read the open run under the write lock, so that concurrent checks cannot both start a run
+    if not cursor.connection.in_transaction:
+        cursor.execute('BEGIN IMMEDIATE')
+    run = _load_open_run(cursor, project_id)
+    transition = run is None or run['key'] != key
+    if transition:
+        cursor.execute('''
+            INSERT INTO health_check_runs
+                (project_id, status, status_code, error_kind, error_id, started_at, ended_at, check_count)
+            VALUES (?, ?, ?, ?, ?, ?, ?, 0)
+        ''', (project_id, *key, now, now))
+        run = {'id': cursor.lastrowid, 'key': key}
+
+    latency = result['response_time']
+    if latency is not None:
+        cursor.execute('SELECT MAX(sampled_at) FROM health_check_samples WHERE project_id = ?', (project_id,))
+        last_sample = cursor.fetchone()[0] or 0
+        if transition or now - last_sample >= SAMPLE_INTERVAL:
+            timings = timings or {}
+            cursor.execute(f'''
+                INSERT OR REPLACE INTO health_check_samples (project_id, sampled_at, response_time, {SAMPLE_PHASES})
+                VALUES (?, ?, ?, {', '.join('?' for _ in PHASES)})
+            ''', (project_id, now, latency, *(timings.get(phase) for phase in PHASES)))
+
+    check = PendingChecks().add(run['id'], now, result, last_checked, timings)
+    with _lock:
+        pending = _pending.get(project_id)
+        # Pending checks of a run that ended (in another process) are written too
+        due = transition or status_changed or pending is not None and (
+            now - pending.since >= CHECKPOINT_INTERVAL or any(run_id != run['id'] for run_id in pending.runs))
+        detached = {other: checks for other, checks in _pending.items()
+                    if other == project_id and due or now - checks.since >= CHECKPOINT_INTERVAL}
+        for other in detached:
+            del _pending[other]
+
+    written = dict(detached)
+    if due:
+        written[project_id] = check.merge(detached[project_id]) if project_id in detached else check
+    else:
+        db.after_transaction(cursor, on_commit=lambda: _stage({project_id: check}))
+    _checkpoint(cursor, detached, written)
+    return transition
+
+
+def flush_pending_checks(cursor):
+    """Write the pending checks of every project (on shutdown, before shards change hands)"""
+    with _lock:
+        detached = dict(_pending)
+        _pending.clear()
+    _checkpoint(cursor, detached, detached)
+
+
+def pending_runs(project_id):
+    """{run id: (check_count, ended_at)} of the pending checks of a project"""
+    with _lock:
+        pending = _pending.get(project_id)
+        return {run_id: tuple(run) for run_id, run in pending.runs.items()} if pending else {}
+
+
+def _history_row(status, sample, status_code, message, checked_at):
+    # `sample` is (response_time, *phase timings) of the latest sample, or None
+    sample = sample or (None,) * (1 + len(PHASES))
+    return (STATUS_NAMES.get(status, 'unknown'), sample[0], status_code, message, to_sql_timestamp(checked_at),
+            *sample[1:])
+
+
+def fetch_compact_history(cursor, project_id, start=None, end=None, limit=None):
+    """Rebuild per-check history rows from runs and latency samples
+
+    Checks inside a run are spread evenly between its first and last
+    timestamps; each takes the latest latency sample (and its phase timings)
+    at or before it.
+    Rows are returned newest first when `limit` is given, oldest first
+    otherwise, like the raw `health_checks` queries.
+    """
+    pending = pending_runs(project_id)
+    if limit is not None:
+        return _latest_compact_history(cursor, project_id, limit, pending)
+
+    query = '''
+        SELECT r.id, r.status, r.status_code, e.message, r.started_at, r.ended_at, r.check_count
+        FROM health_check_runs r
+        LEFT JOIN error_messages e ON e.id = r.error_id
+        WHERE r.project_id = ?
+    '''
+    params = [project_id]
+    if start is not None:
+        # The stored end of a run may lag behind its pending checks
+        query += f' AND (r.ended_at >= ? OR r.id IN ({", ".join("?" for _ in pending)}))'
+        params.extend([start, *pending])
+    if end is not None:
+        query += ' AND r.started_at <= ?'
+        params.append(end)
+    query += ' ORDER BY r.started_at'
+    cursor.execute(query, params)
+    runs = cursor.fetchall()
+    if not runs:
+        return []
+
+    cursor.execute(f'''
+        SELECT sampled_at, response_time, {SAMPLE_PHASES}
+        FROM health_check_samples
+        WHERE project_id = ? AND sampled_at >= ?
+        ORDER BY sampled_at
+    ''', (project_id, runs[0][4]))
+    samples = cursor.fetchall()
+
+    rows = []
+    sample_index = 0
+    for run_id, status, status_code, message, started_at, ended_at, check_count in runs:
+        if run_id in pending:
+            check_count += pending[run_id][0]
+            ended_at = max(ended_at, pending[run_id][1])
+        step = (ended_at - started_at) / (check_count - 1) if check_count > 1 else 0
+        sample = None
+        for i in range(check_count):
+            checked_at = started_at + i * step
+            while sample_index < len(samples) and samples[sample_index][0] <= checked_at + 1e-6:
+                if samples[sample_index][0] >= started_at:
+                    sample = samples[sample_index][1:]
+                sample_index += 1
+            if start is not None and checked_at < start or end is not None and checked_at > end:
+                continue
+            rows.append(_history_row(status, sample, status_code, message, checked_at))
+    return rows
+
+
+def fetch_latest_compact(cursor):
+    """Latest stored check of every project, rebuilt from its newest run
+
+    Rows have the shape of the latest `health_checks` rows read by
+    `LatestResults.load` (epoch `checked_at`), latency and phase timings
+    coming from the latest sample of the run.
+    """
+    cursor.execute(f'''
+        SELECT r.project_id, r.status, s.response_time, r.status_code, e.message, r.ended_at,
+               {', '.join(f's.{phase}_time' for phase in PHASES)}
+        FROM projects p
+        JOIN health_check_runs r ON r.id = (
+            SELECT id FROM health_check_runs
+            WHERE project_id = p.id
+            ORDER BY ended_at DESC, id DESC
+            LIMIT 1
+        )
+        LEFT JOIN error_messages e ON e.id = r.error_id
+        LEFT JOIN health_check_samples s ON s.project_id = r.project_id AND s.sampled_at = (
+            SELECT MAX(sampled_at) FROM health_check_samples
+            WHERE project_id = r.project_id AND sampled_at >= r.started_at AND sampled_at <= r.ended_at
+        )
+    ''')
+    return [(project_id, STATUS_NAMES.get(status, 'unknown'), *rest) for project_id, status, *rest in cursor.fetchall()]
+
+
+def _latest_compact_history(cursor, project_id, limit, pending):
+    # Newest runs first, expanding only the checks needed to reach `limit`
+    # rows (every run has at least one check)
+    cursor.execute('''
+        SELECT r.id, r.status, r.status_code, e.message, r.started_at, r.ended_at, r.check_count
+        FROM health_check_runs r
+        LEFT JOIN error_messages e ON e.id = r.error_id
+        WHERE r.project_id = ?
+        ORDER BY r.ended_at DESC, r.id DESC
+        LIMIT ?
+    ''', (project_id, limit))
+    runs = cursor.fetchall()
+
+    rows = []
+    for run_id, status, status_code, message, started_at, ended_at, check_count in runs:
+        if len(rows) >= limit:
+            break
+        if run_id in pending:
+            check_count += pending[run_id][0]
+            ended_at = max(ended_at, pending[run_id][1])
+        step = (ended_at - started_at) / (check_count - 1) if check_count > 1 else 0
+        first = max(check_count - (limit - len(rows)), 0)
+        first_at = started_at + first * step
+
+        # The last sample of the run at or before its first needed check, and the ones after it
+        cursor.execute(f'''
+            SELECT sampled_at, response_time, {SAMPLE_PHASES}
+            FROM health_check_samples
+            WHERE project_id = ? AND sampled_at >= ? AND sampled_at <= ?
+            ORDER BY sampled_at DESC
+            LIMIT 1
+        ''', (project_id, started_at, first_at + 1e-6))
+        samples = cursor.fetchall()
+        cursor.execute(f'''
+            SELECT sampled_at, response_time, {SAMPLE_PHASES}
+            FROM health_check_samples
+            WHERE project_id = ? AND sampled_at > ? AND sampled_at <= ?
+            ORDER BY sampled_at
+        ''', (project_id, first_at + 1e-6, ended_at + 1e-6))
+        samples += cursor.fetchall()
+
+        run_rows = []
+        sample_index = 0
+        sample = None
+        for i in range(first, check_count):
+            checked_at = started_at + i * step
+            while sample_index < len(samples) and samples[sample_index][0] <= checked_at + 1e-6:
+                sample = samples[sample_index][1:]
+                sample_index += 1
+            run_rows.append(_history_row(status, sample, status_code, message, checked_at))
+        rows.extend(reversed(run_rows))
+    return rows
+
+
+def reset_state():
+    """Forget pending checks and interned errors (after switching databases)"""
+    with _lock:
+        _pending.clear()
+        _error_ids.clear()
+
+
+def delete_compact_history(cursor, project_ids):
+    """Delete the runs and samples of projects, and forget their pending checks"""
+    params = [(project_id,) for project_id in project_ids]
+    cursor.executemany('DELETE FROM health_check_runs WHERE project_id = ?', params)
+    cursor.executemany('DELETE FROM health_check_samples WHERE project_id = ?', params)
+    db.after_transaction(cursor, on_commit=lambda: _forget(project_ids))
+
+
+def _forget(project_ids):
+    with _lock:
+        for project_id in project_ids:
+            _pending.pop(project_id, None)
+
+
+def prune_compact(cursor, cutoff):
+    """Delete runs that ended and samples taken before `cutoff`, except the open runs"""
+    cursor.execute('''
+        DELETE FROM health_check_runs
+        WHERE ended_at < ?
+          AND ended_at < (SELECT MAX(latest.ended_at) FROM health_check_runs latest
+                          WHERE latest.project_id = health_check_runs.project_id)
+    ''', (cutoff,))
+    expired = cursor.rowcount
+    cursor.execute('DELETE FROM health_check_samples WHERE sampled_at < ?', (cutoff,))
+    return expired
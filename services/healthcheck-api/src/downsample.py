@@ -0,0 +1,179 @@
+"""Server-side downsampling of health check history for charts
+
+Input series are columnar numpy arrays, either raw checks (one row per check)
+or rollup buckets (pre-aggregated counts and latency sums/min/max), so both
+shapes go through the same vectorized bucketing.
+"""
+import numpy as np
+
+MODES = ('minmax', 'lttb')
+
+
+def series_from_raw(rows):
+    """Columnar series from (epoch, is_up, latency) tuples of raw checks"""
+    if not rows:
+        return _empty_series()
+    t = np.array([row[0] for row in rows], dtype=float)
+    up = np.array([1.0 if row[1] else 0.0 for row in rows])
+    latency = np.array([np.nan if row[2] is None else row[2] for row in rows], dtype=float)
+    has_latency = ~np.isnan(latency)
+    return {
+        't': t,
+        'count': np.ones_like(t),
+        'up': up,
+        'latency_sum': np.where(has_latency, latency, 0.0),
+        'latency_count': has_latency.astype(float),
+        'latency_min': latency,
+        'latency_max': latency,
+    }
+
+
+def series_from_rollups(rows):
+    """Columnar series from rollup rows (bucket_start, check_count, up_count,
+    latency_count, latency_sum, latency_min, latency_max, ...)"""
+    if not rows:
+        return _empty_series()
+    columns = list(zip(*rows))
+
+    def column(index):
+        return np.array([np.nan if v is None else v for v in columns[index]], dtype=float)
+
+    return {
+        't': column(0),
+        'count': column(1),
+        'up': column(2),
+        'latency_count': column(3),
+        'latency_sum': column(4),
+        'latency_min': column(5),
+        'latency_max': column(6),
+    }
+
+
+def _empty_series():
+    empty = np.empty(0, dtype=float)
+    return {key: empty for key in ('t', 'count', 'up', 'latency_sum', 'latency_count', 'latency_min', 'latency_max')}
+
+
+def bucket_index(t, start, end, points):
+    """Equal-width time bucket of every sample, clipped to [0, points - 1]"""
+    width = max(end - start, 1e-9) / points
+    return np.clip(((t - start) // width).astype(np.int64), 0, points - 1), width
+
+
+def minmax_buckets(series, start, end, points):
+    """Aggregate a series into `points` equal-width buckets
+
+    Returns per-bucket check count, up ratio and latency avg/min/max; empty
+    buckets have NaN statistics.
+    """
+    index, width = bucket_index(series['t'], start, end, points)
+
+    count = np.bincount(index, weights=series['count'], minlength=points)
+    up = np.bincount(index, weights=series['up'], minlength=points)
+    latency_count = np.bincount(index, weights=series['latency_count'], minlength=points)
+    latency_sum = np.bincount(index, weights=series['latency_sum'], minlength=points)
+
+    latency_min = np.full(points, np.inf)
+    latency_max = np.full(points, -np.inf)
+    valid = ~np.isnan(series['latency_min'])
+    np.minimum.at(latency_min, index[valid], series['latency_min'][valid])
+    valid = ~np.isnan(series['latency_max'])
+    np.maximum.at(latency_max, index[valid], series['latency_max'][valid])
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        up_ratio = np.where(count > 0, up / count, np.nan)
+        latency_avg = np.where(latency_count > 0, latency_sum / latency_count, np.nan)
+    latency_min[np.isinf(latency_min)] = np.nan
+    latency_max[np.isinf(latency_max)] = np.nan
+
+    return {
+        't': start + np.arange(points) * width,
+        'count': count,
+        'up_ratio': up_ratio,
+        'latency_avg': latency_avg,
+        'latency_min': latency_min,
+        'latency_max': latency_max,
+    }
+
+
+def lttb_select(t, y, index, points):
+    """Largest-Triangle-Three-Buckets selection over pre-assigned buckets
+
+    Returns the selected sample position per bucket (-1 for empty buckets).
+    The first non-empty bucket keeps its first sample and the last keeps its
+    last one; in between, each bucket keeps the sample forming the largest
+    triangle with the previous selection and the next bucket's centroid.
+    """
+    selected = np.full(points, -1, dtype=np.int64)
+    valid = ~np.isnan(y)
+    t, y, index = t[valid], y[valid], index[valid]
+    positions = np.flatnonzero(valid)
+    if len(t) == 0:
+        return selected
+
+    starts = np.searchsorted(index, np.arange(points), side='left')
+    stops = np.searchsorted(index, np.arange(points), side='right')
+    sizes = stops - starts
+    sums_t = np.bincount(index, weights=t, minlength=points)
+    sums_y = np.bincount(index, weights=y, minlength=points)
+    non_empty = np.flatnonzero(sizes)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        centroid_t = sums_t / sizes
+        centroid_y = sums_y / sizes
+
+    first, last = non_empty[0], non_empty[-1]
+    selected[first] = positions[starts[first]]
+    prev_t, prev_y = t[starts[first]], y[starts[first]]
+    for k in range(1, len(non_empty)):
+        bucket = non_empty[k]
+        lo, hi = starts[bucket], stops[bucket]
+        if bucket == last:
+            choice = hi - 1
+        else:
+            nxt = non_empty[k + 1]
+            area = np.abs((prev_t - centroid_t[nxt]) * (y[lo:hi] - prev_y)
+                          - (prev_t - t[lo:hi]) * (centroid_y[nxt] - prev_y))
+            choice = lo + int(np.argmax(area))
+        selected[bucket] = positions[choice]
+        prev_t, prev_y = t[choice], y[choice]
+    return selected
+
+
+def downsample(series, start, end, points, mode='minmax'):
+    """Downsample a series to at most `points` buckets for charting
+
+    Both modes return per-bucket up ratio and latency range. 'lttb' also
+    returns one representative sample per bucket (latency_t, latency).
+    """
+    if mode not in MODES:
+        raise ValueError(f'Unknown downsampling mode {mode!r}')
+    order = np.argsort(series['t'], kind='stable')
+    series = {key: values[order] for key, values in series.items()}
+
+    buckets = minmax_buckets(series, start, end, points)
+    if mode == 'lttb':
+        index, _ = bucket_index(series['t'], start, end, points)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            y = np.where(series['latency_count'] > 0, series['latency_sum'] / series['latency_count'], np.nan)
+        selected = lttb_select(series['t'], y, index, points)
+        picked = selected >= 0
+        buckets['latency_t'] = np.full(points, np.nan)
+        buckets['latency'] = np.full(points, np.nan)
+        buckets['latency_t'][picked] = series['t'][selected[picked]]
+        buckets['latency'][picked] = y[selected[picked]]
+    return buckets
+
+
+def to_json_lists(buckets, decimals=6):
+    """Convert bucket arrays to JSON-friendly lists (NaN -> None)"""
+    output = {}
+    for key, values in buckets.items():
+        if key in ('t', 'count'):
+            output[key] = [int(v) for v in np.round(values)]
+            continue
+        if key == 'latency_t':
+            output[key] = [None if np.isnan(v) else int(v) for v in values]
+            continue
+        rounded = np.round(values, decimals)
+        output[key] = [None if np.isnan(v) else float(v) for v in rounded]
+    return output
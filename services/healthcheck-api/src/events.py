@@ -0,0 +1,81 @@
+"""In-memory broadcast hub for Server-Sent Events
+
+Events get increasing ids and are appended once to a bounded replay buffer.
+Subscribers do not have their own queues: they wait on a shared condition
+and read the buffer past the last id they saw, so publishing costs the same
+with one or hundreds of connected viewers, and a reconnecting client can
+resume from its `Last-Event-ID` as long as the buffer still holds it.
+"""
+import itertools
+import json
+import os
+import threading
+from collections import deque
+
+# Events kept for Last-Event-ID resume
+REPLAY_SIZE = int(os.environ.get('HEALTHCHECK_EVENT_REPLAY_SIZE', 1000))
+# Seconds between keep-alive comments on an idle stream
+KEEPALIVE_INTERVAL = float(os.environ.get('HEALTHCHECK_EVENT_KEEPALIVE', 15))
+
+
+class EventHub:
+    """Bounded buffer of published events plus a condition to wait on"""
+
+    def __init__(self, replay_size=REPLAY_SIZE):
+        self._events = deque(maxlen=replay_size)
+        self._last_id = 0
+        self._condition = threading.Condition()
+
+    @property
+    def last_id(self):
+        with self._condition:
+            return self._last_id
+
+    def publish(self, event_type, data):
+        """Append an event and wake every waiting subscriber"""
+        with self._condition:
+            self._last_id += 1
+            event = {'id': self._last_id, 'event': event_type, 'data': data}
+            self._events.append(event)
+            self._condition.notify_all()
+        return event
+
+    def _since(self, last_id):
+        if last_id > self._last_id:
+            # Id from before a restart: the client has to start over
+            return [], False
+        if not self._events:
+            return [], True
+        oldest = self._events[0]['id']
+        if last_id + 1 < oldest:
+            return list(self._events), False
+        return list(itertools.islice(self._events, last_id + 1 - oldest, None)), True
+
+    def since(self, last_id):
+        """Events after `last_id`, and whether none were evicted in between"""
+        with self._condition:
+            return self._since(last_id)
+
+    def wait(self, last_id, timeout=KEEPALIVE_INTERVAL):
+        """Like since(), but block up to `timeout` seconds for new events"""
+        with self._condition:
+            events, complete = self._since(last_id)
+            if events or not complete:
+                return events, complete
+            self._condition.wait(timeout)
+            return self._since(last_id)
+
+    def clear(self):
+        with self._condition:
+            self._events.clear()
+            self._last_id = 0
+
+
+def format_event(event):
+    """Serialize an event in the text/event-stream format"""
+    lines = []
+    if event.get('id') is not None:
+        lines.append(f'id: {event["id"]}')
+    lines.append(f'event: {event["event"]}')
+    lines.append(f'data: {json.dumps(event["data"], separators=(",", ":"))}')
+    return '\n'.join(lines) + '\n\n'
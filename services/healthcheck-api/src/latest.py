@@ -0,0 +1,140 @@
+"""In-memory table of the latest check result of every project
+
+Besides the latest result, each entry keeps what the Prometheus exporter
+needs (project labels, consecutive failures and a cumulative latency
+histogram), so a scrape never touches the database. The histogram only
+counts probes run by this process; it is not exported while the latest
+result comes from another process (sharded workers).
+"""
+import threading
+
+from src.compact_storage import fetch_latest_compact
+from src.probe import PHASES
+
+# Upper bounds (seconds) of the probe latency histogram buckets
+LATENCY_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+def _new_entry():
+    return {
+        'name': None,
+        'url': None,
+        'result': None,
+        'consecutive_failures': 0,
+        'probed_here': False,
+        'buckets': [0] * len(LATENCY_BUCKETS),
+        'latency_count': 0,
+        'latency_sum': 0.0
+    }
+
+
+class LatestResults:
+    """Latest probe result and probe metrics per project"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = {}
+
+    def set_target(self, project_id, name, url):
+        """Set the labels (name, url) of a project
+
+        Results and metrics of a previous URL are discarded.
+        """
+        with self._lock:
+            entry = self._entries.get(project_id)
+            if entry is None or (entry['url'] is not None and entry['url'] != url):
+                entry = self._entries[project_id] = _new_entry()
+            entry['name'], entry['url'] = name, url
+
+    def remove(self, project_id):
+        with self._lock:
+            self._entries.pop(project_id, None)
+
+    def has_target(self, project_id):
+        with self._lock:
+            entry = self._entries.get(project_id)
+            return bool(entry) and entry['name'] is not None
+
+    def update(self, project_id, result, checked_at):
+        with self._lock:
+            entry = self._entries.setdefault(project_id, _new_entry())
+            entry['result'] = {**result, 'checked_at': checked_at}
+            entry['probed_here'] = True
+            if result['status'] == 'online':
+                entry['consecutive_failures'] = 0
+            else:
+                entry['consecutive_failures'] += 1
+
+            latency = result.get('response_time')
+            if latency is not None:
+                entry['latency_count'] += 1
+                entry['latency_sum'] += latency
+                for i, bound in enumerate(LATENCY_BUCKETS):
+                    if latency <= bound:
+                        entry['buckets'][i] += 1
+
+    def get(self, project_id):
+        """Copy of the latest result (with its epoch `checked_at`), or None"""
+        with self._lock:
+            entry = self._entries.get(project_id)
+            return dict(entry['result']) if entry and entry['result'] else None
+
+    def snapshot(self):
+        """Copy of every entry, by project id"""
+        with self._lock:
+            return {
+                project_id: {**entry, 'buckets': list(entry['buckets'])}
+                for project_id, entry in self._entries.items()
+            }
+
+    def load(self, cursor, compact=False):
+        """Seed labels and latest results from the database (startup)
+
+        Results recorded by other processes (sharded workers) only show up
+        through this; their consecutive failures are taken from the probe
+        state (fast failures of an open circuit are not counted there).
+        With `compact`, results are read from the run tables.
+        """
+        cursor.execute('SELECT id, name, url FROM projects')
+        projects = cursor.fetchall()
+        cursor.execute('SELECT project_id, last_status, stable_count FROM probe_state')
+        failures = {
+            project_id: stable_count if last_status not in (None, 'online') else 0
+            for project_id, last_status, stable_count in cursor.fetchall()
+        }
+        if compact:
+            rows = fetch_latest_compact(cursor)
+        else:
+            cursor.execute(f'''
+                SELECT h.project_id, h.status, h.response_time, h.status_code, h.error_message,
+                       CAST(strftime('%s', h.checked_at) AS REAL), {', '.join(f'h.{phase}_time' for phase in PHASES)}
+                FROM health_checks h
+                JOIN (SELECT project_id, MAX(id) AS id FROM health_checks GROUP BY project_id) latest
+                  ON latest.id = h.id
+            ''')
+            rows = cursor.fetchall()
+
+        with self._lock:
+            for project_id, name, url in projects:
+                entry = self._entries.setdefault(project_id, _new_entry())
+                entry['name'], entry['url'] = name, url
+            for row in rows:
+                entry = self._entries.setdefault(row[0], _new_entry())
+                current = entry['result']
+                if current and current['checked_at'] >= row[5]:
+                    continue
+                timings = dict(zip(PHASES, row[6:]))
+                entry['result'] = {
+                    'status': row[1],
+                    'response_time': row[2],
+                    'status_code': row[3],
+                    'error_message': row[4],
+                    'timings': timings if any(t is not None for t in timings.values()) else None,
+                    'checked_at': row[5]
+                }
+                entry['consecutive_failures'] = failures.get(row[0], 0 if row[1] == 'online' else 1)
+                entry['probed_here'] = False
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
@@ -1,10 +1,35 @@
-from flask import Flask, jsonify, request
+import atexit
+import os
+import sys
+sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
+
+from flask import Flask, Response, jsonify, request, stream_with_context
 from flask_cors import CORS
-import requests
+import http.client
+import socket
+import threading
 import time
-from datetime import datetime
-import sqlite3
-import os
+from datetime import datetime, timezone
+from src import db
+from src.db import ensure_column
+from src.compact_storage import (
+    create_compact_tables, fetch_compact_history, flush_pending_checks, prune_compact, record_compact
+)
+from src.events import EventHub, format_event
+from src.latest import LatestResults
+from src.metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, render_metrics
+from src.probe import PHASES, certificate_cache, empty_timings, timed_get
+from src.downsample import downsample, series_from_raw, series_from_rollups, to_json_lists
+from src.rollups import (
+    GLOBAL_SKETCH_SCOPE, choose_resolution, create_rollup_tables, fetch_batch_buckets, fetch_rollups,
+    from_sql_timestamp, load_lifetime_sketch, maybe_prune, parse_window, project_scope, record_rollups,
+    retention_seconds, rollup_row_to_dict, slot_resolution, to_sql_timestamp, window_summary
+)
+from src.scheduler import ProbeScheduler, create_probe_state_table, guarded_probe, update_probe_state
+from src.sharding import WORKER_TTL, ShardedScheduler, create_lease_tables
+from src.singleflight import SingleFlight
+from src.sync import BackendSync, create_sync_tables, get_state
+from src.uptime import DEFAULT_SLO_TARGET, all_projects_uptime, project_uptime, window_counts
 
 app = Flask(__name__)
 CORS(app, origins="*")  # Allow all origins for development
@@ -12,9 +37,51 @@ CORS(app, origins="*")  # Allow all origins for development
 # Database setup
 DATABASE = 'src/database/app.db'
 
+DEBUG = True
+PORT = int(os.environ.get('HEALTHCHECK_PORT', 5000))
+
+# 'rows' stores one health_checks row per probe, 'compact' stores
+# run-length encoded state changes plus periodic latency samples
+STORAGE_MODE = os.environ.get('HEALTHCHECK_STORAGE_MODE', 'rows')
+
+# Upper bound for the `points` argument of downsampled history
+MAX_HISTORY_POINTS = int(os.environ.get('HEALTHCHECK_MAX_HISTORY_POINTS', 2000))
+
+# Upper bound for the number of projects in one batch history call
+MAX_BATCH_PROJECTS = int(os.environ.get('HEALTHCHECK_MAX_BATCH_PROJECTS', 500))
+
+# Background adaptive probing (set to 0 to only check on demand)
+SCHEDULER_ENABLED = os.environ.get('HEALTHCHECK_SCHEDULER_ENABLED', '1') == '1'
+
+# Split scheduled probing with other checker workers (src/worker.py)
+# through shard leases instead of probing every target
+SHARDED = os.environ.get('HEALTHCHECK_SHARDED', '0') == '1'
+
+# On-demand checks return the latest result if it is younger than this
+# many seconds (unless `?force=true`)
+CHECK_FRESHNESS = float(os.environ.get('HEALTHCHECK_CHECK_FRESHNESS', 10))
+
+# With sharded workers, how often (seconds) the latest results table is
+# reloaded from the database for /metrics
+LATEST_REFRESH_INTERVAL = float(os.environ.get('HEALTHCHECK_LATEST_REFRESH_INTERVAL', 15))
+
+# backend-api base URL (e.g. http://localhost:5000): when set, targets are
+# synced from its projects and statuses pushed back instead of using the
+# built-in sample projects
+BACKEND_API_URL = os.environ.get('BACKEND_API_URL')
+
+# Latest result per project and the in-flight on-demand checks
+latest_results = LatestResults()
+check_flight = SingleFlight()
+
+# Broadcast hub behind /api/events
+event_hub = EventHub()
+
+PHASE_TIME_COLUMNS = ', '.join(f'{phase}_time' for phase in PHASES)
+
 def init_db():
     """Initialize the database with required tables"""
-    conn = sqlite3.connect(DATABASE)
+    conn = db.connect(DATABASE)
     cursor = conn.cursor()
     
     # Create projects table
@@ -44,9 +111,30 @@ def init_db():
         )
     ''')
     
-    # Insert sample projects if table is empty
+    # Columns added after the initial schema
+    ensure_column(cursor, 'projects', 'slo_target', 'REAL')
+    for phase in PHASES:
+        ensure_column(cursor, 'health_checks', f'{phase}_time', 'REAL')
+    
+    # Create minute/hour/day rollup tables
+    create_rollup_tables(cursor)
+    
+    # Create adaptive cadence / circuit breaker state table
+    create_probe_state_table(cursor)
+    
+    # Create compact storage tables (runs, samples, error dictionary)
+    create_compact_tables(cursor)
+    
+    # Create checker worker heartbeat and shard lease tables
+    create_lease_tables(cursor)
+    
+    # Create backend sync columns and watermark table
+    create_sync_tables(cursor)
+    
+    # Insert sample projects if table is empty (targets come from the
+    # backend when it is configured)
     cursor.execute('SELECT COUNT(*) FROM projects')
-    if cursor.fetchone()[0] == 0:
+    if cursor.fetchone()[0] == 0 and not BACKEND_API_URL:
         sample_projects = [
             ('E-commerce Platform', 'https://demo-ecommerce.example.com'),
             ('AI Chat Assistant', 'https://chat-ai.example.com'),
@@ -65,48 +153,166 @@ def init_db():
     conn.close()
 
 def check_url_health(url):
-    """Check the health of a given URL"""
+    """Check the health of a given URL, timing each phase of the request
+    
+    HTTPS results carry the (cached) peer certificate summary.
+    """
+    timings = empty_timings()
+    peer = {'certificate': None}
     try:
-        start_time = time.time()
-        response = requests.get(url, timeout=10)
-        response_time = time.time() - start_time
+        start_time = time.perf_counter()
+        status_code = timed_get(url, timings, peer=peer)
+        response_time = time.perf_counter() - start_time
         
-        if response.status_code == 200:
+        if status_code == 200:
             return {
                 'status': 'online',
                 'response_time': response_time,
-                'status_code': response.status_code,
-                'error_message': None
+                'status_code': status_code,
+                'error_message': None,
+                'timings': timings,
+                'certificate': peer['certificate']
             }
         else:
             return {
                 'status': 'offline',
                 'response_time': response_time,
-                'status_code': response.status_code,
-                'error_message': f'HTTP {response.status_code}'
+                'status_code': status_code,
+                'error_message': f'HTTP {status_code}',
+                'timings': timings,
+                'certificate': peer['certificate']
             }
-    except requests.exceptions.Timeout:
+    except socket.timeout:
         return {
             'status': 'offline',
             'response_time': None,
             'status_code': None,
-            'error_message': 'Timeout'
+            'error_message': 'Timeout',
+            'timings': timings,
+            'certificate': peer['certificate']
         }
-    except requests.exceptions.ConnectionError:
+    except (OSError, http.client.HTTPException):
         return {
             'status': 'offline',
             'response_time': None,
             'status_code': None,
-            'error_message': 'Connection Error'
+            'error_message': 'Connection Error',
+            'timings': timings,
+            'certificate': peer['certificate']
         }
     except Exception as e:
         return {
             'status': 'offline',
             'response_time': None,
             'status_code': None,
-            'error_message': str(e)
+            'error_message': str(e),
+            'timings': timings,
+            'certificate': peer['certificate']
         }
 
+def record_check(cursor, project_id, health_result):
+    """Store a check result (project status, raw row, rollups) and broadcast it"""
+    now = time.time()
+    
+    # Previous status, to detect transitions
+    cursor.execute('SELECT status FROM projects WHERE id = ?', (project_id,))
+    previous = cursor.fetchone()
+    previous_status = previous[0] if previous else None
+    
+    # Phase timings only count in rollups for probes that got a response
+    timings = health_result.get('timings') or {}
+    rollup_timings = timings if health_result['response_time'] is not None else None
+    if STORAGE_MODE == 'compact':
+        # Runs, rollups and the project row are written at checkpoints
+        record_compact(cursor, project_id, health_result, now, rollup_timings, datetime.now().isoformat(),
+                       status_changed=previous_status != health_result['status'])
+    else:
+        # Update project status
+        cursor.execute('''
+            UPDATE projects 
+            SET status = ?, last_checked = ?, response_time = ?
+            WHERE id = ?
+        ''', (
+            health_result['status'],
+            datetime.now().isoformat(),
+            health_result['response_time'],
+            project_id
+        ))
+        
+        # Insert health check record
+        cursor.execute(f'''
+            INSERT INTO health_checks (project_id, status, response_time, status_code, error_message, checked_at,
+                                       {PHASE_TIME_COLUMNS})
+            VALUES (?, ?, ?, ?, ?, ?, {', '.join('?' for _ in PHASES)})
+        ''', (
+            project_id,
+            health_result['status'],
+            health_result['response_time'],
+            health_result['status_code'],
+            health_result['error_message'],
+            to_sql_timestamp(now),
+            *(timings.get(phase) for phase in PHASES)
+        ))
+        
+        # Maintain rollups incrementally
+        record_rollups(cursor, project_id, now, health_result['status'] == 'online', health_result['response_time'],
+                       rollup_timings)
+    
+    # Expire old rows
+    if maybe_prune(cursor, now) is not None and STORAGE_MODE == 'compact':
+        prune_compact(cursor, now - retention_seconds('raw'))
+    
+    # Fast-failed checks do not move the cadence or circuit state
+    if not health_result.get('circuit_open'):
+        update_probe_state(cursor, project_id, health_result, now)
+    
+    if not latest_results.has_target(project_id):
+        cursor.execute('SELECT name, url FROM projects WHERE id = ?', (project_id,))
+        project = cursor.fetchone()
+        if project:
+            latest_results.set_target(project_id, *project)
+    latest_results.update(project_id, health_result, now)
+    
+    publish_check_events(project_id, health_result, previous_status, now)
+
+def publish_check_events(project_id, health_result, previous_status, now):
+    """Broadcast a check completion, and a transition if the status changed"""
+    checked_at = to_sql_timestamp(now)
+    event_hub.publish('check', {
+        'project_id': project_id,
+        'status': health_result['status'],
+        'response_time': health_result['response_time'],
+        'status_code': health_result['status_code'],
+        'error_message': health_result['error_message'],
+        'checked_at': checked_at
+    })
+    if previous_status != health_result['status']:
+        event_hub.publish('transition', {
+            'project_id': project_id,
+            'from': previous_status,
+            'to': health_result['status'],
+            'error_message': health_result['error_message'],
+            'checked_at': checked_at
+        })
+
+def parse_time_arg(value):
+    """Parse an epoch-seconds or ISO 8601 query argument (naive = UTC)"""
+    if value is None:
+        return None
+    try:
+        ts = float(value)
+    except ValueError:
+        parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+        if parsed.tzinfo is None:
+            parsed = parsed.replace(tzinfo=timezone.utc)
+        return parsed.timestamp()
+    # nan/inf and out of range epochs cannot be turned into SQL timestamps
+    try:
+        datetime.fromtimestamp(ts, timezone.utc)
+    except (OverflowError, OSError, ValueError):
+        raise ValueError(f'Timestamp out of range: {value}')
+    return ts
+
 @app.route('/api/health', methods=['GET'])
 def api_health():
     """API health endpoint"""
@@ -118,8 +324,8 @@ def api_health():
 
 @app.route('/metrics', methods=['GET'])
 def metrics():
-    """API metrics endpoint"""
-    return jsonify({})
+    """Prometheus metrics of every project, from the in-memory latest results"""
+    return Response(render_metrics(latest_results.snapshot(), time.time()), content_type=METRICS_CONTENT_TYPE)
 
 @app.route('/health', methods=['GET'])
 def health():
@@ -130,15 +336,57 @@ def health():
         'service': 'healthcheck-api'
     }), 200
 
+@app.route('/api/events', methods=['GET'])
+def stream_events():
+    """Server-Sent Events stream of check completions and status transitions
+    
+    Resumes after the `Last-Event-ID` header (or `last_event_id` argument)
+    from the replay buffer; a `reset` event tells the client that events
+    were missed and it should reload its state. `project_id` and `types`
+    (comma-separated) filter the stream.
+    """
+    last_id = request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+    project_id = request.args.get('project_id', type=int)
+    types = set(request.args['types'].split(',')) if request.args.get('types') else None
+    try:
+        last_id = int(last_id) if last_id else event_hub.last_id
+    except ValueError:
+        return jsonify({'error': 'Invalid Last-Event-ID'}), 400
+    
+    def generate(last_id):
+        yield 'retry: 3000\n\n'
+        while True:
+            events, complete = event_hub.wait(last_id)
+            if not complete:
+                yield format_event({'event': 'reset', 'data': {'last_event_id': event_hub.last_id}})
+                if not events:
+                    last_id = event_hub.last_id
+            if not events and complete:
+                yield ': keepalive\n\n'
+            for event in events:
+                last_id = event['id']
+                if types is not None and event['event'] not in types:
+                    continue
+                if project_id is not None and event['data'].get('project_id') != project_id:
+                    continue
+                yield format_event(event)
+    
+    return Response(stream_with_context(generate(last_id)), content_type='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+
 @app.route('/api/projects', methods=['GET'])
 def get_projects():
     """Get all projects with their current status"""
-    conn = sqlite3.connect(DATABASE)
+    conn = db.connect(DATABASE)
     cursor = conn.cursor()
     
     cursor.execute('''
-        SELECT p.id, p.name, p.url, p.status, p.last_checked, p.response_time
+        SELECT p.id, p.name, p.url, p.status, p.last_checked, p.response_time,
+               s.next_check_at, s.circuit_state
         FROM projects p
+        LEFT JOIN probe_state s ON s.project_id = p.id
         ORDER BY p.name
     ''')
     
@@ -150,7 +398,9 @@ def get_projects():
             'url': row[2],
             'status': row[3],
             'last_checked': row[4],
-            'response_time': row[5]
+            'response_time': row[5],
+            'next_check_at': to_sql_timestamp(row[6]) if row[6] else None,
+            'circuit_state': row[7] or 'closed'
         })
     
     conn.close()
@@ -158,8 +408,33 @@ def get_projects():
 
 @app.route('/api/projects/<int:project_id>/check', methods=['POST'])
 def check_project(project_id):
-    """Check the health of a specific project"""
-    conn = sqlite3.connect(DATABASE)
+    """Check the health of a specific project
+    
+    Concurrent checks of the same project share one probe, and a result
+    younger than CHECK_FRESHNESS seconds is returned as is unless
+    `force=true` is given.
+    """
+    force = request.args.get('force', 'false').lower() in ('1', 'true', 'yes')
+    
+    if not force:
+        latest = latest_results.get(project_id)
+        if latest and time.time() - latest['checked_at'] < CHECK_FRESHNESS:
+            conn = db.connect(DATABASE)
+            cursor = conn.cursor()
+            cursor.execute('SELECT url FROM projects WHERE id = ?', (project_id,))
+            result = cursor.fetchone()
+            conn.close()
+            if result:
+                return jsonify(_check_response(project_id, result[0], latest, latest['checked_at'], cached=True))
+    
+    response, shared = check_flight.do(project_id, lambda: _run_check(project_id))
+    if response is None:
+        return jsonify({'error': 'Project not found'}), 404
+    return jsonify({**response, 'coalesced': shared})
+
+def _run_check(project_id):
+    """Probe a project and record the result; None if it does not exist"""
+    conn = db.connect(DATABASE)
     cursor = conn.cursor()
     
     # Get project URL
@@ -168,51 +443,33 @@ def check_project(project_id):
     
     if not result:
         conn.close()
-        return jsonify({'error': 'Project not found'}), 404
+        return None
     
     url = result[0]
     
-    # Perform health check
-    health_result = check_url_health(url)
+    # Perform health check (fast-fails while the target's circuit is open)
+    health_result = guarded_probe(cursor, project_id, url, check_url_health)
     
-    # Update project status
-    cursor.execute('''
-        UPDATE projects 
-        SET status = ?, last_checked = ?, response_time = ?
-        WHERE id = ?
-    ''', (
-        health_result['status'],
-        datetime.now().isoformat(),
-        health_result['response_time'],
-        project_id
-    ))
-    
-    # Insert health check record
-    cursor.execute('''
-        INSERT INTO health_checks (project_id, status, response_time, status_code, error_message)
-        VALUES (?, ?, ?, ?, ?)
-    ''', (
-        project_id,
-        health_result['status'],
-        health_result['response_time'],
-        health_result['status_code'],
-        health_result['error_message']
-    ))
+    record_check(cursor, project_id, health_result)
     
     conn.commit()
     conn.close()
     
-    return jsonify({
+    return _check_response(project_id, url, health_result, time.time())
+
+def _check_response(project_id, url, result, checked_at, cached=False):
+    return {
         'project_id': project_id,
         'url': url,
-        **health_result,
-        'checked_at': datetime.now().isoformat()
-    })
+        **result,
+        'checked_at': datetime.fromtimestamp(checked_at).isoformat(),
+        'cached': cached
+    }
 
 @app.route('/api/projects/check-all', methods=['POST'])
 def check_all_projects():
     """Check the health of all projects"""
-    conn = sqlite3.connect(DATABASE)
+    conn = db.connect(DATABASE)
     cursor = conn.cursor()
     
     # Get all projects
@@ -224,32 +481,12 @@ def check_all_projects():
     for project in projects:
         project_id, name, url = project
         
-        # Perform health check
-        health_result = check_url_health(url)
-        
-        # Update project status
-        cursor.execute('''
-            UPDATE projects 
-            SET status = ?, last_checked = ?, response_time = ?
-            WHERE id = ?
-        ''', (
-            health_result['status'],
-            datetime.now().isoformat(),
-            health_result['response_time'],
-            project_id
-        ))
+        # Perform health check (fast-fails while the target's circuit is open)
+        health_result = guarded_probe(cursor, project_id, url, check_url_health)
         
-        # Insert health check record
-        cursor.execute('''
-            INSERT INTO health_checks (project_id, status, response_time, status_code, error_message)
-            VALUES (?, ?, ?, ?, ?)
-        ''', (
-            project_id,
-            health_result['status'],
-            health_result['response_time'],
-            health_result['status_code'],
-            health_result['error_message']
-        ))
+        # Commit per project so the write lock is not held across probes
+        record_check(cursor, project_id, health_result)
+        conn.commit()
         
         results.append({
             'project_id': project_id,
@@ -269,37 +506,363 @@ def check_all_projects():
 
 @app.route('/api/projects/<int:project_id>/history', methods=['GET'])
 def get_project_history(project_id):
-    """Get health check history for a specific project"""
+    """Get health check history for a specific project
+    
+    Without `from`/`to` the last `limit` raw checks are returned. With a time
+    range, the raw rows or the minute/hour/day rollups are used depending on
+    the span (override with `resolution=raw|minute|hour|day`). With `points`,
+    the range is downsampled on the server into that many buckets.
+    """
     limit = request.args.get('limit', 50, type=int)
+    points = request.args.get('points', type=int)
+    mode = request.args.get('mode', 'minmax')
+    if points is not None and not 1 <= points <= MAX_HISTORY_POINTS:
+        return jsonify({'error': f'`points` must be between 1 and {MAX_HISTORY_POINTS}'}), 400
     
-    conn = sqlite3.connect(DATABASE)
+    try:
+        start = parse_time_arg(request.args.get('from'))
+        end = parse_time_arg(request.args.get('to'))
+    except ValueError:
+        return jsonify({'error': 'Invalid from/to timestamp'}), 400
+    
+    conn = db.connect(DATABASE)
     cursor = conn.cursor()
     
-    cursor.execute('''
-        SELECT status, response_time, status_code, error_message, checked_at
-        FROM health_checks
-        WHERE project_id = ?
-        ORDER BY checked_at DESC
-        LIMIT ?
-    ''', (project_id, limit))
-    
-    history = []
-    for row in cursor.fetchall():
-        history.append({
-            'status': row[0],
-            'response_time': row[1],
-            'status_code': row[2],
-            'error_message': row[3],
-            'checked_at': row[4]
+    if start is None and end is None and points is None:
+        history = [_history_row_to_dict(row) for row in fetch_raw_history(cursor, project_id, limit=limit)]
+        conn.close()
+        return jsonify(history)
+    
+    now = time.time()
+    end = now if end is None else end
+    start = end - 86400 if start is None else start
+    if start > end:
+        conn.close()
+        return jsonify({'error': '`from` must be before `to`'}), 400
+    
+    resolution = request.args.get('resolution') or choose_resolution(start, end, now)
+    if points is not None:
+        if resolution == 'raw':
+            series = series_from_raw([
+                (from_sql_timestamp(row[4]), row[0] == 'online', row[1])
+                for row in fetch_raw_history(cursor, project_id, start, end)
+            ])
+        elif resolution in ('minute', 'hour', 'day'):
+            series = series_from_rollups(fetch_rollups(cursor, resolution, project_id, start, end))
+        else:
+            conn.close()
+            return jsonify({'error': f'Unknown resolution {resolution}'}), 400
+        conn.close()
+        
+        try:
+            buckets = downsample(series, start, end, points, mode)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        return jsonify({
+            'project_id': project_id,
+            'resolution': resolution,
+            'mode': mode,
+            'from': to_sql_timestamp(start),
+            'to': to_sql_timestamp(end),
+            'bucket_seconds': (end - start) / points,
+            'series': to_json_lists(buckets)
         })
     
+    if resolution == 'raw':
+        points = [_history_row_to_dict(row) for row in fetch_raw_history(cursor, project_id, start, end)]
+    elif resolution in ('minute', 'hour', 'day'):
+        points = [
+            rollup_row_to_dict(resolution, row)
+            for row in fetch_rollups(cursor, resolution, project_id, start, end)
+        ]
+    else:
+        conn.close()
+        return jsonify({'error': f'Unknown resolution {resolution}'}), 400
+    
+    conn.close()
+    return jsonify({
+        'project_id': project_id,
+        'resolution': resolution,
+        'from': to_sql_timestamp(start),
+        'to': to_sql_timestamp(end),
+        'points': points
+    })
+
+def fetch_raw_history(cursor, project_id, start=None, end=None, limit=None):
+    """Per-check history rows (status, response_time, status_code, error_message, checked_at,
+    then the phase timings; compact storage takes them from latency samples)
+    
+    With `limit`, the newest rows come first; with a time range, oldest first.
+    """
+    if STORAGE_MODE == 'compact':
+        return fetch_compact_history(cursor, project_id, start, end, limit)
+    
+    if limit is not None:
+        cursor.execute(f'''
+            SELECT status, response_time, status_code, error_message, checked_at, {PHASE_TIME_COLUMNS}
+            FROM health_checks
+            WHERE project_id = ?
+            ORDER BY checked_at DESC
+            LIMIT ?
+        ''', (project_id, limit))
+    else:
+        cursor.execute(f'''
+            SELECT status, response_time, status_code, error_message, checked_at, {PHASE_TIME_COLUMNS}
+            FROM health_checks
+            WHERE project_id = ? AND checked_at >= ? AND checked_at <= ?
+            ORDER BY checked_at
+        ''', (project_id, to_sql_timestamp(start), to_sql_timestamp(end)))
+    return cursor.fetchall()
+
+def _history_row_to_dict(row):
+    timings = row[5:]
+    return {
+        'status': row[0],
+        'response_time': row[1],
+        'status_code': row[2],
+        'error_message': row[3],
+        'checked_at': row[4],
+        'timings': dict(zip(PHASES, timings)) if any(t is not None for t in timings) else None
+    }
+
+@app.route('/api/history/batch', methods=['GET'])
+def get_history_batch():
+    """Get bucketed sparkline series for many projects in one call
+    
+    `ids` is a comma-separated list of project ids (all projects if omitted),
+    `window` the look-back (default 24h) and `points` the number of buckets.
+    """
+    window_arg = request.args.get('window', '24h')
+    points = request.args.get('points', 48, type=int)
+    ids_arg = request.args.get('ids')
+    
+    try:
+        window = parse_window(window_arg)
+        project_ids = [int(i) for i in ids_arg.split(',') if i.strip()] if ids_arg else None
+    except ValueError:
+        return jsonify({'error': 'Invalid ids or window'}), 400
+    if not 1 <= points <= MAX_HISTORY_POINTS:
+        return jsonify({'error': f'`points` must be between 1 and {MAX_HISTORY_POINTS}'}), 400
+    if project_ids is not None and len(project_ids) > MAX_BATCH_PROJECTS:
+        return jsonify({'error': f'At most {MAX_BATCH_PROJECTS} ids per call'}), 400
+    
+    end = time.time()
+    start = end - window
+    resolution = slot_resolution(window, points)
+    
+    conn = db.connect(DATABASE)
+    cursor = conn.cursor()
+    
+    if project_ids is None:
+        cursor.execute('SELECT id FROM projects ORDER BY id')
+        project_ids = [row[0] for row in cursor.fetchall()]
+    rows = fetch_batch_buckets(cursor, resolution, project_ids, start, end, points)
+    conn.close()
+    
+    series = {
+        project_id: {'latency': [None] * points, 'up_ratio': [None] * points}
+        for project_id in project_ids
+    }
+    for project_id, slot, check_count, up_count, latency_count, latency_sum in rows:
+        project_series = series[project_id]
+        project_series['up_ratio'][slot] = round(up_count / check_count, 4) if check_count else None
+        project_series['latency'][slot] = round(latency_sum / latency_count, 4) if latency_count else None
+    
+    return jsonify({
+        'window': window_arg,
+        'points': points,
+        'resolution': resolution,
+        'start': int(start),
+        'bucket_seconds': window / points,
+        'projects': {str(project_id): values for project_id, values in series.items()}
+    })
+
+def latency_stats(cursor, scope, window_arg, project_id=None):
+    """Latency percentiles from the lifetime sketch or merged window rollups"""
+    if window_arg is None:
+        sketch = load_lifetime_sketch(cursor, scope)
+        return {
+            'window': None,
+            'count': sketch.count,
+            'average_response_time': sketch.sum / sketch.count if sketch.count else None,
+            'min_response_time': sketch.min,
+            'max_response_time': sketch.max,
+            **sketch.quantiles()
+        }
+    
+    summary = window_summary(cursor, parse_window(window_arg), project_id)
+    return {
+        'window': window_arg,
+        'count': summary['latency_count'],
+        'average_response_time': summary['avg_response_time'],
+        'min_response_time': summary['min_response_time'],
+        'max_response_time': summary['max_response_time'],
+        **summary['sketch'].quantiles()
+    }
+
+def timing_stats(cursor, window_arg, project_id=None):
+    """Average phase timings over a window (24h by default)"""
+    window_arg = window_arg or '24h'
+    summary = window_summary(cursor, parse_window(window_arg), project_id)
+    return {
+        'window': window_arg,
+        'count': summary['timing_count'],
+        **(summary['timings'] or dict.fromkeys(PHASES))
+    }
+
+@app.route('/api/projects/<int:project_id>/stats', methods=['GET'])
+def get_project_stats(project_id):
+    """Get latency percentiles for a specific project"""
+    window_arg = request.args.get('window')
+    
+    conn = db.connect(DATABASE)
+    cursor = conn.cursor()
+    
+    cursor.execute('SELECT id FROM projects WHERE id = ?', (project_id,))
+    if not cursor.fetchone():
+        conn.close()
+        return jsonify({'error': 'Project not found'}), 404
+    
+    try:
+        latency = latency_stats(cursor, project_scope(project_id), window_arg, project_id)
+        timings = timing_stats(cursor, window_arg, project_id)
+    except ValueError as e:
+        conn.close()
+        return jsonify({'error': str(e)}), 400
+    
+    conn.close()
+    return jsonify({
+        'project_id': project_id,
+        'latency': latency,
+        'timings': timings
+    })
+
+@app.route('/api/projects/<int:project_id>/uptime', methods=['GET'])
+def get_project_uptime(project_id):
+    """Get uptime and SLO burn of a project over 1h/24h/7d/30d"""
+    conn = db.connect(DATABASE)
+    cursor = conn.cursor()
+    
+    cursor.execute('SELECT name, slo_target FROM projects WHERE id = ?', (project_id,))
+    result = cursor.fetchone()
+    if not result:
+        conn.close()
+        return jsonify({'error': 'Project not found'}), 404
+    
+    name, slo_target = result
+    slo_target = slo_target if slo_target is not None else DEFAULT_SLO_TARGET
+    windows = project_uptime(cursor, project_id, slo_target)
+    conn.close()
+    
+    return jsonify({
+        'project_id': project_id,
+        'name': name,
+        'slo_target': slo_target,
+        'windows': windows
+    })
+
+@app.route('/api/uptime', methods=['GET'])
+def get_uptime():
+    """Get uptime and SLO burn of every project over 1h/24h/7d/30d"""
+    conn = db.connect(DATABASE)
+    cursor = conn.cursor()
+    
+    cursor.execute('SELECT id, name, slo_target FROM projects ORDER BY name')
+    projects, overall = all_projects_uptime(cursor, cursor.fetchall())
+    conn.close()
+    
+    return jsonify({
+        'overall': overall,
+        'projects': projects
+    })
+
+def certificate_to_dict(certificate, now):
+    """API view of a certificate summary with its remaining validity"""
+    not_after = certificate['not_after']
+    return {
+        **certificate,
+        'not_before': to_sql_timestamp(certificate['not_before']) if certificate['not_before'] else None,
+        'not_after': to_sql_timestamp(not_after) if not_after else None,
+        'inspected_at': to_sql_timestamp(certificate['inspected_at']),
+        'days_remaining': round((not_after - now) / 86400, 2) if not_after else None
+    }
+
+@app.route('/api/projects/<int:project_id>/certificate', methods=['GET'])
+def get_project_certificate(project_id):
+    """TLS certificate seen by the latest probe of a project"""
+    latest = latest_results.get(project_id)
+    if not latest or not latest.get('certificate'):
+        return jsonify({'error': 'No certificate recorded for this project'}), 404
+    return jsonify({
+        'project_id': project_id,
+        **certificate_to_dict(latest['certificate'], time.time())
+    })
+
+@app.route('/api/certificates', methods=['GET'])
+def get_certificates():
+    """Every inspected certificate, soonest expiry first"""
+    now = time.time()
+    certificates = sorted(certificate_cache.snapshot(), key=lambda c: c['not_after'] or float('inf'))
+    return jsonify([certificate_to_dict(certificate, now) for certificate in certificates])
+
+@app.route('/api/workers', methods=['GET'])
+def get_workers():
+    """Checker workers with their heartbeat and number of held shard leases"""
+    conn = db.connect(DATABASE)
+    cursor = conn.cursor()
+    now = time.time()
+    
+    cursor.execute('''
+        SELECT w.worker_id, w.started_at, w.heartbeat_at,
+               (SELECT COUNT(*) FROM checker_leases l WHERE l.owner = w.worker_id AND l.expires_at > ?)
+        FROM checker_workers w
+        ORDER BY w.worker_id
+    ''', (now,))
+    workers = [{
+        'worker_id': row[0],
+        'started_at': to_sql_timestamp(row[1]),
+        'heartbeat_at': to_sql_timestamp(row[2]),
+        'alive': row[2] >= now - WORKER_TTL,
+        'shards': row[3]
+    } for row in cursor.fetchall()]
+    
+    cursor.execute('SELECT COUNT(*) FROM checker_leases WHERE owner IS NULL OR expires_at <= ?', (now,))
+    unassigned = cursor.fetchone()[0]
+    
     conn.close()
-    return jsonify(history)
+    return jsonify({'workers': workers, 'unassigned_shards': unassigned})
+
+@app.route('/api/sync', methods=['GET'])
+def get_sync_status():
+    """State of the backend-api sync (watermark, last pull, pending statuses)"""
+    conn = db.connect(DATABASE)
+    cursor = conn.cursor()
+    
+    watermark = get_state(cursor, 'watermark')
+    pulled_at = get_state(cursor, 'pulled_at')
+    full_sync_at = get_state(cursor, 'full_sync_at')
+    cursor.execute('SELECT COUNT(*) FROM projects WHERE external_id IS NOT NULL')
+    synced_targets = cursor.fetchone()[0]
+    cursor.execute('SELECT COUNT(*) FROM projects WHERE external_id IS NOT NULL AND status IS NOT synced_status')
+    pending = cursor.fetchone()[0]
+    
+    conn.close()
+    return jsonify({
+        'enabled': bool(BACKEND_API_URL),
+        'backend_url': BACKEND_API_URL,
+        'watermark': watermark,
+        'pulled_at': to_sql_timestamp(float(pulled_at)) if pulled_at else None,
+        'full_sync_at': to_sql_timestamp(float(full_sync_at)) if full_sync_at else None,
+        'synced_targets': synced_targets,
+        'pending_statuses': pending
+    })
 
 @app.route('/api/stats', methods=['GET'])
 def get_stats():
     """Get overall statistics"""
-    conn = sqlite3.connect(DATABASE)
+    window_arg = request.args.get('window')
+    
+    conn = db.connect(DATABASE)
     cursor = conn.cursor()
     
     # Count projects by status
@@ -321,19 +884,106 @@ def get_stats():
     cursor.execute('SELECT AVG(response_time) FROM projects WHERE response_time IS NOT NULL')
     avg_response_time = cursor.fetchone()[0]
     
+    # Real uptime over the last 24h, from the hourly rollups
+    counts = window_counts(cursor, '24h').values()
+    checks_24h = sum(c[0] for c in counts)
+    up_24h = sum(c[1] for c in counts)
+    
+    # Latency percentiles from the global sketch (no history scan)
+    try:
+        latency = latency_stats(cursor, GLOBAL_SKETCH_SCOPE, window_arg)
+        timings = timing_stats(cursor, window_arg)
+    except ValueError as e:
+        conn.close()
+        return jsonify({'error': str(e)}), 400
+    
     conn.close()
     
     return jsonify({
         'total_projects': total_projects,
         'status_counts': status_counts,
         'average_response_time': avg_response_time,
-        'uptime_percentage': (status_counts.get('online', 0) / total_projects * 100) if total_projects > 0 else 0
+        'latency': latency,
+        'timings': timings,
+        'online_percentage': (status_counts.get('online', 0) / total_projects * 100) if total_projects > 0 else 0,
+        'uptime_percentage': (up_24h / checks_24h * 100) if checks_24h > 0 else None
     })
 
+@atexit.register
+def flush_compact_storage():
+    """Persist the pending checks of compact storage on shutdown"""
+    if STORAGE_MODE != 'compact':
+        return
+    conn = db.connect(DATABASE)
+    flush_pending_checks(conn.cursor())
+    conn.commit()
+    conn.close()
+
+def load_latest_results():
+    """Seed the in-memory latest results table from the database"""
+    conn = db.connect(DATABASE)
+    latest_results.load(conn.cursor(), compact=STORAGE_MODE == 'compact')
+    conn.close()
+
+def start_latest_results_refresher():
+    """Periodically reload latest results recorded by other worker processes"""
+    def refresh():
+        while True:
+            time.sleep(LATEST_REFRESH_INTERVAL)
+            try:
+                load_latest_results()
+            except Exception:
+                app.logger.exception('Reloading latest results failed')
+    
+    threading.Thread(target=refresh, name='latest-results-refresher', daemon=True).start()
+
+def hand_off_compact_runs(acquired, released):
+    """Write pending checks before shards change hands, so that their new owner sees them"""
+    if STORAGE_MODE != 'compact':
+        return
+    conn = db.connect(DATABASE)
+    flush_pending_checks(conn.cursor())
+    conn.commit()
+    conn.close()
+
+def apply_target_changes(changed, removed):
+    """Keep the latest results labels in line with synced targets"""
+    for project_id, name, url in changed:
+        latest_results.set_target(project_id, name, url)
+    for project_id in removed:
+        latest_results.remove(project_id)
+
+def start_backend_sync():
+    """Start syncing targets and statuses with backend-api"""
+    sync = BackendSync(DATABASE, BACKEND_API_URL, on_targets_changed=apply_target_changes)
+    sync.start()
+    return sync
+
+def start_scheduler(sharded=None, worker_id=None):
+    """Start the background adaptive probe scheduler"""
+    if SHARDED if sharded is None else sharded:
+        scheduler = ShardedScheduler(DATABASE, check_url_health, record_check, worker_id=worker_id,
+                                     on_rebalance=hand_off_compact_runs)
+    else:
+        scheduler = ProbeScheduler(DATABASE, check_url_health, record_check)
+    scheduler.start()
+    return scheduler
+
 if __name__ == '__main__':
     # Initialize database
     init_db()
+    load_latest_results()
+    if SHARDED:
+        start_latest_results_refresher()
+    
+    # With the reloader, only the child process serving requests probes
+    # and syncs
+    serving = not DEBUG or os.environ.get('WERKZEUG_RUN_MAIN') == 'true'
+    if BACKEND_API_URL and serving:
+        start_backend_sync()
+    if SCHEDULER_ENABLED and serving:
+        start_scheduler()
     
     # Run the app
-    app.run(host='0.0.0.0', port=5000, debug=True)
+    app.run(host='0.0.0.0', port=PORT, debug=DEBUG)
 
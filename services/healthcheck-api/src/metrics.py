@@ -0,0 +1,86 @@
+"""Prometheus text exposition of per-project probe results
+
+Metric names follow the blackbox exporter (`probe_success`,
+`probe_duration_seconds`, `probe_http_duration_seconds{phase=...}`, ...) so
+dashboards and alert rules written for it also work here. Every series has
+`project_id`, `project` and `target` labels.
+"""
+from src.latest import LATENCY_BUCKETS
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Our phase names -> blackbox exporter phase names
+PHASE_LABELS = {
+    'dns': 'resolve',
+    'connect': 'connect',
+    'tls': 'tls',
+    'ttfb': 'processing',
+    'transfer': 'transfer',
+}
+
+GAUGES = (
+    ('probe_success', 'Whether the last probe of the project succeeded'),
+    ('probe_duration_seconds', 'Duration of the last probe'),
+    ('probe_http_status_code', 'HTTP status code of the last probe (0 without a response)'),
+    ('probe_http_duration_seconds', 'Duration of each phase of the last probe'),
+    ('probe_consecutive_failures', 'Failed probes since the last successful one'),
+    ('probe_last_check_timestamp_seconds', 'Time of the last probe'),
+    ('probe_check_age_seconds', 'Seconds since the last probe'),
+    ('probe_ssl_earliest_cert_expiry', 'Expiry time of the peer certificate of the last HTTPS probe'),
+)
+
+HISTOGRAM = ('healthcheck_probe_duration_seconds', 'Probe durations seen by this process')
+
+
+def escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def format_value(value):
+    if value is None:
+        return 'NaN'
+    return repr(float(value))
+
+
+def render_metrics(entries, now):
+    """Render the LatestResults snapshot `entries` as Prometheus text"""
+    samples = {name: [] for name, _ in GAUGES}
+    histogram = []
+
+    for project_id, entry in sorted(entries.items()):
+        labels = (f'project_id="{project_id}",project="{escape_label(entry["name"] or "")}",'
+                  f'target="{escape_label(entry["url"] or "")}"')
+        result = entry['result']
+        if result is not None:
+            samples['probe_success'].append((labels, 1 if result['status'] == 'online' else 0))
+            samples['probe_duration_seconds'].append((labels, result['response_time']))
+            samples['probe_http_status_code'].append((labels, result['status_code'] or 0))
+            timings = result.get('timings') or {}
+            for phase, label in PHASE_LABELS.items():
+                if timings.get(phase) is not None:
+                    samples['probe_http_duration_seconds'].append(
+                        (f'{labels},phase="{label}"', timings[phase])
+                    )
+            samples['probe_consecutive_failures'].append((labels, entry['consecutive_failures']))
+            samples['probe_last_check_timestamp_seconds'].append((labels, result['checked_at']))
+            samples['probe_check_age_seconds'].append((labels, max(now - result['checked_at'], 0)))
+            certificate = result.get('certificate')
+            if certificate and certificate.get('not_after'):
+                samples['probe_ssl_earliest_cert_expiry'].append((labels, certificate['not_after']))
+
+        if entry['probed_here'] and entry['latency_count']:
+            for bound, count in zip(LATENCY_BUCKETS, entry['buckets']):
+                histogram.append(f'{HISTOGRAM[0]}_bucket{{{labels},le="{bound}"}} {count}')
+            histogram.append(f'{HISTOGRAM[0]}_bucket{{{labels},le="+Inf"}} {entry["latency_count"]}')
+            histogram.append(f'{HISTOGRAM[0]}_sum{{{labels}}} {format_value(entry["latency_sum"])}')
+            histogram.append(f'{HISTOGRAM[0]}_count{{{labels}}} {entry["latency_count"]}')
+
+    lines = []
+    for name, help_text in GAUGES:
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} gauge')
+        lines.extend(f'{name}{{{labels}}} {format_value(value)}' for labels, value in samples[name])
+    lines.append(f'# HELP {HISTOGRAM[0]} {HISTOGRAM[1]}')
+    lines.append(f'# TYPE {HISTOGRAM[0]} histogram')
+    lines.extend(histogram)
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,186 @@
+"""HTTP probe with a per-phase timing breakdown
+
+The request is made with socket/ssl/http.client directly so every phase can
+be timed separately: name resolution, TCP connect, TLS handshake, time to
+first byte (request sent until the response headers arrived) and transfer of
+the body. Redirects are followed and the phases of every hop are summed.
+Unlike `requests`, proxy variables are ignored, certificates are checked
+against the system store rather than certifi, and no Accept-Encoding is sent.
+
+The peer certificate of TLS hops (expiry, issuer, SAN) is inspected at most
+once per CERT_CHECK_INTERVAL per host:port and kept in `certificate_cache`.
+"""
+import http.client
+import os
+import socket
+import ssl
+import threading
+import time
+from urllib.parse import urljoin, urlsplit
+
+PHASES = ('dns', 'connect', 'tls', 'ttfb', 'transfer')
+
+# Per-operation socket timeout (seconds)
+PROBE_TIMEOUT = float(os.environ.get('HEALTHCHECK_PROBE_TIMEOUT', 10))
+MAX_REDIRECTS = int(os.environ.get('HEALTHCHECK_MAX_REDIRECTS', 10))
+USER_AGENT = 'healthcheck-api'
+
+# Extra CA bundle (PEM file) trusted in addition to the system store
+CA_BUNDLE = os.environ.get('HEALTHCHECK_CA_BUNDLE')
+# Seconds between two inspections of the certificate of a host:port
+CERT_CHECK_INTERVAL = float(os.environ.get('HEALTHCHECK_CERT_CHECK_INTERVAL', 3600))
+
+REDIRECT_STATUSES = (301, 302, 303, 307, 308)
+
+
+class TooManyRedirects(Exception):
+    pass
+
+
+def _name_fields(name):
+    return {key: value for rdn in name for key, value in rdn}
+
+
+def parse_certificate(cert):
+    """Summary of a decoded peer certificate (ssl getpeercert() dict)"""
+    issuer = _name_fields(cert.get('issuer', ()))
+    return {
+        'subject': _name_fields(cert.get('subject', ())).get('commonName'),
+        'issuer': issuer.get('commonName') or issuer.get('organizationName'),
+        'issuer_organization': issuer.get('organizationName'),
+        'san': [value for _, value in cert.get('subjectAltName', ())],
+        'serial_number': cert.get('serialNumber'),
+        'not_before': ssl.cert_time_to_seconds(cert['notBefore']) if 'notBefore' in cert else None,
+        'not_after': ssl.cert_time_to_seconds(cert['notAfter']) if 'notAfter' in cert else None,
+    }
+
+
+class CertificateCache:
+    """Last inspected certificate per (host, port)"""
+
+    def __init__(self, interval=CERT_CHECK_INTERVAL):
+        self.interval = interval
+        self.inspections = 0
+        self._lock = threading.Lock()
+        self._entries = {}
+
+    def inspect(self, host, port, sock, now=None):
+        """Return the certificate of `sock`, re-reading it once per interval"""
+        now = time.time() if now is None else now
+        with self._lock:
+            entry = self._entries.get((host, port))
+            if entry and now - entry['inspected_at'] < self.interval:
+                return dict(entry)
+        cert = sock.getpeercert()
+        if not cert:
+            return None
+        entry = {'host': host, 'port': port, **parse_certificate(cert), 'inspected_at': now}
+        with self._lock:
+            self._entries[(host, port)] = entry
+            self.inspections += 1
+        return dict(entry)
+
+    def snapshot(self):
+        with self._lock:
+            return [dict(entry) for entry in self._entries.values()]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.inspections = 0
+
+
+certificate_cache = CertificateCache()
+
+_contexts = {}
+
+
+def default_ssl_context():
+    """Verifying client context, trusting CA_BUNDLE too (built once)"""
+    context = _contexts.get(CA_BUNDLE)
+    if context is None:
+        context = ssl.create_default_context()
+        if CA_BUNDLE:
+            context.load_verify_locations(cafile=CA_BUNDLE)
+        _contexts[CA_BUNDLE] = context
+    return context
+
+
+def empty_timings():
+    """Phase timings before any phase ran (tls stays None for plain HTTP)"""
+    return {'dns': 0.0, 'connect': 0.0, 'tls': None, 'ttfb': 0.0, 'transfer': 0.0}
+
+
+def _connect(host, port, timeout, timings):
+    started = time.perf_counter()
+    addresses = socket.getaddrinfo(host, port, type=socket.SOCK_STREAM)
+    resolved = time.perf_counter()
+    timings['dns'] += resolved - started
+
+    error = None
+    for family, sock_type, proto, _, address in addresses:
+        sock = socket.socket(family, sock_type, proto)
+        sock.settimeout(timeout)
+        try:
+            sock.connect(address)
+        except OSError as e:
+            sock.close()
+            error = e
+            continue
+        timings['connect'] += time.perf_counter() - resolved
+        return sock
+    raise error or OSError(f'No address for {host}')
+
+
+def _fetch(url, timeout, ssl_context, timings, peer):
+    """One request without following redirects; returns (status, location)"""
+    parts = urlsplit(url)
+    https = parts.scheme == 'https'
+    if parts.scheme not in ('http', 'https') or not parts.hostname:
+        raise ValueError(f'Unsupported URL {url!r}')
+    port = parts.port or (443 if https else 80)
+
+    sock = _connect(parts.hostname, port, timeout, timings)
+    try:
+        if https:
+            handshake_started = time.perf_counter()
+            context = ssl_context or default_ssl_context()
+            sock = context.wrap_socket(sock, server_hostname=parts.hostname)
+            timings['tls'] = (timings['tls'] or 0.0) + time.perf_counter() - handshake_started
+            if peer is not None:
+                peer['certificate'] = certificate_cache.inspect(parts.hostname, port, sock)
+            conn = http.client.HTTPSConnection(parts.hostname, port, timeout=timeout, context=context)
+        else:
+            conn = http.client.HTTPConnection(parts.hostname, port, timeout=timeout)
+        # Reuse the socket set up above instead of letting http.client connect
+        conn.sock = sock
+
+        path = parts.path or '/'
+        if parts.query:
+            path += '?' + parts.query
+        sent = time.perf_counter()
+        conn.request('GET', path, headers={'User-Agent': USER_AGENT, 'Accept': '*/*', 'Connection': 'close'})
+        response = conn.getresponse()
+        first_byte = time.perf_counter()
+        timings['ttfb'] += first_byte - sent
+        response.read()
+        timings['transfer'] += time.perf_counter() - first_byte
+        return response.status, response.getheader('Location')
+    finally:
+        sock.close()
+
+
+def timed_get(url, timings, timeout=PROBE_TIMEOUT, max_redirects=MAX_REDIRECTS, ssl_context=None, peer=None):
+    """GET `url`, following redirects, and return the final status code
+
+    Phase durations (seconds) are accumulated into `timings` as they
+    complete, so a failed probe still reports the phases it got through.
+    If a `peer` dict is given, it receives the certificate of the last TLS
+    hop under 'certificate'.
+    """
+    for _ in range(max_redirects + 1):
+        status, location = _fetch(url, timeout, ssl_context, timings, peer)
+        if status not in REDIRECT_STATUSES or not location:
+            return status
+        url = urljoin(url, location)
+    raise TooManyRedirects(f'Exceeded {max_redirects} redirects')
@@ -0,0 +1,394 @@
+"""Minute/hour/day rollups of health checks and retention of raw rows"""
+import os
+import time
+from datetime import datetime, timezone
+
+from src.db import ensure_column
+from src.probe import PHASES
+from src.sketch import DDSketch, merge_serialized
+
+# Rollup resolutions: name -> (table, bucket width in seconds)
+RESOLUTIONS = {
+    'minute': ('health_check_rollups_minute', 60),
+    'hour': ('health_check_rollups_hour', 3600),
+    'day': ('health_check_rollups_day', 86400),
+}
+
+# Retention per resolution, in days
+RETENTION_DAYS = {
+    'raw': int(os.environ.get('HEALTHCHECK_RAW_RETENTION_DAYS', 7)),
+    'minute': int(os.environ.get('HEALTHCHECK_MINUTE_RETENTION_DAYS', 30)),
+    'hour': int(os.environ.get('HEALTHCHECK_HOUR_RETENTION_DAYS', 365)),
+    'day': int(os.environ.get('HEALTHCHECK_DAY_RETENTION_DAYS', 1825)),
+}
+
+# Raw rows are only served for spans up to this many seconds
+RAW_MAX_SPAN = int(os.environ.get('HEALTHCHECK_RAW_MAX_SPAN', 6 * 3600))
+
+# A resolution is picked only if the range fits in this many buckets
+MAX_HISTORY_BUCKETS = int(os.environ.get('HEALTHCHECK_MAX_HISTORY_BUCKETS', 1440))
+
+# Per-phase timing sums, averaged over `timing_count`
+PHASE_COLUMNS = tuple(f'{phase}_sum' for phase in PHASES)
+
+# Suffixes accepted by parse_window
+WINDOW_UNITS = {'m': 60, 'h': 3600, 'd': 86400}
+
+GLOBAL_SKETCH_SCOPE = 'global'
+
+# How often (seconds) expired rows are pruned as checks land
+PRUNE_INTERVAL = int(os.environ.get('HEALTHCHECK_PRUNE_INTERVAL', 3600))
+
+_last_prune = 0.0
+
+
+def retention_seconds(resolution):
+    """Retention of a resolution ('raw', 'minute', 'hour', 'day') in seconds"""
+    return RETENTION_DAYS[resolution] * 86400
+
+
+def to_sql_timestamp(ts):
+    """Format an epoch timestamp like SQLite's CURRENT_TIMESTAMP (UTC)"""
+    return datetime.fromtimestamp(ts, timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+
+
+def from_sql_timestamp(value):
+    """Parse a CURRENT_TIMESTAMP-style UTC string back to epoch seconds"""
+    return datetime.strptime(value[:19], '%Y-%m-%d %H:%M:%S').replace(tzinfo=timezone.utc).timestamp()
+
+
+def create_rollup_tables(cursor):
+    """Create the rollup tables and the indexes used by history/retention"""
+    for table, _ in RESOLUTIONS.values():
+        cursor.execute(f'''
+            CREATE TABLE IF NOT EXISTS {table} (
+                project_id INTEGER NOT NULL,
+                bucket_start INTEGER NOT NULL,
+                check_count INTEGER NOT NULL DEFAULT 0,
+                up_count INTEGER NOT NULL DEFAULT 0,
+                latency_count INTEGER NOT NULL DEFAULT 0,
+                latency_sum REAL NOT NULL DEFAULT 0,
+                latency_min REAL,
+                latency_max REAL,
+                latency_sketch BLOB,
+                PRIMARY KEY (project_id, bucket_start)
+            ) WITHOUT ROWID
+        ''')
+        cursor.execute(f'CREATE INDEX IF NOT EXISTS idx_{table}_bucket ON {table} (bucket_start)')
+        ensure_column(cursor, table, 'timing_count', 'INTEGER NOT NULL DEFAULT 0')
+        for column in PHASE_COLUMNS:
+            ensure_column(cursor, table, column, 'REAL NOT NULL DEFAULT 0')
+
+    # Lifetime latency sketches, one per project plus a global one
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS latency_sketches (
+            scope TEXT PRIMARY KEY,
+            sketch BLOB NOT NULL,
+            updated_at INTEGER NOT NULL
+        )
+    ''')
+
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_health_checks_project_checked
+        ON health_checks (project_id, checked_at)
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_health_checks_checked ON health_checks (checked_at)')
+
+
+class RollupBucket:
+    """Checks of one rollup bucket not written to the database yet"""
+
+    def __init__(self):
+        self.check_count = 0
+        self.up_count = 0
+        # Latency count, sum, min and max come with the sketch
+        self.latency = DDSketch()
+        self.timing_count = 0
+        self.phase_sums = [0.0] * len(PHASES)
+
+    def add(self, is_up, latency, timings=None):
+        self.check_count += 1
+        self.up_count += 1 if is_up else 0
+        self.latency.add(latency)
+        if timings:
+            self.timing_count += 1
+            self.phase_sums = [total + (timings.get(phase) or 0.0) for total, phase in zip(self.phase_sums, PHASES)]
+
+    def merge(self, other):
+        self.check_count += other.check_count
+        self.up_count += other.up_count
+        self.latency.merge(other.latency)
+        self.timing_count += other.timing_count
+        self.phase_sums = [total + other_total for total, other_total in zip(self.phase_sums, other.phase_sums)]
+        return self
+
+
+def add_to_buckets(buckets, ts, is_up, latency, timings=None):
+    """Fold one check result into {(resolution, bucket_start): RollupBucket}"""
+    for resolution, (_, width) in RESOLUTIONS.items():
+        key = (resolution, int(ts // width * width))
+        bucket = buckets.get(key)
+        if bucket is None:
+            bucket = buckets[key] = RollupBucket()
+        bucket.add(is_up, latency, timings)
+
+
+def write_rollups(cursor, project_id, buckets):
+    """Add {(resolution, bucket_start): RollupBucket} to the stored rollup buckets"""
+    for (resolution, bucket_start), bucket in buckets.items():
+        table = RESOLUTIONS[resolution][0]
+        cursor.execute(f'''
+            SELECT check_count, up_count, latency_count, latency_sum, latency_min, latency_max, latency_sketch,
+                   timing_count, {', '.join(PHASE_COLUMNS)}
+            FROM {table}
+            WHERE project_id = ? AND bucket_start = ?
+        ''', (project_id, bucket_start))
+        row = cursor.fetchone() or (0, 0, 0, 0.0, None, None, None, 0) + (0.0,) * len(PHASES)
+        check_count, up_count, latency_count, latency_sum, latency_min, latency_max, blob, timing_count = row[:8]
+
+        check_count += bucket.check_count
+        up_count += bucket.up_count
+        latency = bucket.latency
+        if latency.count:
+            blob = DDSketch.from_bytes(blob).merge(latency).to_bytes()
+            latency_count += latency.count
+            latency_sum += latency.sum
+            latency_min = latency.min if latency_min is None else min(latency_min, latency.min)
+            latency_max = latency.max if latency_max is None else max(latency_max, latency.max)
+        timing_count += bucket.timing_count
+        phase_sums = [total + added for total, added in zip(row[8:], bucket.phase_sums)]
+
+        cursor.execute(f'''
+            INSERT OR REPLACE INTO {table}
+                (project_id, bucket_start, check_count, up_count, latency_count,
+                 latency_sum, latency_min, latency_max, latency_sketch,
+                 timing_count, {', '.join(PHASE_COLUMNS)})
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, {', '.join('?' for _ in PHASES)})
+        ''', (project_id, bucket_start, check_count, up_count, latency_count,
+              latency_sum, latency_min, latency_max, blob, timing_count, *phase_sums))
+
+
+def record_rollups(cursor, project_id, ts, is_up, latency, timings=None):
+    """Fold one check result into the rollup buckets and lifetime sketches
+
+    `timings` is the phase breakdown of a probe that got a response.
+    """
+    buckets = {}
+    add_to_buckets(buckets, ts, is_up, latency, timings)
+    write_rollups(cursor, project_id, buckets)
+
+    if latency is not None:
+        for scope in (project_scope(project_id), GLOBAL_SKETCH_SCOPE):
+            update_lifetime_sketch(cursor, scope, latency, ts)
+
+
+def phase_averages(timing_count, phase_sums):
+    """Average duration of each phase, or None without timed probes"""
+    if not timing_count:
+        return None
+    return {phase: total / timing_count for phase, total in zip(PHASES, phase_sums)}
+
+
+def project_scope(project_id):
+    return f'project:{project_id}'
+
+
+def update_lifetime_sketch(cursor, scope, latency, ts):
+    """Add one latency observation to a stored lifetime sketch"""
+    sketch = DDSketch()
+    sketch.add(latency)
+    merge_lifetime_sketch(cursor, scope, sketch, ts)
+
+
+def merge_lifetime_sketch(cursor, scope, sketch, ts):
+    """Merge a sketch of several latency observations into a stored lifetime sketch"""
+    stored = load_lifetime_sketch(cursor, scope).merge(sketch)
+    cursor.execute(
+        'INSERT OR REPLACE INTO latency_sketches (scope, sketch, updated_at) VALUES (?, ?, ?)',
+        (scope, stored.to_bytes(), int(ts))
+    )
+
+
+def load_lifetime_sketch(cursor, scope):
+    """Load the lifetime sketch of a scope ('global' or 'project:<id>')"""
+    cursor.execute('SELECT sketch FROM latency_sketches WHERE scope = ?', (scope,))
+    row = cursor.fetchone()
+    return DDSketch.from_bytes(row[0] if row else None)
+
+
+def delete_project_history(cursor, project_ids):
+    """Delete the raw rows, rollup buckets and lifetime sketch of projects
+
+    Their latencies stay in the global sketch, which cannot be split.
+    """
+    params = [(project_id,) for project_id in project_ids]
+    cursor.executemany('DELETE FROM health_checks WHERE project_id = ?', params)
+    for table, _ in RESOLUTIONS.values():
+        cursor.executemany(f'DELETE FROM {table} WHERE project_id = ?', params)
+    cursor.executemany('DELETE FROM latency_sketches WHERE scope = ?',
+                       [(project_scope(project_id),) for project_id in project_ids])
+
+
+def prune_expired(cursor, now=None):
+    """Delete raw rows and rollup buckets older than their retention"""
+    now = time.time() if now is None else now
+    deleted = {}
+
+    cursor.execute('DELETE FROM health_checks WHERE checked_at < ?',
+                   (to_sql_timestamp(now - retention_seconds('raw')),))
+    deleted['raw'] = cursor.rowcount
+
+    for resolution, (table, _) in RESOLUTIONS.items():
+        cursor.execute(f'DELETE FROM {table} WHERE bucket_start < ?',
+                       (int(now - retention_seconds(resolution)),))
+        deleted[resolution] = cursor.rowcount
+    return deleted
+
+
+def maybe_prune(cursor, now=None):
+    """Prune expired rows at most once per PRUNE_INTERVAL"""
+    global _last_prune
+    now = time.time() if now is None else now
+    if now - _last_prune < PRUNE_INTERVAL:
+        return None
+    _last_prune = now
+    return prune_expired(cursor, now)
+
+
+def choose_resolution(start, end, now=None):
+    """Pick the finest resolution that still holds `start` and fits the range"""
+    now = time.time() if now is None else now
+    span = max(end - start, 0)
+
+    if span <= RAW_MAX_SPAN and start >= now - retention_seconds('raw'):
+        return 'raw'
+    for resolution, (_, width) in RESOLUTIONS.items():
+        if start >= now - retention_seconds(resolution) and span / width <= MAX_HISTORY_BUCKETS:
+            return resolution
+    return 'day'
+
+
+def parse_window(value):
+    """Parse a window such as '90m', '24h' or '7d' into seconds"""
+    value = (value or '').strip().lower()
+    if len(value) < 2 or value[-1] not in WINDOW_UNITS or not value[:-1].isdigit():
+        raise ValueError(f'Invalid window {value!r}')
+    return int(value[:-1]) * WINDOW_UNITS[value[-1]]
+
+
+def window_resolution(window):
+    """Finest rollup resolution that covers `window` seconds in few buckets"""
+    for resolution, (_, width) in RESOLUTIONS.items():
+        if window / width <= MAX_HISTORY_BUCKETS and window <= retention_seconds(resolution):
+            return resolution
+    return 'day'
+
+
+def window_summary(cursor, window, project_id=None, now=None):
+    """Merge rollups of the last `window` seconds (one project or all)
+
+    Returns counts, latency min/avg/max, the merged latency sketch and the
+    average phase timings.
+    """
+    now = time.time() if now is None else now
+    resolution = window_resolution(window)
+    table, width = RESOLUTIONS[resolution]
+    start = int((now - window) // width * width)
+
+    query = f'''
+        SELECT check_count, up_count, latency_count, latency_sum, latency_min, latency_max, latency_sketch,
+               timing_count, {', '.join(PHASE_COLUMNS)}
+        FROM {table}
+        WHERE bucket_start >= ?
+    '''
+    params = [start]
+    if project_id is not None:
+        query += ' AND project_id = ?'
+        params.append(project_id)
+    cursor.execute(query, params)
+    rows = cursor.fetchall()
+
+    latency_count = sum(row[2] for row in rows)
+    minimums = [row[4] for row in rows if row[4] is not None]
+    maximums = [row[5] for row in rows if row[5] is not None]
+    return {
+        'resolution': resolution,
+        'check_count': sum(row[0] for row in rows),
+        'up_count': sum(row[1] for row in rows),
+        'latency_count': latency_count,
+        'avg_response_time': sum(row[3] for row in rows) / latency_count if latency_count else None,
+        'min_response_time': min(minimums) if minimums else None,
+        'max_response_time': max(maximums) if maximums else None,
+        'sketch': merge_serialized(row[6] for row in rows),
+        'timing_count': sum(row[7] for row in rows),
+        'timings': phase_averages(
+            sum(row[7] for row in rows),
+            [sum(row[8 + i] for row in rows) for i in range(len(PHASES))]
+        ),
+    }
+
+
+def slot_resolution(window, points):
+    """Coarsest rollup resolution whose buckets still fit in one of `points` slots"""
+    chosen = 'minute'
+    for resolution, (_, width) in RESOLUTIONS.items():
+        if width <= window / points and window <= retention_seconds(resolution):
+            chosen = resolution
+    return chosen
+
+
+def fetch_batch_buckets(cursor, resolution, project_ids, start, end, points):
+    """Bucket the rollups of many projects into `points` slots in one query
+
+    Returns rows of (project_id, slot, check_count, up_count, latency_count,
+    latency_sum) for the slots that have data. `project_ids` of None means
+    every project.
+    """
+    table, width = RESOLUTIONS[resolution]
+    slot_width = max(end - start, 1) / points
+    query = f'''
+        SELECT project_id,
+               MAX(MIN(CAST((bucket_start - ?) / ? AS INTEGER), ?), 0) AS slot,
+               SUM(check_count), SUM(up_count), SUM(latency_count), SUM(latency_sum)
+        FROM {table}
+        WHERE bucket_start >= ? AND bucket_start <= ?
+    '''
+    params = [start, slot_width, points - 1, int(start // width * width), int(end)]
+    if project_ids is not None:
+        query += f' AND project_id IN ({", ".join("?" for _ in project_ids)})'
+        params.extend(project_ids)
+    query += ' GROUP BY project_id, slot ORDER BY project_id, slot'
+    cursor.execute(query, params)
+    return cursor.fetchall()
+
+
+def rollup_row_to_dict(resolution, row):
+    """Convert a rollup row (bucket_start, counts, latencies, sketch, phase sums) to API output"""
+    bucket_start, check_count, up_count, latency_count, latency_sum, latency_min, latency_max, blob = row[:8]
+    sketch = DDSketch.from_bytes(blob)
+    return {
+        'bucket_start': to_sql_timestamp(bucket_start),
+        'resolution': resolution,
+        'check_count': check_count,
+        'up_count': up_count,
+        'uptime_percentage': up_count / check_count * 100 if check_count else None,
+        'min_response_time': latency_min,
+        'avg_response_time': latency_sum / latency_count if latency_count else None,
+        'max_response_time': latency_max,
+        **sketch.quantiles(),
+        'timings': phase_averages(row[8], row[9:])
+    }
+
+
+def fetch_rollups(cursor, resolution, project_id, start, end):
+    """Return rollup rows of a project for buckets overlapping [start, end]"""
+    table, width = RESOLUTIONS[resolution]
+    cursor.execute(f'''
+        SELECT bucket_start, check_count, up_count, latency_count, latency_sum,
+               latency_min, latency_max, latency_sketch, timing_count, {', '.join(PHASE_COLUMNS)}
+        FROM {table}
+        WHERE project_id = ? AND bucket_start > ? AND bucket_start <= ?
+        ORDER BY bucket_start
+    ''', (project_id, int(start) - width, int(end)))
+    return cursor.fetchall()
+
@@ -0,0 +1,259 @@
+"""Adaptive probe cadence and per-target circuit breaker"""
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from src import db
+
+# Regular interval between probes (seconds)
+BASE_INTERVAL = float(os.environ.get('HEALTHCHECK_BASE_INTERVAL', 60))
+# Interval used right after a target changed state
+FAST_INTERVAL = float(os.environ.get('HEALTHCHECK_FAST_INTERVAL', 15))
+# Upper bound for stable-healthy targets
+MAX_INTERVAL = float(os.environ.get('HEALTHCHECK_MAX_INTERVAL', 600))
+# Fast probes after a transition before returning to the base interval
+FAST_CHECKS = int(os.environ.get('HEALTHCHECK_FAST_CHECKS', 3))
+# Consecutive healthy probes before the interval starts doubling
+BACKOFF_AFTER = int(os.environ.get('HEALTHCHECK_BACKOFF_AFTER', 5))
+
+# Consecutive connection failures that open the circuit
+CIRCUIT_THRESHOLD = int(os.environ.get('HEALTHCHECK_CIRCUIT_THRESHOLD', 3))
+# First half-open retry delay, doubled on every failed retry
+CIRCUIT_BASE_DELAY = float(os.environ.get('HEALTHCHECK_CIRCUIT_BASE_DELAY', 60))
+CIRCUIT_MAX_DELAY = float(os.environ.get('HEALTHCHECK_CIRCUIT_MAX_DELAY', 3600))
+
+SCHEDULER_TICK = float(os.environ.get('HEALTHCHECK_SCHEDULER_TICK', 1))
+SCHEDULER_CONCURRENCY = int(os.environ.get('HEALTHCHECK_SCHEDULER_CONCURRENCY', 8))
+
+CONNECTION_ERRORS = ('Timeout', 'Connection Error')
+CIRCUIT_OPEN_ERROR = 'Circuit open'
+
+logger = logging.getLogger(__name__)
+
+
+def create_probe_state_table(cursor):
+    """Create the table holding per-target cadence and circuit state"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS probe_state (
+            project_id INTEGER PRIMARY KEY,
+            next_check_at REAL NOT NULL,
+            interval REAL NOT NULL,
+            last_status TEXT,
+            stable_count INTEGER NOT NULL DEFAULT 0,
+            consecutive_failures INTEGER NOT NULL DEFAULT 0,
+            circuit_state TEXT NOT NULL DEFAULT 'closed',
+            circuit_open_count INTEGER NOT NULL DEFAULT 0,
+            last_transition_at REAL,
+            FOREIGN KEY (project_id) REFERENCES projects (id)
+        )
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_probe_state_next ON probe_state (next_check_at)')
+
+
+def load_state(cursor, project_id):
+    """Return the probe state of a project as a dict, or None"""
+    cursor.execute('''
+        SELECT next_check_at, interval, last_status, stable_count, consecutive_failures,
+               circuit_state, circuit_open_count, last_transition_at
+        FROM probe_state
+        WHERE project_id = ?
+    ''', (project_id,))
+    row = cursor.fetchone()
+    if not row:
+        return None
+    return {
+        'next_check_at': row[0],
+        'interval': row[1],
+        'last_status': row[2],
+        'stable_count': row[3],
+        'consecutive_failures': row[4],
+        'circuit_state': row[5],
+        'circuit_open_count': row[6],
+        'last_transition_at': row[7]
+    }
+
+
+def is_connection_failure(result):
+    return result['status_code'] is None and result['error_message'] in CONNECTION_ERRORS
+
+
+def circuit_blocks(state, now):
+    """True if the circuit is open and its half-open retry is not due yet"""
+    return bool(state) and state['circuit_state'] == 'open' and now < state['next_check_at']
+
+
+def circuit_open_result():
+    """Result returned instead of probing a target whose circuit is open"""
+    return {
+        'status': 'offline',
+        'response_time': None,
+        'status_code': None,
+        'error_message': CIRCUIT_OPEN_ERROR,
+        'circuit_open': True
+    }
+
+
+def next_state(state, result, now):
+    """Compute the new cadence/circuit state after a probe result"""
+    state = dict(state or {
+        'interval': BASE_INTERVAL,
+        'last_status': None,
+        'stable_count': 0,
+        'consecutive_failures': 0,
+        'circuit_state': 'closed',
+        'circuit_open_count': 0,
+        'last_transition_at': None
+    })
+
+    status = result['status']
+    if state['last_status'] is not None and status != state['last_status']:
+        state['stable_count'] = 1
+        state['last_transition_at'] = now
+    else:
+        state['stable_count'] += 1
+    state['last_status'] = status
+
+    if is_connection_failure(result):
+        state['consecutive_failures'] += 1
+    else:
+        state['consecutive_failures'] = 0
+
+    if state['consecutive_failures'] >= CIRCUIT_THRESHOLD:
+        # Open (or re-open after a failed half-open probe) with exponential delay
+        state['circuit_open_count'] += 1
+        state['circuit_state'] = 'open'
+        delay = min(CIRCUIT_BASE_DELAY * 2 ** (state['circuit_open_count'] - 1), CIRCUIT_MAX_DELAY)
+        state['interval'] = delay
+        state['next_check_at'] = now + delay
+        return state
+
+    state['circuit_state'] = 'closed'
+    state['circuit_open_count'] = 0
+
+    if state['last_transition_at'] is not None and state['stable_count'] <= FAST_CHECKS:
+        interval = FAST_INTERVAL
+    elif status == 'online' and state['stable_count'] > BACKOFF_AFTER:
+        interval = min(max(state['interval'], BASE_INTERVAL) * 2, MAX_INTERVAL)
+    else:
+        interval = BASE_INTERVAL
+
+    state['interval'] = interval
+    state['next_check_at'] = now + interval
+    return state
+
+
+def update_probe_state(cursor, project_id, result, now=None):
+    """Fold a probe result into the stored cadence/circuit state"""
+    now = time.time() if now is None else now
+    state = next_state(load_state(cursor, project_id), result, now)
+    cursor.execute('''
+        INSERT OR REPLACE INTO probe_state
+            (project_id, next_check_at, interval, last_status, stable_count, consecutive_failures,
+             circuit_state, circuit_open_count, last_transition_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ''', (
+        project_id,
+        state['next_check_at'],
+        state['interval'],
+        state['last_status'],
+        state['stable_count'],
+        state['consecutive_failures'],
+        state['circuit_state'],
+        state['circuit_open_count'],
+        state['last_transition_at']
+    ))
+    return state
+
+
+def guarded_probe(cursor, project_id, url, probe, now=None):
+    """Probe a target unless its circuit is open
+
+    When the circuit is open but its retry delay has elapsed, the probe runs
+    as the half-open attempt: success closes the circuit, failure re-opens
+    it with a doubled delay.
+    """
+    now = time.time() if now is None else now
+    if circuit_blocks(load_state(cursor, project_id), now):
+        return circuit_open_result()
+    return probe(url)
+
+
+def due_projects(cursor, now, limit, shard_filter=None):
+    """Projects whose next probe is due, most overdue first
+
+    `shard_filter` is an optional (sql, params) condition on `p.id`
+    restricting the selection to the shards held by this worker.
+    """
+    query = '''
+        SELECT p.id, p.url
+        FROM projects p
+        LEFT JOIN probe_state s ON s.project_id = p.id
+        WHERE (s.next_check_at IS NULL OR s.next_check_at <= ?)
+    '''
+    params = [now]
+    if shard_filter is not None:
+        query += f' AND {shard_filter[0]}'
+        params.extend(shard_filter[1])
+    query += ' ORDER BY COALESCE(s.next_check_at, 0) LIMIT ?'
+    params.append(limit)
+    cursor.execute(query, params)
+    return cursor.fetchall()
+
+
+class ProbeScheduler(threading.Thread):
+    """Background thread probing targets when their adaptive deadline is due
+
+    `probe(url)` performs a check and `record(cursor, project_id, result)`
+    stores it (including the probe state update).
+    """
+
+    def __init__(self, database, probe, record, tick=SCHEDULER_TICK, concurrency=SCHEDULER_CONCURRENCY):
+        super().__init__(name='probe-scheduler', daemon=True)
+        self.database = database
+        self.probe = probe
+        self.record = record
+        self.tick = tick
+        self.concurrency = concurrency
+        self._stop_event = threading.Event()
+        self._executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='probe')
+
+    def stop(self):
+        self._stop_event.set()
+
+    def run(self):
+        while not self._stop_event.is_set():
+            try:
+                self.run_once()
+            except Exception:
+                logger.exception('Probe scheduler iteration failed')
+            self._stop_event.wait(self.tick)
+        self._executor.shutdown(wait=True)
+
+    def run_once(self, now=None):
+        """Probe every due target once; returns the number of probes run"""
+        now = time.time() if now is None else now
+        conn = db.connect(self.database)
+        cursor = conn.cursor()
+        due = self.due(cursor, now)
+        conn.close()
+
+        futures = [self._executor.submit(self._check, project_id, url) for project_id, url in due]
+        for future in futures:
+            future.result()
+        return len(futures)
+
+    def due(self, cursor, now):
+        """Targets to probe in this iteration"""
+        return due_projects(cursor, now, self.concurrency * 4)
+
+    def _check(self, project_id, url):
+        conn = db.connect(self.database)
+        cursor = conn.cursor()
+        try:
+            result = guarded_probe(cursor, project_id, url, self.probe)
+            self.record(cursor, project_id, result)
+            conn.commit()
+        finally:
+            conn.close()
@@ -0,0 +1,293 @@
+"""Sharded probing across several checker workers
+
+Projects are hashed into a fixed number of shards, and shards are spread
+over the live workers with a consistent hash ring, so a worker joining or
+leaving only moves its share of the shards. A worker only probes the
+projects of shards it holds a time-bounded lease on in `checker_leases`:
+
+- every worker heartbeats in `checker_workers`; workers whose heartbeat is
+  older than WORKER_TTL drop out of the ring;
+- leases are acquired and renewed with a single conditional UPDATE (free,
+  expired or already ours), so two workers can never hold the same shard;
+- a shard that moved to another worker is drained (no new probes) and
+  released once its in-flight probes finished;
+- a dead worker's leases expire after LEASE_TTL and are picked up by the new
+  ring owners;
+- a probe only starts when the lease still has PROBE_MARGIN seconds left,
+  and its result is only recorded if the lease is still held.
+
+Lease times are wall clock seconds, so workers on separate nodes need
+synchronized clocks.
+"""
+import bisect
+import hashlib
+import logging
+import os
+import socket
+import threading
+import time
+from collections import Counter
+
+from src import db
+from src.scheduler import SCHEDULER_CONCURRENCY, SCHEDULER_TICK, ProbeScheduler, due_projects, guarded_probe
+
+# Number of shards projects are hashed into (must be the same on all workers)
+NUM_SHARDS = int(os.environ.get('HEALTHCHECK_SHARDS', 64))
+# Virtual nodes per worker on the hash ring
+VIRTUAL_NODES = int(os.environ.get('HEALTHCHECK_VIRTUAL_NODES', 64))
+# Lease duration, renewed every LEASE_TTL / 3 seconds
+LEASE_TTL = float(os.environ.get('HEALTHCHECK_LEASE_TTL', 30))
+# Heartbeat age after which a worker is considered dead
+WORKER_TTL = float(os.environ.get('HEALTHCHECK_WORKER_TTL', 15))
+# Minimum lease time left to start a probe (longer than the probe timeout)
+PROBE_MARGIN = float(os.environ.get('HEALTHCHECK_LEASE_PROBE_MARGIN', 15))
+
+logger = logging.getLogger(__name__)
+
+# Knuth's multiplicative hash, also usable in SQL on p.id
+_HASH_MULTIPLIER = 2654435761
+
+
+def shard_of(project_id, num_shards=NUM_SHARDS):
+    """Shard a project belongs to"""
+    return (project_id * _HASH_MULTIPLIER) % 4294967296 % num_shards
+
+
+def shard_filter(shards, num_shards=NUM_SHARDS):
+    """SQL condition on `p.id` selecting the projects of `shards`"""
+    shards = sorted(shards)
+    placeholders = ', '.join('?' for _ in shards)
+    return (f'((p.id * {_HASH_MULTIPLIER}) % 4294967296 % ?) IN ({placeholders})', [num_shards, *shards])
+
+
+def default_worker_id():
+    return f'{socket.gethostname()}-{os.getpid()}'
+
+
+def _ring_point(key):
+    return int.from_bytes(hashlib.md5(key.encode()).digest()[:8], 'big')
+
+
+class HashRing:
+    """Consistent hash ring with virtual nodes"""
+
+    def __init__(self, workers, virtual_nodes=VIRTUAL_NODES):
+        points = sorted(
+            (_ring_point(f'{worker}#{i}'), worker)
+            for worker in workers
+            for i in range(virtual_nodes)
+        )
+        self._points = [point for point, _ in points]
+        self._workers = [worker for _, worker in points]
+
+    def owner(self, key):
+        """Worker owning `key`: first virtual node clockwise of its hash"""
+        if not self._points:
+            return None
+        index = bisect.bisect(self._points, _ring_point(str(key))) % len(self._points)
+        return self._workers[index]
+
+    def assignment(self, num_shards=NUM_SHARDS):
+        return {shard: self.owner(f'shard:{shard}') for shard in range(num_shards)}
+
+
+def create_lease_tables(cursor, num_shards=NUM_SHARDS):
+    """Create the worker heartbeat and shard lease tables"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS checker_workers (
+            worker_id TEXT PRIMARY KEY,
+            started_at REAL NOT NULL,
+            heartbeat_at REAL NOT NULL
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS checker_leases (
+            shard INTEGER PRIMARY KEY,
+            owner TEXT,
+            expires_at REAL NOT NULL DEFAULT 0
+        )
+    ''')
+    cursor.executemany(
+        'INSERT OR IGNORE INTO checker_leases (shard) VALUES (?)',
+        [(shard,) for shard in range(num_shards)]
+    )
+
+
+def live_workers(cursor, now, worker_ttl=WORKER_TTL):
+    cursor.execute('SELECT worker_id FROM checker_workers WHERE heartbeat_at >= ? ORDER BY worker_id',
+                   (now - worker_ttl,))
+    return [row[0] for row in cursor.fetchall()]
+
+
+def lease_held(cursor, shard, worker_id, now):
+    cursor.execute('SELECT owner, expires_at FROM checker_leases WHERE shard = ?', (shard,))
+    row = cursor.fetchone()
+    return bool(row) and row[0] == worker_id and row[1] > now
+
+
+class ShardLeases:
+    """Lease bookkeeping of one worker"""
+
+    def __init__(self, database, worker_id, num_shards=NUM_SHARDS, lease_ttl=LEASE_TTL,
+                 worker_ttl=WORKER_TTL, probe_margin=PROBE_MARGIN):
+        self.database = database
+        self.worker_id = worker_id
+        self.num_shards = num_shards
+        self.lease_ttl = lease_ttl
+        self.worker_ttl = worker_ttl
+        self.probe_margin = probe_margin
+        self.started_at = time.time()
+        self._held = {}
+        self._draining = set()
+        self._inflight = Counter()
+        self._lock = threading.Lock()
+
+    def refresh(self, now=None):
+        """Heartbeat, then release moved shards and acquire/renew ours
+
+        Returns the (acquired, released) shard sets.
+        """
+        now = time.time() if now is None else now
+        conn = db.connect(self.database)
+        cursor = conn.cursor()
+        try:
+            cursor.execute('''
+                INSERT INTO checker_workers (worker_id, started_at, heartbeat_at) VALUES (?, ?, ?)
+                ON CONFLICT (worker_id) DO UPDATE SET heartbeat_at = excluded.heartbeat_at
+            ''', (self.worker_id, self.started_at, now))
+            cursor.execute('DELETE FROM checker_workers WHERE heartbeat_at < ?', (now - self.worker_ttl * 10,))
+            conn.commit()
+
+            ring = HashRing(live_workers(cursor, now, self.worker_ttl))
+            wanted = {shard for shard, owner in ring.assignment(self.num_shards).items()
+                      if owner == self.worker_id}
+
+            released = set()
+            with self._lock:
+                held = set(self._held)
+                draining = held - wanted
+                self._draining = set(draining)
+                idle = {shard for shard in draining if not self._inflight[shard]}
+            for shard in idle:
+                cursor.execute(
+                    'UPDATE checker_leases SET owner = NULL, expires_at = 0 WHERE shard = ? AND owner = ?',
+                    (shard, self.worker_id)
+                )
+                released.add(shard)
+
+            # Draining shards with probes in flight keep their lease renewed
+            acquired = set()
+            renewed = {}
+            for shard in wanted | (draining - idle):
+                cursor.execute('''
+                    UPDATE checker_leases SET owner = ?, expires_at = ?
+                    WHERE shard = ? AND (owner = ? OR owner IS NULL OR expires_at <= ?)
+                ''', (self.worker_id, now + self.lease_ttl, shard, self.worker_id, now))
+                if cursor.rowcount:
+                    renewed[shard] = now + self.lease_ttl
+                    if shard not in held:
+                        acquired.add(shard)
+            conn.commit()
+        finally:
+            conn.close()
+
+        with self._lock:
+            self._held = renewed
+            self._draining -= released
+        return acquired, released
+
+    def release_all(self):
+        """Give up every lease and leave the ring (graceful shutdown)"""
+        conn = db.connect(self.database)
+        cursor = conn.cursor()
+        cursor.execute('UPDATE checker_leases SET owner = NULL, expires_at = 0 WHERE owner = ?', (self.worker_id,))
+        cursor.execute('DELETE FROM checker_workers WHERE worker_id = ?', (self.worker_id,))
+        conn.commit()
+        conn.close()
+        with self._lock:
+            self._held = {}
+            self._draining = set()
+
+    def probe_shards(self, now=None):
+        """Shards new probes may be started for"""
+        now = time.time() if now is None else now
+        with self._lock:
+            return {shard for shard, expires_at in self._held.items()
+                    if shard not in self._draining and expires_at - now >= self.probe_margin}
+
+    def begin(self, shard, now=None):
+        """Mark a probe of `shard` in flight; False if it must not start"""
+        now = time.time() if now is None else now
+        with self._lock:
+            expires_at = self._held.get(shard)
+            if expires_at is None or shard in self._draining or expires_at - now < self.probe_margin:
+                return False
+            self._inflight[shard] += 1
+            return True
+
+    def end(self, shard):
+        with self._lock:
+            self._inflight[shard] -= 1
+
+
+class ShardedScheduler(ProbeScheduler):
+    """Probe scheduler limited to the shards this worker holds leases on
+
+    `on_rebalance(acquired, released)` is called after shards changed hands.
+    """
+
+    def __init__(self, database, probe, record, worker_id=None, tick=SCHEDULER_TICK,
+                 concurrency=SCHEDULER_CONCURRENCY, on_rebalance=None, leases=None):
+        super().__init__(database, probe, record, tick=tick, concurrency=concurrency)
+        self.worker_id = worker_id or default_worker_id()
+        self.leases = leases or ShardLeases(database, self.worker_id)
+        self.on_rebalance = on_rebalance
+        self._lease_thread = threading.Thread(target=self._keep_leases, name='lease-keeper', daemon=True)
+
+    def run(self):
+        self.refresh_leases()
+        self._lease_thread.start()
+        super().run()
+        self._lease_thread.join()
+        self.leases.release_all()
+
+    def refresh_leases(self, now=None):
+        acquired, released = self.leases.refresh(now)
+        if (acquired or released) and self.on_rebalance:
+            self.on_rebalance(acquired, released)
+        return acquired, released
+
+    def _keep_leases(self):
+        interval = self.leases.lease_ttl / 3
+        while not self._stop_event.wait(interval):
+            try:
+                self.refresh_leases()
+            except Exception:
+                logger.exception('Lease refresh failed')
+
+    def due(self, cursor, now):
+        shards = self.leases.probe_shards(now)
+        if not shards:
+            return []
+        return due_projects(cursor, now, self.concurrency * 4,
+                            shard_filter(shards, self.leases.num_shards))
+
+    def _check(self, project_id, url):
+        shard = shard_of(project_id, self.leases.num_shards)
+        if not self.leases.begin(shard):
+            return
+        conn = db.connect(self.database)
+        cursor = conn.cursor()
+        try:
+            result = guarded_probe(cursor, project_id, url, self.probe)
+            # Take the write lock first so the lease cannot move before commit
+            cursor.execute('BEGIN IMMEDIATE')
+            if not lease_held(cursor, shard, self.worker_id, time.time()):
+                logger.warning('Lease on shard %s lost, dropping result of project %s', shard, project_id)
+                conn.rollback()
+                return
+            self.record(cursor, project_id, result)
+            conn.commit()
+        finally:
+            conn.close()
+            self.leases.end(shard)
@@ -0,0 +1,187 @@
+"""Mergeable latency quantile sketch (DDSketch-style, relative-error buckets)"""
+import math
+import struct
+
+# Values at or below this threshold (seconds) are counted in the zero bucket
+MIN_INDEXABLE_VALUE = 1e-6
+DEFAULT_RELATIVE_ACCURACY = 0.01
+DEFAULT_MAX_BINS = 2048
+
+_FORMAT_VERSION = 1
+
+
+def _write_varint(out, value):
+    """Append an unsigned LEB128 varint to a bytearray"""
+    while True:
+        byte = value & 0x7F
+        value >>= 7
+        if value:
+            out.append(byte | 0x80)
+        else:
+            out.append(byte)
+            return
+
+
+def _read_varint(data, offset):
+    """Read an unsigned LEB128 varint, returning (value, new_offset)"""
+    result = 0
+    shift = 0
+    while True:
+        byte = data[offset]
+        offset += 1
+        result |= (byte & 0x7F) << shift
+        if not byte & 0x80:
+            return result, offset
+        shift += 7
+
+
+def _zigzag(value):
+    return (value << 1) ^ (value >> 63)
+
+
+def _unzigzag(value):
+    return (value >> 1) ^ -(value & 1)
+
+
+class DDSketch:
+    """Quantile sketch with bounded relative error on every quantile.
+
+    Each value lands in the bucket ceil(log_gamma(value)), so any two sketches
+    built with the same accuracy can be merged by adding bucket counts.
+    """
+
+    def __init__(self, relative_accuracy=DEFAULT_RELATIVE_ACCURACY, max_bins=DEFAULT_MAX_BINS):
+        self.relative_accuracy = relative_accuracy
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self._log_gamma = math.log(self.gamma)
+        self.max_bins = max_bins
+        self.bins = {}
+        self.zero_count = 0
+        self.count = 0
+        self.sum = 0.0
+        self.min = None
+        self.max = None
+
+    def _index(self, value):
+        return int(math.ceil(math.log(value) / self._log_gamma))
+
+    def _value(self, index):
+        return 2 * self.gamma ** index / (self.gamma + 1)
+
+    def add(self, value, count=1):
+        """Record a latency observation"""
+        if value is None or count <= 0:
+            return
+        value = max(float(value), 0.0)
+        if value <= MIN_INDEXABLE_VALUE:
+            self.zero_count += count
+        else:
+            index = self._index(value)
+            self.bins[index] = self.bins.get(index, 0) + count
+            if len(self.bins) > self.max_bins:
+                self._collapse_lowest()
+        self.count += count
+        self.sum += value * count
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    def _collapse_lowest(self):
+        """Fold the lowest buckets together so the sketch stays bounded"""
+        indexes = sorted(self.bins)
+        excess = len(indexes) - self.max_bins
+        target = indexes[excess]
+        for index in indexes[:excess]:
+            self.bins[target] += self.bins.pop(index)
+
+    def merge(self, other):
+        """Merge another sketch with the same accuracy into this one"""
+        if other is None or other.count == 0:
+            return self
+        if abs(other.gamma - self.gamma) > 1e-12:
+            raise ValueError('Cannot merge sketches with different relative accuracy')
+        for index, count in other.bins.items():
+            self.bins[index] = self.bins.get(index, 0) + count
+        if len(self.bins) > self.max_bins:
+            self._collapse_lowest()
+        self.zero_count += other.zero_count
+        self.count += other.count
+        self.sum += other.sum
+        self.min = other.min if self.min is None else min(self.min, other.min)
+        self.max = other.max if self.max is None else max(self.max, other.max)
+        return self
+
+    def quantile(self, q):
+        """Return the estimated value at quantile q (0..1), or None if empty"""
+        if self.count == 0:
+            return None
+        if q <= 0:
+            return self.min
+        if q >= 1:
+            return self.max
+
+        rank = q * (self.count - 1)
+        seen = self.zero_count
+        if rank < seen:
+            return self.min if self.min is not None and self.min <= MIN_INDEXABLE_VALUE else 0.0
+        for index in sorted(self.bins):
+            seen += self.bins[index]
+            if seen > rank:
+                return min(max(self._value(index), self.min), self.max)
+        return self.max
+
+    def quantiles(self, qs=(0.5, 0.95, 0.99)):
+        """Return a {'p50': ..., 'p95': ...} mapping for the given quantiles"""
+        return {f'p{_quantile_label(q)}': self.quantile(q) for q in qs}
+
+    def to_bytes(self):
+        """Serialize the sketch to a compact binary blob"""
+        out = bytearray()
+        out.append(_FORMAT_VERSION)
+        out += struct.pack('<dddd', self.relative_accuracy, self.sum,
+                           self.min if self.min is not None else math.nan,
+                           self.max if self.max is not None else math.nan)
+        _write_varint(out, self.zero_count)
+        _write_varint(out, len(self.bins))
+        previous = 0
+        for index in sorted(self.bins):
+            _write_varint(out, _zigzag(index - previous))
+            _write_varint(out, self.bins[index])
+            previous = index
+        return bytes(out)
+
+    @classmethod
+    def from_bytes(cls, data):
+        """Rebuild a sketch from to_bytes() output; None/empty yields an empty sketch"""
+        if not data:
+            return cls()
+        if data[0] != _FORMAT_VERSION:
+            raise ValueError(f'Unsupported sketch format version {data[0]}')
+        relative_accuracy, total, minimum, maximum = struct.unpack_from('<dddd', data, 1)
+        sketch = cls(relative_accuracy)
+        offset = 1 + struct.calcsize('<dddd')
+        sketch.zero_count, offset = _read_varint(data, offset)
+        bin_count, offset = _read_varint(data, offset)
+        index = 0
+        for _ in range(bin_count):
+            delta, offset = _read_varint(data, offset)
+            index += _unzigzag(delta)
+            sketch.bins[index], offset = _read_varint(data, offset)
+        sketch.count = sketch.zero_count + sum(sketch.bins.values())
+        sketch.sum = total
+        sketch.min = None if math.isnan(minimum) else minimum
+        sketch.max = None if math.isnan(maximum) else maximum
+        return sketch
+
+
+def _quantile_label(q):
+    label = f'{q * 100:g}'
+    return label.replace('.', '_')
+
+
+def merge_serialized(blobs):
+    """Merge an iterable of serialized sketches into a single sketch"""
+    merged = DDSketch()
+    for blob in blobs:
+        if blob:
+            merged.merge(DDSketch.from_bytes(blob))
+    return merged
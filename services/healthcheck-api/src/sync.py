@@ -0,0 +1,221 @@
+"""Incremental sync of targets and statuses with backend-api
+
+Targets are pulled from the backend `projects` table with an `updated_at`
+watermark: each pass only asks for projects modified since the last one
+(`GET /api/projects?updated_since=...`) and upserts them by `external_id`.
+A full pass, which also drops targets deleted in the backend along with
+their check history, runs once per FULL_SYNC_INTERVAL.
+
+Statuses go the other way: `synced_status` remembers the last status sent
+for each target, and only targets whose status moved since are pushed, in
+batches of SYNC_BATCH_SIZE, to `PATCH /api/projects/status`, which itself
+only writes rows whose status actually changed and leaves statuses set by
+an admin (`maintenance`...) alone.
+"""
+import logging
+import os
+import threading
+import time
+from datetime import datetime
+
+import requests
+
+from src import db
+from src.compact_storage import delete_compact_history
+from src.db import ensure_column
+from src.rollups import delete_project_history
+
+# Seconds between two sync passes
+SYNC_INTERVAL = float(os.environ.get('HEALTHCHECK_SYNC_INTERVAL', 30))
+# Statuses sent per bulk update request
+SYNC_BATCH_SIZE = int(os.environ.get('HEALTHCHECK_SYNC_BATCH_SIZE', 100))
+# Seconds between two full pulls (detecting deleted projects)
+FULL_SYNC_INTERVAL = float(os.environ.get('HEALTHCHECK_FULL_SYNC_INTERVAL', 3600))
+# Timeout (seconds) of requests to the backend
+SYNC_TIMEOUT = float(os.environ.get('HEALTHCHECK_SYNC_TIMEOUT', 10))
+
+logger = logging.getLogger(__name__)
+
+
+def create_sync_tables(cursor):
+    """Create the sync columns on projects and the sync_state table"""
+    ensure_column(cursor, 'projects', 'external_id', 'INTEGER')
+    ensure_column(cursor, 'projects', 'synced_status', 'TEXT')
+    cursor.execute('CREATE UNIQUE INDEX IF NOT EXISTS idx_projects_external_id ON projects (external_id)')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS sync_state (
+            key TEXT PRIMARY KEY,
+            value TEXT
+        )
+    ''')
+
+
+def get_state(cursor, key):
+    cursor.execute('SELECT value FROM sync_state WHERE key = ?', (key,))
+    row = cursor.fetchone()
+    return row[0] if row else None
+
+
+def set_state(cursor, key, value):
+    cursor.execute('INSERT OR REPLACE INTO sync_state (key, value) VALUES (?, ?)', (key, value))
+
+
+def apply_targets(cursor, targets, full=False):
+    """Upsert backend projects as targets; returns (changed, removed)
+
+    `changed` lists the (id, name, url) of inserted or modified targets and
+    `removed` the ids of targets dropped, with their check history, because
+    a full pull no longer has them. A target whose URL changed goes back to 'unknown' and is probed
+    again right away.
+    """
+    changed = []
+    for target in targets:
+        cursor.execute('SELECT id, name, url FROM projects WHERE external_id = ?', (target['id'],))
+        row = cursor.fetchone()
+        if row is None:
+            cursor.execute('''
+                INSERT INTO projects (name, url, external_id, status, synced_status)
+                VALUES (?, ?, ?, 'unknown', 'unknown')
+            ''', (target['name'], target['url'], target['id']))
+            changed.append((cursor.lastrowid, target['name'], target['url']))
+        elif row[2] != target['url']:
+            cursor.execute('''
+                UPDATE projects SET name = ?, url = ?, status = 'unknown', synced_status = 'unknown',
+                                    last_checked = NULL, response_time = NULL
+                WHERE id = ?
+            ''', (target['name'], target['url'], row[0]))
+            cursor.execute('DELETE FROM probe_state WHERE project_id = ?', (row[0],))
+            changed.append((row[0], target['name'], target['url']))
+        elif row[1] != target['name']:
+            cursor.execute('UPDATE projects SET name = ? WHERE id = ?', (target['name'], row[0]))
+            changed.append((row[0], target['name'], target['url']))
+
+    removed = []
+    if full:
+        seen = {target['id'] for target in targets}
+        cursor.execute('SELECT id, external_id FROM projects WHERE external_id IS NOT NULL')
+        removed = [project_id for project_id, external_id in cursor.fetchall() if external_id not in seen]
+        # Their history goes with them, whichever storage mode wrote it
+        delete_project_history(cursor, removed)
+        delete_compact_history(cursor, removed)
+        cursor.executemany('DELETE FROM probe_state WHERE project_id = ?', [(project_id,) for project_id in removed])
+        cursor.executemany('DELETE FROM projects WHERE id = ?', [(project_id,) for project_id in removed])
+    return changed, removed
+
+
+def latest_update(targets, watermark=None):
+    """Most recent `updated_at` among `targets` and the current watermark"""
+    stamps = [datetime.fromisoformat(target['updated_at']) for target in targets if target.get('updated_at')]
+    if watermark:
+        stamps.append(datetime.fromisoformat(watermark))
+    return max(stamps).isoformat() if stamps else None
+
+
+def pending_statuses(cursor, limit):
+    """(id, external_id, status) of targets whose status was not pushed yet"""
+    cursor.execute('''
+        SELECT id, external_id, status FROM projects
+        WHERE external_id IS NOT NULL AND status IS NOT synced_status
+        ORDER BY id LIMIT ?
+    ''', (limit,))
+    return cursor.fetchall()
+
+
+class BackendSync(threading.Thread):
+    """Background thread pulling targets from and pushing statuses to backend-api
+
+    `on_targets_changed(changed, removed)` is called after a pull that
+    modified targets, with the lists returned by apply_targets().
+    """
+
+    def __init__(self, database, base_url, interval=SYNC_INTERVAL, batch_size=SYNC_BATCH_SIZE,
+                 full_interval=FULL_SYNC_INTERVAL, timeout=SYNC_TIMEOUT, on_targets_changed=None):
+        super().__init__(name='backend-sync', daemon=True)
+        self.database = database
+        self.base_url = base_url.rstrip('/')
+        self.interval = interval
+        self.batch_size = batch_size
+        self.full_interval = full_interval
+        self.timeout = timeout
+        self.on_targets_changed = on_targets_changed
+        self.session = requests.Session()
+        self._stop_event = threading.Event()
+
+    def stop(self):
+        self._stop_event.set()
+
+    def run(self):
+        while not self._stop_event.is_set():
+            try:
+                self.run_once()
+            except Exception:
+                logger.exception('Backend sync failed')
+            self._stop_event.wait(self.interval)
+
+    def run_once(self, now=None):
+        """One pull then one push; returns counters of what was synced"""
+        now = time.time() if now is None else now
+        pulled, changed, removed = self.pull(now)
+        received, updated = self.push()
+        return {'pulled': pulled, 'changed': changed, 'removed': removed, 'pushed': received, 'updated': updated}
+
+    def pull(self, now):
+        """Fetch projects modified since the watermark and apply them"""
+        conn = db.connect(self.database)
+        cursor = conn.cursor()
+        try:
+            watermark = get_state(cursor, 'watermark')
+            last_full = float(get_state(cursor, 'full_sync_at') or 0)
+            full = watermark is None or now - last_full >= self.full_interval
+            conn.rollback()
+
+            # The bound is inclusive: projects updated in the same instant as
+            # the watermark come back and are applied again, which is a no-op
+            params = {} if full else {'updated_since': watermark}
+            response = self.session.get(f'{self.base_url}/api/projects', params=params, timeout=self.timeout)
+            response.raise_for_status()
+            targets = response.json()['projects']
+
+            changed, removed = apply_targets(cursor, targets, full=full)
+            new_watermark = latest_update(targets, watermark)
+            if new_watermark:
+                set_state(cursor, 'watermark', new_watermark)
+            if full:
+                set_state(cursor, 'full_sync_at', str(now))
+            set_state(cursor, 'pulled_at', str(now))
+            conn.commit()
+        finally:
+            conn.close()
+
+        if (changed or removed) and self.on_targets_changed:
+            self.on_targets_changed(changed, removed)
+        return len(targets), len(changed), len(removed)
+
+    def push(self):
+        """Send status changes in batches; returns (sent, updated in backend)"""
+        sent = updated = 0
+        while True:
+            conn = db.connect(self.database)
+            cursor = conn.cursor()
+            try:
+                rows = pending_statuses(cursor, self.batch_size)
+                if not rows:
+                    break
+                response = self.session.patch(
+                    f'{self.base_url}/api/projects/status',
+                    json={'statuses': [{'id': external_id, 'status': status} for _, external_id, status in rows]},
+                    timeout=self.timeout
+                )
+                response.raise_for_status()
+
+                # A status that moved again meanwhile stays pending
+                cursor.executemany('UPDATE projects SET synced_status = ? WHERE id = ?',
+                                   [(status, project_id) for project_id, _, status in rows])
+                conn.commit()
+            finally:
+                conn.close()
+            sent += len(rows)
+            updated += response.json().get('updated', 0)
+            if len(rows) < self.batch_size:
+                break
+        return sent, updated
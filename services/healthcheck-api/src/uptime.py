@@ -0,0 +1,125 @@
+"""Windowed uptime and SLO burn computed from the rollup tables"""
+import os
+import time
+
+from src.rollups import RESOLUTIONS
+
+DEFAULT_SLO_TARGET = float(os.environ.get('HEALTHCHECK_DEFAULT_SLO', 99.9))
+
+# Window name -> (seconds, rollup resolution it is computed from)
+UPTIME_WINDOWS = {
+    '1h': (3600, 'minute'),
+    '24h': (86400, 'hour'),
+    '7d': (7 * 86400, 'hour'),
+    '30d': (30 * 86400, 'hour'),
+}
+
+
+def _bucket_counts(cursor, table, start, end, project_id):
+    # {project_id: [check_count, up_count]} of the buckets starting in [start, end)
+    query = f'''
+        SELECT project_id, SUM(check_count), SUM(up_count)
+        FROM {table}
+        WHERE bucket_start >= ?
+    '''
+    params = [start]
+    if end is not None:
+        query += ' AND bucket_start < ?'
+        params.append(end)
+    if project_id is not None:
+        query += ' AND project_id = ?'
+        params.append(project_id)
+    query += ' GROUP BY project_id'
+
+    cursor.execute(query, params)
+    return {row[0]: [row[1], row[2]] for row in cursor.fetchall()}
+
+
+def window_counts(cursor, window, project_id=None, now=None):
+    """Return {project_id: (check_count, up_count)} over a named window
+
+    The window covers the buckets of its resolution that start within the
+    last `window` seconds, plus the minute buckets of the partial leading
+    bucket, so hour-based windows are not short by up to an hour.
+    """
+    now = time.time() if now is None else now
+    seconds, resolution = UPTIME_WINDOWS[window]
+    table, width = RESOLUTIONS[resolution]
+    window_start = now - seconds
+    start = int(-(-window_start // width) * width)
+    counts = _bucket_counts(cursor, table, start, None, project_id)
+
+    minute_table, minute_width = RESOLUTIONS['minute']
+    leading_start = int(-(-window_start // minute_width) * minute_width)
+    if leading_start < start:
+        for key, (check_count, up_count) in _bucket_counts(cursor, minute_table, leading_start, start,
+                                                           project_id).items():
+            total = counts.setdefault(key, [0, 0])
+            total[0] += check_count
+            total[1] += up_count
+    return {key: tuple(value) for key, value in counts.items()}
+
+
+def slo_summary(check_count, up_count, slo_target):
+    """Uptime, error budget and burn rate for one window"""
+    if not check_count:
+        return {
+            'check_count': 0,
+            'up_count': 0,
+            'uptime_percentage': None,
+            'error_budget_remaining': None,
+            'burn_rate': None
+        }
+
+    uptime = up_count / check_count * 100
+    allowed_failures = (100 - slo_target) / 100 * check_count
+    failures = check_count - up_count
+    burn_rate = (100 - uptime) / (100 - slo_target) if slo_target < 100 else None
+    return {
+        'check_count': check_count,
+        'up_count': up_count,
+        'uptime_percentage': uptime,
+        'error_budget_remaining': 1 - failures / allowed_failures if allowed_failures else None,
+        'burn_rate': burn_rate
+    }
+
+
+def project_uptime(cursor, project_id, slo_target, now=None):
+    """All uptime windows of one project"""
+    windows = {}
+    for window in UPTIME_WINDOWS:
+        counts = window_counts(cursor, window, project_id, now).get(project_id, (0, 0))
+        windows[window] = slo_summary(counts[0], counts[1], slo_target)
+    return windows
+
+
+def all_projects_uptime(cursor, projects, now=None):
+    """Uptime windows of every project plus a check-weighted overall figure
+
+    `projects` is an iterable of (project_id, name, slo_target) tuples.
+    """
+    counts_by_window = {window: window_counts(cursor, window, now=now) for window in UPTIME_WINDOWS}
+
+    results = []
+    for project_id, name, slo_target in projects:
+        slo_target = slo_target if slo_target is not None else DEFAULT_SLO_TARGET
+        results.append({
+            'project_id': project_id,
+            'name': name,
+            'slo_target': slo_target,
+            'windows': {
+                window: slo_summary(*counts.get(project_id, (0, 0)), slo_target)
+                for window, counts in counts_by_window.items()
+            }
+        })
+
+    overall = {}
+    for window, counts in counts_by_window.items():
+        check_count = sum(c[0] for c in counts.values())
+        up_count = sum(c[1] for c in counts.values())
+        overall[window] = {
+            'check_count': check_count,
+            'up_count': up_count,
+            'uptime_percentage': up_count / check_count * 100 if check_count else None
+        }
+    return results, overall
@@ -0,0 +1,38 @@
+"""Standalone checker worker
+
+Probes its share of the projects through shard leases, next to other
+workers and to API processes started with HEALTHCHECK_SHARDED=1.
+
+Usage: python src/worker.py [--worker-id ID] [--database PATH]
+"""
+import argparse
+import logging
+import os
+import signal
+import sys
+sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
+
+from src import main
+
+
+def run(argv=None):
+    parser = argparse.ArgumentParser(description='Healthcheck checker worker')
+    parser.add_argument('--worker-id', help='unique worker name (default: hostname-pid)')
+    parser.add_argument('--database', help=f'SQLite database file (default: {main.DATABASE})')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(name)s %(levelname)s %(message)s')
+    if args.database:
+        main.DATABASE = args.database
+    main.init_db()
+
+    worker = main.start_scheduler(sharded=True, worker_id=args.worker_id)
+    # Release the leases on SIGTERM/SIGINT so the shards move immediately
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(signum, lambda *_: worker.stop())
+    while worker.is_alive():
+        worker.join(0.5)
+
+
+if __name__ == '__main__':
+    run()
@@ -0,0 +1,19 @@
+import pytest
+import sys
+import os
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from src import main
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    """Create a test client backed by a fresh SQLite database."""
+    monkeypatch.setattr(main, 'DATABASE', str(tmp_path / 'app.db'))
+    main.app.config['TESTING'] = True
+    monkeypatch.setattr(main, 'CHECK_FRESHNESS', 0)
+    main.latest_results.clear()
+    main.event_hub.clear()
+    main.init_db()
+
+    with main.app.test_client() as client:
+        yield client
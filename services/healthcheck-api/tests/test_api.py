@@ -0,0 +1,290 @@
+import pytest
+import sys
+import os
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from src import main, rollups, uptime
+import json
+import sqlite3
+import threading
+import time
+
+@pytest.fixture
+def fake_probe(monkeypatch):
+    """Replace the network probe with a scripted sequence of results."""
+    results = []
+    
+    def probe(url):
+        return results.pop(0)
+    
+    monkeypatch.setattr(main, 'check_url_health', probe)
+    return results
+
+def probe_result(status='online', response_time=0.1):
+    return {
+        'status': status,
+        'response_time': response_time,
+        'status_code': 200 if status == 'online' else 503,
+        'error_message': None if status == 'online' else 'HTTP 503'
+    }
+
+class TestHistoryAPI:
+    """Test raw history and rollup-backed history."""
+    
+    def test_legacy_history_returns_raw_rows(self, client, fake_probe):
+        """Without a time range the last raw checks are returned."""
+        fake_probe.extend([probe_result(), probe_result('offline', None)])
+        client.post('/api/projects/1/check')
+        client.post('/api/projects/1/check')
+        
+        response = client.get('/api/projects/1/history')
+        data = json.loads(response.data)
+        assert len(data) == 2
+        assert {row['status'] for row in data} == {'online', 'offline'}
+
+    def test_checks_update_all_rollup_resolutions(self, client, fake_probe):
+        """Each check lands in the minute, hour and day buckets."""
+        fake_probe.extend([probe_result(response_time=0.1), probe_result(response_time=0.3),
+                           probe_result('offline', None)])
+        for _ in range(3):
+            client.post('/api/projects/1/check')
+        
+        for resolution in ('minute', 'hour', 'day'):
+            response = client.get(f'/api/projects/1/history?from={time.time() - 3600}&resolution={resolution}')
+            data = json.loads(response.data)
+            assert data['resolution'] == resolution
+            bucket = data['points'][-1]
+            assert bucket['check_count'] == 3
+            assert bucket['up_count'] == 2
+            assert bucket['min_response_time'] == pytest.approx(0.1)
+            assert bucket['max_response_time'] == pytest.approx(0.3)
+            assert bucket['avg_response_time'] == pytest.approx(0.2)
+
+    def test_resolution_follows_requested_range(self, client):
+        """Short ranges use raw rows, wider ranges use coarser rollups."""
+        now = time.time()
+        assert rollups.choose_resolution(now - 3600, now, now) == 'raw'
+        assert rollups.choose_resolution(now - 86400, now, now) == 'minute'
+        assert rollups.choose_resolution(now - 30 * 86400, now, now) == 'hour'
+        assert rollups.choose_resolution(now - 400 * 86400, now, now) == 'day'
+        
+        response = client.get(f'/api/projects/1/history?from={now - 7 * 86400}&to={now}')
+        assert json.loads(response.data)['resolution'] == 'hour'
+
+    def test_history_rejects_non_finite_timestamps(self, client):
+        """nan, inf and out of range epochs are a bad request, not a server error."""
+        for value in ('nan', 'inf', '-inf', '1e300'):
+            response = client.get(f'/api/projects/1/history?from={value}')
+            assert response.status_code == 400
+
+    def test_prune_expires_raw_rows_but_keeps_rollups(self, client, fake_probe):
+        """Raw rows past retention are deleted while rollups survive."""
+        fake_probe.append(probe_result())
+        client.post('/api/projects/1/check')
+        
+        conn = sqlite3.connect(main.DATABASE)
+        cursor = conn.cursor()
+        deleted = rollups.prune_expired(cursor, time.time() + 8 * 86400)
+        conn.commit()
+        
+        assert deleted['raw'] == 1
+        assert deleted['minute'] == 0
+        cursor.execute('SELECT COUNT(*) FROM health_check_rollups_hour')
+        assert cursor.fetchone()[0] == 1
+        conn.close()
+
+    def test_downsampled_history(self, client, fake_probe):
+        """`points` returns a fixed number of buckets with up ratio and latency range."""
+        fake_probe.extend([probe_result(response_time=0.1), probe_result('offline', None)])
+        client.post('/api/projects/1/check')
+        client.post('/api/projects/1/check')
+        
+        now = time.time()
+        response = client.get(f'/api/projects/1/history?from={now - 3600}&to={now + 1}&points=12')
+        data = json.loads(response.data)
+        assert data['resolution'] == 'raw'
+        assert len(data['series']['t']) == 12
+        assert sum(data['series']['count']) == 2
+        assert data['series']['up_ratio'][-1] == pytest.approx(0.5)
+        
+        response = client.get(f'/api/projects/1/history?from={now - 30 * 86400}&points=12')
+        data = json.loads(response.data)
+        assert data['resolution'] == 'hour'
+        assert len(data['series']['t']) == 12
+
+    def test_points_out_of_range(self, client):
+        """Unbounded point counts are rejected."""
+        assert client.get('/api/projects/1/history?points=0').status_code == 400
+
+class TestHistoryBatchAPI:
+    """Test the multi-project sparkline endpoint."""
+    
+    def test_batch_returns_fixed_size_series_per_project(self, client, fake_probe):
+        """Every requested project gets `points` latency and up-ratio slots."""
+        fake_probe.extend([probe_result(response_time=0.2), probe_result('offline', None),
+                           probe_result(response_time=0.4)])
+        client.post('/api/projects/1/check')
+        client.post('/api/projects/2/check')
+        client.post('/api/projects/2/check')
+        
+        data = json.loads(client.get('/api/history/batch?ids=1,2,3&window=24h&points=48').data)
+        assert data['resolution'] == 'minute'
+        assert set(data['projects']) == {'1', '2', '3'}
+        for values in data['projects'].values():
+            assert len(values['latency']) == 48
+            assert len(values['up_ratio']) == 48
+        assert data['projects']['1']['latency'][-1] == pytest.approx(0.2)
+        assert data['projects']['2']['up_ratio'][-1] == pytest.approx(0.5)
+        assert data['projects']['2']['latency'][-1] == pytest.approx(0.4)
+        assert set(data['projects']['3']['latency']) == {None}
+
+    def test_batch_defaults_to_all_projects(self, client):
+        """Without ids, every project is included."""
+        data = json.loads(client.get('/api/history/batch?window=7d&points=24').data)
+        assert len(data['projects']) == 6
+        assert data['resolution'] == 'hour'
+
+    def test_batch_rejects_bad_ids(self, client):
+        """Non-numeric ids are rejected."""
+        assert client.get('/api/history/batch?ids=1,abc').status_code == 400
+
+class TestLatencyStatsAPI:
+    """Test latency percentiles in the stats endpoints."""
+    
+    def test_project_stats_percentiles(self, client, fake_probe):
+        """Per-project stats expose p50/p95/p99 from the lifetime sketch."""
+        latencies = [0.1] * 90 + [2.0] * 10
+        fake_probe.extend(probe_result(response_time=latency) for latency in latencies)
+        for _ in latencies:
+            client.post('/api/projects/2/check')
+        
+        data = json.loads(client.get('/api/projects/2/stats').data)
+        latency = data['latency']
+        assert latency['count'] == 100
+        assert latency['p50'] == pytest.approx(0.1, rel=0.02)
+        assert latency['p95'] == pytest.approx(2.0, rel=0.02)
+        assert latency['p99'] == pytest.approx(2.0, rel=0.02)
+
+    def test_global_stats_merge_projects_and_windows(self, client, fake_probe):
+        """Global percentiles cover every project, with or without a window."""
+        fake_probe.extend([probe_result(response_time=0.2), probe_result(response_time=0.4)])
+        client.post('/api/projects/1/check')
+        client.post('/api/projects/2/check')
+        
+        lifetime = json.loads(client.get('/api/stats').data)['latency']
+        windowed = json.loads(client.get('/api/stats?window=1h').data)['latency']
+        for latency in (lifetime, windowed):
+            assert latency['count'] == 2
+            assert latency['min_response_time'] == pytest.approx(0.2)
+            assert latency['max_response_time'] == pytest.approx(0.4)
+        assert windowed['window'] == '1h'
+
+    def test_invalid_window(self, client):
+        """Malformed windows are rejected."""
+        response = client.get('/api/stats?window=soon')
+        assert response.status_code == 400
+
+class TestUptimeAPI:
+    """Test windowed uptime and SLO burn."""
+    
+    def test_project_uptime_windows(self, client, fake_probe):
+        """Uptime counts checks in every window and derives SLO burn."""
+        fake_probe.extend([probe_result()] * 9 + [probe_result('offline', None)])
+        for _ in range(10):
+            client.post('/api/projects/1/check')
+        
+        data = json.loads(client.get('/api/projects/1/uptime').data)
+        assert data['slo_target'] == 99.9
+        assert set(data['windows']) == {'1h', '24h', '7d', '30d'}
+        for window in data['windows'].values():
+            assert window['check_count'] == 10
+            assert window['uptime_percentage'] == pytest.approx(90.0)
+            assert window['burn_rate'] == pytest.approx(100.0)
+            assert window['error_budget_remaining'] < 0
+
+    def test_window_includes_partial_leading_hour(self, client):
+        """Checks in the first, partial hour of a window count, from the minute rollups."""
+        now = 100 * 86400 + 1800
+        conn = sqlite3.connect(main.DATABASE)
+        cursor = conn.cursor()
+        # 24h and 10 minutes ago (outside), 23h50 ago (inside, before the first whole hour), 1h ago
+        for ts, is_up in ((now - 86400 - 600, True), (now - 86400 + 600, False), (now - 3600, True)):
+            rollups.record_rollups(cursor, 1, ts, is_up, 0.1)
+        conn.commit()
+
+        assert uptime.window_counts(cursor, '24h', 1, now) == {1: (2, 1)}
+        conn.close()
+
+    def test_aggregated_uptime(self, client, fake_probe):
+        """The aggregated endpoint lists every project and an overall figure."""
+        fake_probe.extend([probe_result(), probe_result('offline', None)])
+        client.post('/api/projects/1/check')
+        client.post('/api/projects/2/check')
+        
+        data = json.loads(client.get('/api/uptime').data)
+        assert len(data['projects']) == 6
+        assert data['overall']['24h']['uptime_percentage'] == pytest.approx(50.0)
+        unchecked = [p for p in data['projects'] if p['project_id'] == 3][0]
+        assert unchecked['windows']['1h']['uptime_percentage'] is None
+
+    def test_stats_uptime_uses_history(self, client, fake_probe):
+        """`uptime_percentage` reflects check history, not current status."""
+        fake_probe.extend([probe_result('offline', None)] * 3 + [probe_result()])
+        for _ in range(4):
+            client.post('/api/projects/1/check')
+        
+        data = json.loads(client.get('/api/stats').data)
+        assert data['uptime_percentage'] == pytest.approx(25.0)
+        assert data['status_counts']['online'] == 1
+
+class TestOnDemandCheckAPI:
+    """Test coalescing and the freshness window of on-demand checks."""
+    
+    def test_concurrent_checks_share_one_probe(self, client, monkeypatch):
+        """Parallel checks of one project probe once and write one row."""
+        release = threading.Event()
+        calls = []
+        
+        def probe(url):
+            calls.append(url)
+            release.wait(5)
+            return probe_result()
+        
+        monkeypatch.setattr(main, 'check_url_health', probe)
+        responses = []
+        
+        def check():
+            with main.app.test_client() as thread_client:
+                responses.append(json.loads(thread_client.post('/api/projects/1/check').data))
+        
+        threads = [threading.Thread(target=check) for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        while not calls:
+            time.sleep(0.01)
+        time.sleep(0.2)
+        release.set()
+        for thread in threads:
+            thread.join()
+        
+        assert len(calls) == 1
+        assert sorted(r['coalesced'] for r in responses) == [False] + [True] * 4
+        assert len({r['checked_at'] for r in responses}) == 1
+        
+        conn = sqlite3.connect(main.DATABASE)
+        assert conn.execute('SELECT COUNT(*) FROM health_checks').fetchone()[0] == 1
+        conn.close()
+
+    def test_fresh_result_is_reused_unless_forced(self, client, fake_probe, monkeypatch):
+        """Within the freshness window the last result is returned; force re-probes."""
+        monkeypatch.setattr(main, 'CHECK_FRESHNESS', 60)
+        fake_probe.extend([probe_result(response_time=0.1), probe_result('offline', None)])
+        
+        first = json.loads(client.post('/api/projects/1/check').data)
+        second = json.loads(client.post('/api/projects/1/check').data)
+        forced = json.loads(client.post('/api/projects/1/check?force=true').data)
+        
+        assert not first['cached'] and second['cached']
+        assert second['response_time'] == first['response_time']
+        assert not forced['cached'] and forced['status'] == 'offline'
+        assert fake_probe == []
@@ -0,0 +1,107 @@
+import pytest
+import sys
+import os
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from src import main, probe
+import http.server
+import json
+import shutil
+import ssl
+import subprocess
+import threading
+import time
+
+@pytest.fixture
+def certificate(tmp_path):
+    """Self-signed certificate for localhost, generated with the openssl CLI."""
+    if not shutil.which('openssl'):
+        pytest.skip('openssl CLI not available')
+    cert, key = str(tmp_path / 'cert.pem'), str(tmp_path / 'key.pem')
+    subprocess.run([
+        'openssl', 'req', '-x509', '-newkey', 'rsa:2048', '-nodes', '-days', '30',
+        '-keyout', key, '-out', cert, '-subj', '/CN=localhost/O=Test CA',
+        '-addext', 'subjectAltName=DNS:localhost,IP:127.0.0.1'
+    ], check=True, capture_output=True)
+    return cert, key
+
+@pytest.fixture
+def tls_server(certificate):
+    """Local HTTPS server answering 200 with the self-signed certificate."""
+    class Handler(http.server.BaseHTTPRequestHandler):
+        def do_GET(self):
+            self.send_response(200)
+            self.send_header('Content-Length', '2')
+            self.end_headers()
+            self.wfile.write(b'ok')
+
+        def log_message(self, *args):
+            pass
+
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    context.load_cert_chain(*certificate)
+    server.socket = context.wrap_socket(server.socket, server_side=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    probe.certificate_cache.clear()
+
+    yield f'https://localhost:{server.server_address[1]}/'
+    server.shutdown()
+    probe.certificate_cache.clear()
+
+class TestCertificateInspection:
+    """Test peer certificate extraction and its per-host cache."""
+
+    def test_expiry_issuer_and_san(self, tls_server, certificate):
+        """The summary holds expiry, issuer and subject alternative names."""
+        context = ssl.create_default_context(cafile=certificate[0])
+        peer = {}
+        assert probe.timed_get(tls_server, probe.empty_timings(), ssl_context=context, peer=peer) == 200
+
+        cert = peer['certificate']
+        assert cert['subject'] == 'localhost'
+        assert cert['issuer'] == 'localhost'
+        assert cert['issuer_organization'] == 'Test CA'
+        assert cert['san'] == ['localhost', '127.0.0.1']
+        assert abs(cert['not_after'] - (time.time() + 30 * 86400)) < 3600
+
+    def test_certificate_inspected_once_per_interval(self, tls_server, certificate, monkeypatch):
+        """Repeated probes of a host:port reuse the cached inspection."""
+        context = ssl.create_default_context(cafile=certificate[0])
+        for _ in range(3):
+            probe.timed_get(tls_server, probe.empty_timings(), ssl_context=context, peer={})
+        assert probe.certificate_cache.inspections == 1
+
+        monkeypatch.setattr(probe.certificate_cache, 'interval', 0)
+        probe.timed_get(tls_server, probe.empty_timings(), ssl_context=context, peer={})
+        assert probe.certificate_cache.inspections == 2
+
+class TestCertificateAPI:
+    """Test certificate expiry in the API and metrics."""
+
+    def test_expiry_in_api_and_metrics(self, client, tls_server, certificate, monkeypatch):
+        """With the CA bundle configured, a check exposes the certificate everywhere."""
+        monkeypatch.setattr(probe, 'CA_BUNDLE', certificate[0])
+        conn = main.db.connect(main.DATABASE)
+        conn.execute('UPDATE projects SET url = ? WHERE id = 1', (tls_server,))
+        conn.commit()
+        conn.close()
+
+        check = json.loads(client.post('/api/projects/1/check').data)
+        assert check['status'] == 'online'
+
+        project_cert = json.loads(client.get('/api/projects/1/certificate').data)
+        assert project_cert['subject'] == 'localhost'
+        assert 29 < project_cert['days_remaining'] <= 30
+
+        certificates = json.loads(client.get('/api/certificates').data)
+        assert [c['host'] for c in certificates] == ['localhost']
+
+        metrics = client.get('/metrics').data.decode()
+        expiry = [line for line in metrics.splitlines() if line.startswith('probe_ssl_earliest_cert_expiry{')]
+        assert len(expiry) == 1
+        assert float(expiry[0].rsplit(' ', 1)[1]) == check['certificate']['not_after']
+
+    def test_no_certificate_for_plain_http(self, client):
+        """Projects never probed over HTTPS have no certificate."""
+        assert client.get('/api/projects/2/certificate').status_code == 404
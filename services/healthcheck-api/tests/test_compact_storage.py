@@ -0,0 +1,193 @@
+import pytest
+import sys
+import os
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from src import db, main, compact_storage
+from src.latest import LatestResults
+import sqlite3
+import time
+
+TIMINGS = {'dns': 0.01, 'connect': 0.02, 'tls': None, 'ttfb': 0.15, 'transfer': 0.02}
+
+def result(status='online', response_time=0.2, status_code=200, error=None):
+    return {'status': status, 'response_time': response_time, 'status_code': status_code, 'error_message': error,
+            'timings': TIMINGS if response_time is not None else None}
+
+# Ten identical checks, an outage, then recovery
+SEQUENCE = [result()] * 10 + [result('offline', None, None, 'Connection Error')] * 5 + [result()] * 5
+
+def replay(database, mode, monkeypatch):
+    """Record SEQUENCE one minute apart in the given storage mode."""
+    monkeypatch.setattr(main, 'DATABASE', database)
+    monkeypatch.setattr(main, 'STORAGE_MODE', mode)
+    monkeypatch.setattr(compact_storage, 'SAMPLE_INTERVAL', 3600)
+    compact_storage.reset_state()
+    main.init_db()
+    
+    start = 1_700_000_000
+    conn = db.connect(database)
+    cursor = conn.cursor()
+    for i, check in enumerate(SEQUENCE):
+        monkeypatch.setattr(main.time, 'time', lambda: start + i * 60)
+        main.record_check(cursor, 1, check)
+        conn.commit()
+    monkeypatch.undo()
+    return conn, start
+
+class TestCompactStorage:
+    """Test run-length encoded health check storage."""
+    
+    def test_runs_collapse_identical_checks(self, tmp_path, monkeypatch):
+        """Only state transitions create rows; errors are interned once."""
+        conn, _ = replay(str(tmp_path / 'app.db'), 'compact', monkeypatch)
+        cursor = conn.cursor()
+        
+        assert cursor.execute('SELECT COUNT(*) FROM health_checks').fetchone()[0] == 0
+        assert cursor.execute('SELECT COUNT(*) FROM health_check_runs').fetchone()[0] == 3
+        assert cursor.execute('SELECT COUNT(*) FROM error_messages').fetchone()[0] == 1
+        assert cursor.execute('SELECT COUNT(*) FROM health_check_samples').fetchone()[0] == 2
+        conn.close()
+
+    def test_history_matches_row_storage(self, tmp_path, monkeypatch):
+        """Reconstructed history, phase timings included, equals what row storage returns."""
+        rows_conn, start = replay(str(tmp_path / 'rows.db'), 'rows', monkeypatch)
+        compact_conn, _ = replay(str(tmp_path / 'compact.db'), 'compact', monkeypatch)
+        
+        monkeypatch.setattr(main, 'STORAGE_MODE', 'rows')
+        expected = main.fetch_raw_history(rows_conn.cursor(), 1, start, start + 3600)
+        latest_expected = main.fetch_raw_history(rows_conn.cursor(), 1, limit=7)
+        monkeypatch.setattr(main, 'STORAGE_MODE', 'compact')
+        actual = main.fetch_raw_history(compact_conn.cursor(), 1, start, start + 3600)
+        latest_actual = main.fetch_raw_history(compact_conn.cursor(), 1, limit=7)
+        
+        assert actual == expected
+        assert latest_actual == latest_expected
+        assert actual[0][5:] == tuple(TIMINGS.values())
+        rows_conn.close()
+        compact_conn.close()
+
+    def test_latest_history_only_expands_needed_checks(self, tmp_path, monkeypatch):
+        """`limit` reads the newest runs and stops, however many checks older runs hold."""
+        conn, start = replay(str(tmp_path / 'app.db'), 'compact', monkeypatch)
+        # A year of checks before the replayed ones
+        conn.execute('''
+            INSERT INTO health_check_runs (project_id, status, status_code, error_kind, started_at, ended_at,
+                                           check_count)
+            VALUES (1, 1, 200, 0, ?, ?, 10000000)
+        ''', (start - 365 * 86400, start - 60))
+        conn.commit()
+        monkeypatch.setattr(main, 'STORAGE_MODE', 'compact')
+        
+        started = time.monotonic()
+        rows = main.fetch_raw_history(conn.cursor(), 1, limit=50)
+        assert time.monotonic() - started < 1
+        assert len(rows) == 50
+        assert rows[0][4] == compact_storage.to_sql_timestamp(start + 19 * 60)
+        assert rows[20][4] == compact_storage.to_sql_timestamp(start - 60)
+        conn.close()
+
+    def test_latest_results_survive_a_restart(self, tmp_path, monkeypatch):
+        """Latest results are loaded from the runs and samples in compact mode."""
+        conn, start = replay(str(tmp_path / 'app.db'), 'compact', monkeypatch)
+        conn.execute("INSERT OR IGNORE INTO projects (id, name, url) VALUES (1, 'Site', 'https://example.com')")
+        compact_storage.flush_pending_checks(conn.cursor())
+        conn.commit()
+        
+        latest = LatestResults()
+        latest.load(conn.cursor(), compact=True)
+        assert latest.get(1) == {
+            'status': 'online', 'response_time': 0.2, 'status_code': 200, 'error_message': None,
+            'timings': TIMINGS, 'checked_at': start + 19 * 60
+        }
+        conn.close()
+
+
+def compact_db(tmp_path, monkeypatch):
+    """Initialize an empty compact database."""
+    monkeypatch.setattr(main, 'DATABASE', str(tmp_path / 'app.db'))
+    monkeypatch.setattr(main, 'STORAGE_MODE', 'compact')
+    monkeypatch.setattr(compact_storage, 'SAMPLE_INTERVAL', 3600)
+    compact_storage.reset_state()
+    main.init_db()
+    return db.connect(main.DATABASE)
+
+def record_at(conn, monkeypatch, ts, check=None, commit=True):
+    """Record one check at `ts`, then commit or roll back."""
+    with monkeypatch.context() as patch:
+        patch.setattr(main.time, 'time', lambda: ts)
+        main.record_check(conn.cursor(), 1, check or result())
+    if commit:
+        conn.commit()
+    else:
+        conn.rollback()
+
+def stored_counts(conn):
+    """(check count of the open run, check count of its hour rollup)"""
+    run = conn.execute('SELECT check_count FROM health_check_runs ORDER BY id DESC LIMIT 1').fetchone()[0]
+    rollup = conn.execute('SELECT SUM(check_count) FROM health_check_rollups_hour').fetchone()[0]
+    return run, rollup
+
+class TestPendingChecks:
+    """Test checks kept in memory between checkpoints."""
+    
+    START = 1_700_000_000
+    
+    def test_only_probe_state_is_written_between_checkpoints(self, tmp_path, monkeypatch):
+        """Checks extending the open run write their rollups and project row at the next checkpoint."""
+        conn = compact_db(tmp_path, monkeypatch)
+        record_at(conn, monkeypatch, self.START)
+        
+        for i in range(1, 5):
+            changes = conn.total_changes
+            record_at(conn, monkeypatch, self.START + i * 60)
+            assert conn.total_changes - changes == 1
+        assert stored_counts(conn) == (1, 1)
+        assert len(main.fetch_raw_history(conn.cursor(), 1, limit=50)) == 5
+        
+        record_at(conn, monkeypatch, self.START + compact_storage.CHECKPOINT_INTERVAL + 60)
+        assert stored_counts(conn) == (6, 6)
+        assert compact_storage.pending_runs(1) == {}
+        conn.close()
+
+    def test_rolled_back_checks_are_forgotten(self, tmp_path, monkeypatch):
+        """A rolled back check is not counted, and a rolled back checkpoint keeps its checks pending."""
+        conn = compact_db(tmp_path, monkeypatch)
+        record_at(conn, monkeypatch, self.START)
+        record_at(conn, monkeypatch, self.START + 60, commit=False)
+        assert compact_storage.pending_runs(1) == {}
+        
+        # A new error message and run that were rolled back are not reused
+        record_at(conn, monkeypatch, self.START + 120, result('offline', None, None, 'Boom'), commit=False)
+        assert compact_storage._error_ids == {}
+        record_at(conn, monkeypatch, self.START + 180)
+        record_at(conn, monkeypatch, self.START + 240)
+        assert sum(count for count, _ in compact_storage.pending_runs(1).values()) == 2
+        
+        record_at(conn, monkeypatch, self.START + 900, commit=False)
+        assert sum(count for count, _ in compact_storage.pending_runs(1).values()) == 2
+        record_at(conn, monkeypatch, self.START + 960)
+        assert stored_counts(conn) == (4, 4)
+        assert conn.execute('SELECT COUNT(*) FROM health_check_runs').fetchone()[0] == 1
+        conn.close()
+
+    def test_processes_add_to_the_same_run(self, tmp_path, monkeypatch):
+        """Pending checks of two processes are added to the run, not overwritten."""
+        conn = compact_db(tmp_path, monkeypatch)
+        record_at(conn, monkeypatch, self.START)
+        for i in range(1, 4):
+            record_at(conn, monkeypatch, self.START + i * 60)
+        
+        first_process = compact_storage._pending
+        monkeypatch.setattr(compact_storage, '_pending', {})
+        for i in range(4, 6):
+            record_at(conn, monkeypatch, self.START + i * 60)
+        compact_storage.flush_pending_checks(conn.cursor())
+        conn.commit()
+        assert stored_counts(conn) == (3, 3)
+        
+        monkeypatch.setattr(compact_storage, '_pending', first_process)
+        compact_storage.flush_pending_checks(conn.cursor())
+        conn.commit()
+        assert stored_counts(conn) == (6, 6)
+        conn.close()
@@ -0,0 +1,52 @@
+import pytest
+import sys
+import os
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from src import db
+
+@pytest.fixture
+def database(tmp_path):
+    path = str(tmp_path / 'pool.db')
+    yield path
+    db.close_all()
+
+class TestConnectionPool:
+    """Test pooled SQLite connections."""
+    
+    def test_connections_are_reused(self, database):
+        """Closing returns the connection to the pool instead of closing it."""
+        conn = db.connect(database)
+        raw = conn._conn
+        conn.close()
+        
+        again = db.connect(database)
+        assert again._conn is raw
+        again.close()
+
+    def test_pragmas_applied_once(self, database):
+        """Pooled connections run in WAL mode."""
+        conn = db.connect(database)
+        assert conn.execute('PRAGMA journal_mode').fetchone()[0] == 'wal'
+        conn.close()
+
+    def test_uncommitted_work_is_rolled_back(self, database):
+        """A connection released mid-transaction does not leak its writes."""
+        conn = db.connect(database)
+        conn.execute('CREATE TABLE t (x INTEGER)')
+        conn.commit()
+        conn.execute('INSERT INTO t VALUES (1)')
+        conn.close()
+        
+        conn = db.connect(database)
+        assert conn.execute('SELECT COUNT(*) FROM t').fetchone()[0] == 0
+        conn.close()
+
+    def test_service_copies_match(self):
+        """The project-bridge copy of the pool has not diverged."""
+        here = os.path.join(os.path.dirname(__file__), '..', 'src', 'db.py')
+        other = os.path.join(os.path.dirname(__file__), '..', '..', 'project-bridge', 'src', 'db.py')
+        if not os.path.exists(other):
+            pytest.skip('project-bridge is not checked out next to healthcheck-api')
+        with open(here) as a, open(other) as b:
+            assert a.read() == b.read()
@@ -0,0 +1,61 @@
+import pytest
+import sys
+import os
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from src.downsample import downsample, series_from_raw, series_from_rollups, to_json_lists
+import numpy as np
+
+def raw_series(n, step=60.0):
+    """n checks, one every `step` seconds, down every 10th check."""
+    rows = [(i * step, i % 10 != 0, None if i % 10 == 0 else 0.1 + (i % 7) / 100) for i in range(n)]
+    return rows, series_from_raw(rows)
+
+class TestDownsample:
+    """Test server-side bucketing of history."""
+    
+    def test_minmax_buckets_aggregate_counts_and_ranges(self):
+        """Each bucket carries its count, up ratio and latency range."""
+        rows, series = raw_series(100)
+        buckets = downsample(series, 0, 6000, 10)
+        
+        assert list(buckets['count']) == [10] * 10
+        assert buckets['up_ratio'] == pytest.approx([0.9] * 10)
+        first = [lat for _, _, lat in rows[:10] if lat is not None]
+        assert buckets['latency_min'][0] == pytest.approx(min(first))
+        assert buckets['latency_max'][0] == pytest.approx(max(first))
+        assert buckets['latency_avg'][0] == pytest.approx(np.mean(first))
+
+    def test_payload_size_is_independent_of_window(self):
+        """A month of checks and an hour of checks yield the same bucket count."""
+        _, hour = raw_series(60)
+        _, month = raw_series(30 * 1440)
+        assert len(downsample(hour, 0, 3600, 48)['t']) == 48
+        assert len(downsample(month, 0, 30 * 86400, 48)['t']) == 48
+
+    def test_rollup_series_weights_by_check_count(self):
+        """Rollup buckets combine by counts, not by averaging averages."""
+        rows = [
+            (0, 10, 10, 10, 1.0, 0.05, 0.2, None),
+            (60, 30, 15, 30, 9.0, 0.1, 0.9, None),
+        ]
+        buckets = downsample(series_from_rollups(rows), 0, 120, 1)
+        assert buckets['count'][0] == 40
+        assert buckets['up_ratio'][0] == pytest.approx(25 / 40)
+        assert buckets['latency_avg'][0] == pytest.approx(10.0 / 40)
+        assert buckets['latency_min'][0] == pytest.approx(0.05)
+        assert buckets['latency_max'][0] == pytest.approx(0.9)
+
+    def test_lttb_keeps_spikes(self):
+        """LTTB picks the outlier of a bucket as its representative sample."""
+        rows = [(i, True, 5.0 if i == 55 else 0.1) for i in range(100)]
+        buckets = downsample(series_from_raw(rows), 0, 100, 10, mode='lttb')
+        assert buckets['latency'][5] == pytest.approx(5.0)
+        assert buckets['latency_t'][5] == 55
+
+    def test_empty_buckets_serialize_as_null(self):
+        """Buckets without data become null in JSON output."""
+        series = series_from_raw([(10, True, 0.2)])
+        output = to_json_lists(downsample(series, 0, 100, 4))
+        assert output['count'] == [1, 0, 0, 0]
+        assert output['latency_avg'][1:] == [None, None, None]
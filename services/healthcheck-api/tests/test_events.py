@@ -0,0 +1,112 @@
+import pytest
+import sys
+import os
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from src import main
+from src.events import EventHub
+import json
+import threading
+
+def probe_result(status='online'):
+    return {
+        'status': status,
+        'response_time': 0.1 if status == 'online' else None,
+        'status_code': 200 if status == 'online' else None,
+        'error_message': None if status == 'online' else 'Connection Error'
+    }
+
+def read_events(response, count):
+    """Parse `count` events (skipping comments and retry) from a streamed response."""
+    events = []
+    buffer = ''
+    chunks = iter(response.response)
+    while len(events) < count:
+        chunk = next(chunks)
+        buffer += chunk.decode() if isinstance(chunk, bytes) else chunk
+        while '\n\n' in buffer:
+            block, buffer = buffer.split('\n\n', 1)
+            fields = dict(line.split(': ', 1) for line in block.splitlines() if not line.startswith(':') and ': ' in line)
+            if 'event' in fields:
+                events.append({'id': fields.get('id'), 'event': fields['event'], 'data': json.loads(fields['data'])})
+    response.close()
+    return events
+
+class TestEventHub:
+    """Test the broadcast hub and its replay buffer."""
+
+    def test_resume_from_last_event_id(self):
+        """Events after the given id are replayed in order."""
+        hub = EventHub(replay_size=10)
+        for i in range(5):
+            hub.publish('check', {'n': i})
+
+        events, complete = hub.since(2)
+        assert complete
+        assert [event['data']['n'] for event in events] == [2, 3, 4]
+
+    def test_evicted_events_are_reported(self):
+        """Resuming from an id older than the buffer flags the gap."""
+        hub = EventHub(replay_size=3)
+        for i in range(6):
+            hub.publish('check', {'n': i})
+
+        events, complete = hub.since(1)
+        assert not complete
+        assert [event['id'] for event in events] == [4, 5, 6]
+
+        # Id from a previous process
+        assert hub.since(99) == ([], False)
+
+    def test_one_publish_wakes_every_subscriber(self):
+        """Waiting subscribers all receive the same event."""
+        hub = EventHub()
+        received = []
+        threads = [threading.Thread(target=lambda: received.append(hub.wait(0, timeout=5)[0]))
+                   for _ in range(20)]
+        for thread in threads:
+            thread.start()
+        hub.publish('transition', {'project_id': 1})
+        for thread in threads:
+            thread.join()
+
+        assert len(received) == 20
+        assert all(events[0]['data'] == {'project_id': 1} for events in received)
+
+class TestEventsAPI:
+    """Test the /api/events SSE stream."""
+
+    def test_checks_publish_completion_and_transition_events(self, client, monkeypatch):
+        """A status change emits a transition; a repeated status only a check event."""
+        results = [probe_result(), probe_result(), probe_result('offline')]
+        monkeypatch.setattr(main, 'check_url_health', lambda url: results.pop(0))
+        for _ in range(3):
+            client.post('/api/projects/1/check')
+
+        response = client.get('/api/events', headers={'Last-Event-ID': '0'}, buffered=False)
+        assert response.content_type == 'text/event-stream'
+        events = read_events(response, 5)
+
+        assert [event['event'] for event in events] == ['check', 'transition', 'check', 'check', 'transition']
+        assert events[1]['data']['from'] == 'unknown' and events[1]['data']['to'] == 'online'
+        assert events[4]['data']['from'] == 'online' and events[4]['data']['to'] == 'offline'
+        assert [event['id'] for event in events] == ['1', '2', '3', '4', '5']
+
+    def test_filters_and_resume(self, client, monkeypatch):
+        """Only transitions of the requested project after the given id are sent."""
+        monkeypatch.setattr(main, 'check_url_health', lambda url: probe_result())
+        client.post('/api/projects/1/check')
+        client.post('/api/projects/2/check')
+        client.post('/api/projects/3/check')
+
+        response = client.get('/api/events?types=transition&project_id=3&last_event_id=2', buffered=False)
+        events = read_events(response, 1)
+        assert events[0]['event'] == 'transition'
+        assert events[0]['data']['project_id'] == 3
+
+    def test_reset_after_restart(self, client):
+        """An unknown Last-Event-ID gets a reset event."""
+        response = client.get('/api/events', headers={'Last-Event-ID': '42'}, buffered=False)
+        events = read_events(response, 1)
+        assert events[0]['event'] == 'reset'
+        assert events[0]['id'] is None
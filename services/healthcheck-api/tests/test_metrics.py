@@ -0,0 +1,98 @@
+import pytest
+import sys
+import os
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from src import main
+from src.latest import LatestResults
+
+def probe_result(status='online', response_time=0.2):
+    return {
+        'status': status,
+        'response_time': response_time,
+        'status_code': 200 if status == 'online' else 503,
+        'error_message': None if status == 'online' else 'HTTP 503',
+        'timings': {'dns': 0.01, 'connect': 0.02, 'tls': None, 'ttfb': 0.15, 'transfer': 0.02}
+    }
+
+def parse(text):
+    """Map 'name{labels}' to its value, skipping comments."""
+    samples = {}
+    for line in text.splitlines():
+        if line and not line.startswith('#'):
+            series, value = line.rsplit(' ', 1)
+            samples[series] = float(value)
+    return samples
+
+def series(name, project_id=1, extra=''):
+    labels = f'project_id="{project_id}",project="E-commerce Platform",target="https://demo-ecommerce.example.com"'
+    return f'{name}{{{labels}{extra}}}'
+
+class TestMetricsEndpoint:
+    """Test the Prometheus exporter."""
+
+    def test_probe_gauges_and_histogram(self, client, monkeypatch):
+        """Checks show up as blackbox-style gauges and a cumulative histogram."""
+        results = [probe_result(), probe_result('offline', 0.7), probe_result('offline', 0.05)]
+        monkeypatch.setattr(main, 'check_url_health', lambda url: results.pop(0))
+        for _ in range(3):
+            client.post('/api/projects/1/check')
+
+        response = client.get('/metrics')
+        assert response.content_type.startswith('text/plain; version=0.0.4')
+        samples = parse(response.data.decode())
+
+        assert samples[series('probe_success')] == 0
+        assert samples[series('probe_duration_seconds')] == 0.05
+        assert samples[series('probe_http_status_code')] == 503
+        assert samples[series('probe_consecutive_failures')] == 2
+        assert samples[series('probe_http_duration_seconds', extra=',phase="processing"')] == 0.15
+        assert series('probe_http_duration_seconds', extra=',phase="tls"') not in samples
+        assert 0 <= samples[series('probe_check_age_seconds')] < 5
+
+        assert samples[series('healthcheck_probe_duration_seconds_bucket', extra=',le="0.05"')] == 1
+        assert samples[series('healthcheck_probe_duration_seconds_bucket', extra=',le="0.25"')] == 2
+        assert samples[series('healthcheck_probe_duration_seconds_bucket', extra=',le="+Inf"')] == 3
+        assert samples[series('healthcheck_probe_duration_seconds_count')] == 3
+
+    def test_scrape_does_not_query_the_database(self, client, monkeypatch):
+        """Scrapes are served from memory only."""
+        monkeypatch.setattr(main, 'check_url_health', lambda url: probe_result())
+        client.post('/api/projects/1/check')
+
+        def no_database(*args):
+            raise AssertionError('database used during scrape')
+
+        monkeypatch.setattr(main.db, 'connect', no_database)
+        samples = parse(client.get('/metrics').data.decode())
+        assert samples[series('probe_success')] == 1
+
+    def test_latest_results_seeded_from_database(self, client, monkeypatch):
+        """After a restart the last stored result of every project is exported."""
+        monkeypatch.setattr(main, 'check_url_health', lambda url: probe_result())
+        client.post('/api/projects/1/check')
+        main.latest_results.clear()
+
+        main.load_latest_results()
+        samples = parse(client.get('/metrics').data.decode())
+        assert samples[series('probe_success')] == 1
+        assert samples[series('probe_duration_seconds')] == 0.2
+        assert sum(1 for name in samples if name.startswith('probe_success{')) == 1
+
+    def test_results_of_other_workers(self, client, monkeypatch):
+        """Failures probed by another worker are counted, and its stale histogram is not exported."""
+        results = [probe_result(), probe_result('offline', 0.7), probe_result('offline', 0.05)]
+        monkeypatch.setattr(main, 'check_url_health', lambda url: results.pop(0))
+        for _ in range(3):
+            client.post('/api/projects/1/check')
+
+        # This worker last probed the project long ago; another one recorded the checks above
+        refreshed = LatestResults()
+        refreshed.update(1, probe_result(), 0)
+        monkeypatch.setattr(main, 'latest_results', refreshed)
+        main.load_latest_results()
+
+        samples = parse(client.get('/metrics').data.decode())
+        assert samples[series('probe_success')] == 0
+        assert samples[series('probe_consecutive_failures')] == 2
+        assert series('healthcheck_probe_duration_seconds_count') not in samples
@@ -0,0 +1,176 @@
+import pytest
+import sys
+import os
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from src import main, probe
+import json
+import shutil
+import socket
+import ssl
+import subprocess
+import threading
+import time
+
+DNS_DELAY = 0.2
+TLS_DELAY = 0.3
+TTFB_DELAY = 0.25
+TRANSFER_DELAY = 0.15
+TOLERANCE = 0.15
+
+@pytest.fixture
+def certificate(tmp_path):
+    """Self-signed certificate for localhost, generated with the openssl CLI."""
+    if not shutil.which('openssl'):
+        pytest.skip('openssl CLI not available')
+    cert, key = str(tmp_path / 'cert.pem'), str(tmp_path / 'key.pem')
+    subprocess.run([
+        'openssl', 'req', '-x509', '-newkey', 'rsa:2048', '-nodes', '-days', '1',
+        '-keyout', key, '-out', cert, '-subj', '/CN=localhost',
+        '-addext', 'subjectAltName=DNS:localhost,IP:127.0.0.1'
+    ], check=True, capture_output=True)
+    return cert, key
+
+@pytest.fixture
+def slow_dns(monkeypatch):
+    """Delay every name resolution by DNS_DELAY."""
+    resolve = socket.getaddrinfo
+
+    def delayed(*args, **kwargs):
+        time.sleep(DNS_DELAY)
+        return resolve(*args, **kwargs)
+
+    monkeypatch.setattr(socket, 'getaddrinfo', delayed)
+
+class DelayServer:
+    """Minimal HTTP(S) server sleeping before the TLS handshake, the
+    response headers and the response body."""
+
+    def __init__(self, certificate=None):
+        self.listener = socket.socket()
+        self.listener.bind(('127.0.0.1', 0))
+        self.listener.listen(8)
+        self.port = self.listener.getsockname()[1]
+        self.context = None
+        if certificate:
+            self.context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+            self.context.load_cert_chain(*certificate)
+        threading.Thread(target=self.serve, daemon=True).start()
+
+    def url(self, path='/'):
+        scheme = 'https' if self.context else 'http'
+        return f'{scheme}://localhost:{self.port}{path}'
+
+    def serve(self):
+        while True:
+            try:
+                conn, _ = self.listener.accept()
+            except OSError:
+                return
+            threading.Thread(target=self.handle, args=(conn,), daemon=True).start()
+
+    def handle(self, conn):
+        try:
+            if self.context:
+                time.sleep(TLS_DELAY)
+                conn = self.context.wrap_socket(conn, server_side=True)
+            request = b''
+            while b'\r\n\r\n' not in request:
+                request += conn.recv(4096)
+            path = request.split(b' ')[1].decode()
+
+            if path == '/old':
+                conn.sendall(b'HTTP/1.1 302 Found\r\nLocation: /new\r\nContent-Length: 0\r\n\r\n')
+                return
+            body = b'ok' * 1000
+            time.sleep(TTFB_DELAY)
+            conn.sendall(b'HTTP/1.1 200 OK\r\nContent-Length: %d\r\n\r\n' % len(body))
+            time.sleep(TRANSFER_DELAY)
+            conn.sendall(body)
+        finally:
+            conn.close()
+
+    def close(self):
+        self.listener.close()
+
+def assert_close(value, expected):
+    assert expected <= value < expected + TOLERANCE
+
+class TestPhaseTimings:
+    """Test the per-phase probe timing breakdown against injected delays."""
+
+    def test_plain_http_phases(self, slow_dns):
+        """DNS, TTFB and transfer match the delays; no TLS phase."""
+        server = DelayServer()
+        timings = probe.empty_timings()
+        status = probe.timed_get(server.url(), timings)
+        server.close()
+
+        assert status == 200
+        assert_close(timings['dns'], DNS_DELAY)
+        assert_close(timings['ttfb'], TTFB_DELAY)
+        assert_close(timings['transfer'], TRANSFER_DELAY)
+        assert timings['connect'] < TOLERANCE
+        assert timings['tls'] is None
+
+    def test_tls_handshake_phase(self, certificate):
+        """The delayed handshake shows up in the TLS phase only."""
+        server = DelayServer(certificate)
+        context = ssl.create_default_context(cafile=certificate[0])
+        timings = probe.empty_timings()
+        status = probe.timed_get(server.url(), timings, ssl_context=context)
+        server.close()
+
+        assert status == 200
+        assert_close(timings['tls'], TLS_DELAY)
+        assert_close(timings['ttfb'], TTFB_DELAY)
+
+    def test_redirect_phases_are_summed(self, slow_dns):
+        """Every hop of a redirect adds to the phases."""
+        server = DelayServer()
+        timings = probe.empty_timings()
+        status = probe.timed_get(server.url('/old'), timings)
+        server.close()
+
+        assert status == 200
+        assert_close(timings['dns'], 2 * DNS_DELAY)
+
+    def test_failed_probe_keeps_completed_phases(self, slow_dns):
+        """A refused connection still reports the DNS time."""
+        listener = socket.socket()
+        listener.bind(('127.0.0.1', 0))
+        port = listener.getsockname()[1]
+        listener.close()
+
+        result = main.check_url_health(f'http://localhost:{port}/')
+        assert result['error_message'] == 'Connection Error'
+        assert result['timings']['dns'] >= DNS_DELAY
+
+class TestPhaseTimingsAPI:
+    """Test that phase timings reach history and stats."""
+
+    def test_history_and_stats_include_timings(self, client):
+        """A real check stores its phases in raw history, rollups and stats."""
+        server = DelayServer()
+        conn = main.db.connect(main.DATABASE)
+        conn.execute('UPDATE projects SET url = ? WHERE id = 1', (server.url(),))
+        conn.commit()
+        conn.close()
+
+        check = json.loads(client.post('/api/projects/1/check').data)
+        server.close()
+        assert check['status'] == 'online'
+        assert_close(check['timings']['ttfb'], TTFB_DELAY)
+
+        history = json.loads(client.get('/api/projects/1/history').data)
+        assert history[0]['timings'] == pytest.approx(check['timings'])
+
+        now = time.time()
+        rollup = json.loads(client.get(
+            f'/api/projects/1/history?from={now - 3600}&to={now}&resolution=minute'
+        ).data)['points'][-1]
+        assert_close(rollup['timings']['transfer'], TRANSFER_DELAY)
+
+        stats = json.loads(client.get('/api/projects/1/stats').data)
+        assert stats['timings']['count'] == 1
+        assert_close(stats['timings']['ttfb'], TTFB_DELAY)
@@ -0,0 +1,104 @@
+import pytest
+import sys
+import os
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from src import main, scheduler
+from src.scheduler import next_state
+import json
+import sqlite3
+
+def result(status='online', error=None, status_code=200):
+    return {'status': status, 'response_time': None, 'status_code': status_code, 'error_message': error}
+
+CONNECTION_FAILURE = result('offline', 'Connection Error', None)
+
+@pytest.fixture
+def database(tmp_path, monkeypatch):
+    """Initialize a fresh database for the scheduler."""
+    monkeypatch.setattr(main, 'DATABASE', str(tmp_path / 'app.db'))
+    monkeypatch.setattr(main, 'CHECK_FRESHNESS', 0)
+    main.init_db()
+    return main.DATABASE
+
+class TestAdaptiveCadence:
+    """Test interval adaptation."""
+    
+    def test_stable_healthy_targets_back_off(self):
+        """Long-healthy targets are probed less and less often, up to a cap."""
+        state = None
+        intervals = []
+        for i in range(12):
+            state = next_state(state, result(), now=i)
+            intervals.append(state['interval'])
+        
+        assert intervals[0] == scheduler.BASE_INTERVAL
+        assert intervals[-1] == scheduler.MAX_INTERVAL
+        assert intervals == sorted(intervals)
+
+    def test_transition_speeds_up_probes(self):
+        """A state change switches to the fast interval for a few probes."""
+        state = None
+        for i in range(10):
+            state = next_state(state, result(), now=i)
+        state = next_state(state, result('offline', 'HTTP 503', 503), now=10)
+        assert state['interval'] == scheduler.FAST_INTERVAL
+        
+        for i in range(scheduler.FAST_CHECKS):
+            state = next_state(state, result('offline', 'HTTP 503', 503), now=11 + i)
+        assert state['interval'] == scheduler.BASE_INTERVAL
+
+class TestCircuitBreaker:
+    """Test the per-target circuit breaker."""
+    
+    def test_circuit_opens_and_retries_exponentially(self):
+        """N connection failures open the circuit; failed retries double the delay."""
+        state = None
+        for i in range(scheduler.CIRCUIT_THRESHOLD):
+            state = next_state(state, CONNECTION_FAILURE, now=0)
+        assert state['circuit_state'] == 'open'
+        assert state['next_check_at'] == scheduler.CIRCUIT_BASE_DELAY
+        
+        state = next_state(state, CONNECTION_FAILURE, now=100)
+        assert state['next_check_at'] == 100 + 2 * scheduler.CIRCUIT_BASE_DELAY
+        
+        state = next_state(state, result(), now=300)
+        assert state['circuit_state'] == 'closed'
+        assert state['circuit_open_count'] == 0
+
+    def test_open_circuit_fast_fails_on_demand_checks(self, database, monkeypatch):
+        """While open, checks return immediately without probing."""
+        calls = []
+        
+        def probe(url):
+            calls.append(url)
+            return CONNECTION_FAILURE
+        
+        monkeypatch.setattr(main, 'check_url_health', probe)
+        main.app.config['TESTING'] = True
+        with main.app.test_client() as client:
+            for _ in range(scheduler.CIRCUIT_THRESHOLD + 2):
+                data = json.loads(client.post('/api/projects/1/check').data)
+        
+        assert len(calls) == scheduler.CIRCUIT_THRESHOLD
+        assert data['error_message'] == scheduler.CIRCUIT_OPEN_ERROR
+
+class TestProbeScheduler:
+    """Test the background scheduler loop."""
+    
+    def test_run_once_probes_only_due_targets(self, database):
+        """Every target is probed once, then nothing is due until its interval passes."""
+        probed = []
+        
+        def probe(url):
+            probed.append(url)
+            return result()
+        
+        probe_scheduler = scheduler.ProbeScheduler(database, probe, main.record_check)
+        assert probe_scheduler.run_once(now=1000) == 6
+        assert probe_scheduler.run_once(now=1001) == 0
+        assert len(set(probed)) == 6
+        
+        conn = sqlite3.connect(database)
+        assert conn.execute('SELECT COUNT(*) FROM health_checks').fetchone()[0] == 6
+        conn.close()
@@ -0,0 +1,156 @@
+import pytest
+import sys
+import os
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from src import main
+from src.sharding import HashRing, ShardLeases, shard_filter, shard_of
+import collections
+import http.server
+import signal
+import sqlite3
+import subprocess
+import threading
+import time
+
+SERVICE_DIR = os.path.join(os.path.dirname(__file__), '..')
+
+@pytest.fixture
+def database(tmp_path, monkeypatch):
+    """Initialize a fresh database for the lease tables."""
+    monkeypatch.setattr(main, 'DATABASE', str(tmp_path / 'app.db'))
+    main.init_db()
+    return main.DATABASE
+
+def owners(database):
+    conn = sqlite3.connect(database)
+    rows = conn.execute('SELECT shard, owner FROM checker_leases').fetchall()
+    conn.close()
+    return dict(rows)
+
+class TestHashRing:
+    """Test the consistent hash ring."""
+
+    def test_removing_a_worker_only_moves_its_shards(self):
+        """Shards of the remaining workers keep their owner."""
+        before = HashRing(['a', 'b', 'c']).assignment(64)
+        after = HashRing(['a', 'b']).assignment(64)
+
+        assert set(before.values()) == {'a', 'b', 'c'}
+        for shard, owner in before.items():
+            if owner != 'c':
+                assert after[shard] == owner
+
+    def test_sql_shard_filter_matches_python(self, database):
+        """The SQL shard expression agrees with shard_of()."""
+        conn = sqlite3.connect(database)
+        conn.executemany('INSERT INTO projects (name, url) VALUES (?, ?)',
+                         [(f'p{i}', 'http://localhost') for i in range(100)])
+        sql, params = shard_filter({3, 5}, 8)
+        ids = [row[0] for row in conn.execute(f'SELECT p.id FROM projects p WHERE {sql}', params)]
+        conn.close()
+
+        assert ids
+        assert all(shard_of(project_id, 8) in (3, 5) for project_id in ids)
+
+class TestShardLeases:
+    """Test lease acquisition, hand-over and expiry."""
+
+    def test_workers_split_shards_exclusively(self, database):
+        """Two workers end up owning disjoint halves of the shards."""
+        a = ShardLeases(database, 'a', num_shards=16, lease_ttl=30, worker_ttl=15, probe_margin=5)
+        b = ShardLeases(database, 'b', num_shards=16, lease_ttl=30, worker_ttl=15, probe_margin=5)
+
+        a.refresh(now=1000)
+        assert a.probe_shards(now=1000) == set(range(16))
+
+        # b joins: a drains and releases its moved shards, then b takes them
+        b.refresh(now=1001)
+        a.refresh(now=1002)
+        acquired, _ = b.refresh(now=1003)
+
+        assert acquired
+        assert a.probe_shards(now=1003) | b.probe_shards(now=1003) == set(range(16))
+        assert not a.probe_shards(now=1003) & b.probe_shards(now=1003)
+
+    def test_dead_worker_leases_expire(self, database):
+        """Shards of a worker that stopped heartbeating move after the lease TTL."""
+        a = ShardLeases(database, 'a', num_shards=8, lease_ttl=30, worker_ttl=15, probe_margin=5)
+        b = ShardLeases(database, 'b', num_shards=8, lease_ttl=30, worker_ttl=15, probe_margin=5)
+        a.refresh(now=1000)
+
+        # a is still alive in the ring until its heartbeat is 15s old
+        b.refresh(now=1010)
+        assert not b.probe_shards(now=1010) - {s for s, o in HashRing(['a', 'b']).assignment(8).items() if o == 'b'}
+
+        b.refresh(now=1031)
+        assert b.probe_shards(now=1031) == set(range(8))
+        assert {owners(database)[shard] for shard in range(8)} == {'b'}
+
+    def test_no_probe_started_near_lease_expiry(self, database):
+        """begin() refuses shards without enough lease time left."""
+        a = ShardLeases(database, 'a', num_shards=4, lease_ttl=30, worker_ttl=15, probe_margin=10)
+        a.refresh(now=1000)
+
+        assert a.begin(0, now=1010)
+        a.end(0)
+        assert not a.begin(0, now=1025)
+
+class ProbeLog(http.server.BaseHTTPRequestHandler):
+    hits = collections.defaultdict(list)
+
+    def do_GET(self):
+        ProbeLog.hits[self.path].append(time.time())
+        self.send_response(200)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+class TestWorkerProcesses:
+    """Run several worker processes against one database file."""
+
+    def test_workers_split_targets_and_take_over_dead_worker(self, database):
+        """Every target is probed at its cadence by exactly one worker, also after a kill."""
+        server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), ProbeLog)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        url = f'http://127.0.0.1:{server.server_address[1]}'
+
+        conn = sqlite3.connect(database)
+        conn.execute('DELETE FROM projects')
+        conn.executemany('INSERT INTO projects (name, url) VALUES (?, ?)',
+                         [(f'p{i}', f'{url}/p/{i}') for i in range(24)])
+        conn.commit()
+        conn.close()
+
+        env = dict(os.environ,
+                   HEALTHCHECK_SHARDS='16',
+                   HEALTHCHECK_BASE_INTERVAL='1', HEALTHCHECK_FAST_INTERVAL='1', HEALTHCHECK_MAX_INTERVAL='1',
+                   HEALTHCHECK_SCHEDULER_TICK='0.1',
+                   HEALTHCHECK_LEASE_TTL='1.5', HEALTHCHECK_WORKER_TTL='1', HEALTHCHECK_LEASE_PROBE_MARGIN='0.5')
+        workers = [
+            subprocess.Popen([sys.executable, 'src/worker.py', '--worker-id', f'w{i}', '--database', database],
+                             cwd=SERVICE_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            for i in range(3)
+        ]
+        try:
+            time.sleep(4)
+            workers[0].send_signal(signal.SIGKILL)
+            killed_at = time.time()
+            time.sleep(5)
+        finally:
+            for worker in workers[1:]:
+                worker.send_signal(signal.SIGTERM)
+            for worker in workers:
+                worker.wait(timeout=10)
+            server.shutdown()
+
+        assert len(ProbeLog.hits) == 24
+        for path, hits in ProbeLog.hits.items():
+            gaps = [later - earlier for earlier, later in zip(hits, hits[1:])]
+            assert min(gaps) > 0.5, f'{path} probed twice'
+            assert max(hits) > killed_at + 3, f'{path} not taken over'
+
+        # Graceful shutdown released every lease
+        assert set(owners(database).values()) == {None}
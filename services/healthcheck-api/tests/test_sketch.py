@@ -0,0 +1,48 @@
+import pytest
+import sys
+import os
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from src.sketch import DDSketch, merge_serialized
+import random
+
+class TestDDSketch:
+    """Test the latency quantile sketch."""
+    
+    def test_quantiles_within_relative_error(self):
+        """Quantiles stay within the configured relative accuracy."""
+        rng = random.Random(42)
+        values = sorted(rng.lognormvariate(-2, 1) for _ in range(10000))
+        sketch = DDSketch()
+        for value in values:
+            sketch.add(value)
+        
+        for q in (0.5, 0.95, 0.99):
+            exact = values[int(q * (len(values) - 1))]
+            assert sketch.quantile(q) == pytest.approx(exact, rel=0.02)
+
+    def test_serialization_roundtrip(self):
+        """Sketches survive serialization unchanged."""
+        sketch = DDSketch()
+        for value in (0.0, 0.012, 0.25, 1.5, 9.0):
+            sketch.add(value)
+        restored = DDSketch.from_bytes(sketch.to_bytes())
+        
+        assert restored.count == sketch.count
+        assert restored.bins == sketch.bins
+        assert restored.min == sketch.min
+        assert restored.max == sketch.max
+        assert restored.quantiles() == sketch.quantiles()
+
+    def test_merge_matches_single_sketch(self):
+        """Merging partial sketches equals sketching all values at once."""
+        values = [i / 1000 for i in range(1, 2001)]
+        whole = DDSketch()
+        parts = [DDSketch(), DDSketch()]
+        for i, value in enumerate(values):
+            whole.add(value)
+            parts[i % 2].add(value)
+        
+        merged = merge_serialized(part.to_bytes() for part in parts)
+        assert merged.count == whole.count
+        assert merged.quantiles() == whole.quantiles()
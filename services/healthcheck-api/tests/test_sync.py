@@ -0,0 +1,173 @@
+import pytest
+import sys
+import os
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from src import main, compact_storage
+from src.sync import BackendSync
+import json
+import requests
+import subprocess
+
+@pytest.fixture(autouse=True)
+def backend_url(monkeypatch):
+    """Configure a backend URL, so that init_db seeds no sample projects."""
+    monkeypatch.setattr(main, 'BACKEND_API_URL', 'http://backend.invalid')
+
+BACKEND_DIR = os.path.join(os.path.dirname(__file__), '..', '..', '..', 'backend-api')
+
+# backend-api projects blueprint served on a random port with its own database
+BACKEND_SERVER = '''
+import sys
+from flask import Flask
+from werkzeug.serving import make_server
+from src.models.database import db
+from src.routes.projects import projects_bp
+
+app = Flask(__name__)
+app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + sys.argv[1]
+app.register_blueprint(projects_bp, url_prefix='/api')
+db.init_app(app)
+with app.app_context():
+    db.create_all()
+
+server = make_server('127.0.0.1', 0, app, threaded=True)
+print(server.port, flush=True)
+server.serve_forever()
+'''
+
+@pytest.fixture
+def backend(tmp_path):
+    """A running backend-api (projects routes only); yields its base URL."""
+    pytest.importorskip('flask_sqlalchemy')
+    process = subprocess.Popen(
+        [sys.executable, '-c', BACKEND_SERVER, str(tmp_path / 'backend.db')],
+        cwd=BACKEND_DIR, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True
+    )
+    port = process.stdout.readline().strip()
+    if not port:
+        process.kill()
+        pytest.skip('backend-api could not be started')
+    yield f'http://127.0.0.1:{port}'
+    process.terminate()
+    process.wait()
+
+def create_project(backend, name, url):
+    response = requests.post(f'{backend}/api/projects', json={'name': name, 'url': url})
+    return response.json()['project']
+
+def backend_projects(backend):
+    return {project['id']: project for project in requests.get(f'{backend}/api/projects').json()['projects']}
+
+def targets():
+    conn = main.db.connect(main.DATABASE)
+    rows = conn.execute('SELECT external_id, name, url, status FROM projects ORDER BY external_id').fetchall()
+    conn.close()
+    return rows
+
+HISTORY_TABLES = ('health_checks', 'health_check_rollups_minute', 'health_check_rollups_hour',
+                  'health_check_rollups_day', 'health_check_runs', 'health_check_samples', 'probe_state')
+
+def history_counts(project_id):
+    conn = main.db.connect(main.DATABASE)
+    counts = {
+        table: conn.execute(f'SELECT COUNT(*) FROM {table} WHERE project_id = ?', (project_id,)).fetchone()[0]
+        for table in HISTORY_TABLES
+    }
+    conn.close()
+    return counts
+
+def probe_result(status='online'):
+    return {
+        'status': status,
+        'response_time': 0.1 if status == 'online' else None,
+        'status_code': 200 if status == 'online' else None,
+        'error_message': None if status == 'online' else 'Connection Error'
+    }
+
+class TestBackendSync:
+    """Test target pulls and status pushes against a running backend-api."""
+
+    def test_no_sample_projects_with_a_backend(self, client):
+        """Targets only come from the backend once it is configured."""
+        assert json.loads(client.get('/api/projects').data) == []
+
+    def test_pull_then_push_only_changed_statuses(self, client, backend, monkeypatch):
+        """Targets are imported, and only statuses that moved are written back."""
+        first = create_project(backend, 'Shop', 'http://shop.example.com')
+        second = create_project(backend, 'Blog', 'http://blog.example.com')
+        sync = BackendSync(main.DATABASE, backend, on_targets_changed=main.apply_target_changes)
+
+        assert sync.run_once()['changed'] == 2
+        assert [row[:3] for row in targets()] == [
+            (first['id'], 'Shop', 'http://shop.example.com'),
+            (second['id'], 'Blog', 'http://blog.example.com')
+        ]
+
+        # A probe moves the first target only
+        monkeypatch.setattr(main, 'check_url_health', lambda url: probe_result())
+        conn = main.db.connect(main.DATABASE)
+        project_id = conn.execute('SELECT id FROM projects WHERE external_id = ?', (first['id'],)).fetchone()[0]
+        conn.close()
+        client.post(f'/api/projects/{project_id}/check')
+
+        result = sync.run_once()
+        assert (result['pushed'], result['updated']) == (1, 1)
+        projects = backend_projects(backend)
+        assert projects[first['id']]['status'] == 'online'
+        assert projects[second['id']]['status'] == 'unknown'
+        # Status pushes do not count as project modifications
+        assert projects[first['id']]['updated_at'] == first['updated_at']
+
+        # Nothing left to send, and a repeated status is not re-sent
+        client.post(f'/api/projects/{project_id}/check')
+        assert sync.run_once()['pushed'] == 0
+        assert json.loads(client.get('/api/sync').data)['pending_statuses'] == 0
+
+    def test_incremental_pull_and_deletions(self, client, backend, monkeypatch):
+        """Only projects updated since the watermark are fetched; full pulls drop deleted ones."""
+        projects = [create_project(backend, f'Site {i}', f'http://site{i}.example.com') for i in range(5)]
+        sync = BackendSync(main.DATABASE, backend, on_targets_changed=main.apply_target_changes)
+        assert sync.run_once()['pulled'] == 5
+
+        requests.put(f'{backend}/api/projects/{projects[1]["id"]}', json={'url': 'http://moved.example.com'})
+        result = sync.run_once()
+        # The inclusive bound brings back the newest already-seen project too
+        assert result['pulled'] <= 2
+        assert result['changed'] == 1
+        assert dict((row[0], row[2]) for row in targets())[projects[1]['id']] == 'http://moved.example.com'
+        assert json.loads(client.get('/api/sync').data)['synced_targets'] == 5
+
+        # Checks of the first target, stored as rows then as runs
+        monkeypatch.setattr(main, 'check_url_health', lambda url: probe_result())
+        client.post('/api/projects/1/check')
+        monkeypatch.setattr(main, 'STORAGE_MODE', 'compact')
+        client.post('/api/projects/1/check')
+        assert history_counts(1) != {table: 0 for table in HISTORY_TABLES}
+
+        requests.delete(f'{backend}/api/projects/{projects[0]["id"]}')
+        sync.full_interval = 0
+        result = sync.run_once()
+        assert result['removed'] == 1
+        assert projects[0]['id'] not in [row[0] for row in targets()]
+        assert history_counts(1) == {table: 0 for table in HISTORY_TABLES}
+        assert compact_storage.pending_runs(1) == {}
+        conn = main.db.connect(main.DATABASE)
+        assert conn.execute("SELECT scope FROM latency_sketches").fetchall() == [('global',)]
+        conn.close()
+
+    def test_url_change_resets_status(self, client, backend, monkeypatch):
+        """A target pointing at a new URL is unknown until probed again."""
+        project = create_project(backend, 'Shop', 'http://shop.example.com')
+        sync = BackendSync(main.DATABASE, backend, on_targets_changed=main.apply_target_changes)
+        sync.run_once()
+        monkeypatch.setattr(main, 'check_url_health', lambda url: probe_result())
+        client.post('/api/projects/1/check')
+        sync.run_once()
+
+        requests.put(f'{backend}/api/projects/{project["id"]}', json={'url': 'http://shop2.example.com'})
+        sync.run_once()
+        assert targets()[0][2:] == ('http://shop2.example.com', 'unknown')
+        assert main.latest_results.get(1) is None
+        # The reset is local: the backend keeps the last probed status
+        assert backend_projects(backend)[project['id']]['status'] == 'online'
@@ -0,0 +1,173 @@
+"""Load balancing over the targets of a service, with passive outlier ejection
+
+A service's targets are its `target_url` plus its `service_targets` rows.
+`services.load_balancing` (else LOAD_BALANCING) picks one per request:
+
+- `round_robin`: each available target in turn;
+- `least_outstanding`: the target with the fewest requests in progress;
+- `p2c_ewma`: the better of two random targets, scored by their
+  exponentially weighted moving average latency (decaying with a time
+  constant of EWMA_DECAY seconds) times their requests in progress plus one.
+
+A target failing EJECTION_CONSECUTIVE_FAILURES requests in a row (connection
+errors, timeouts, 5xx responses) is ejected for EJECTION_BASE_TIME seconds
+times the number of times it was ejected, capped to EJECTION_MAX_TIME, and
+takes requests again afterwards. At most EJECTION_MAX_PERCENT of the
+targets of a service are ejected at once.
+"""
+import math
+import os
+import random
+import threading
+import time
+
+# Default balancing of services without load_balancing
+LOAD_BALANCING = os.environ.get('BRIDGE_LOAD_BALANCING', 'round_robin')
+# Seconds after which a latency sample weighs 1/e in the EWMA
+EWMA_DECAY = float(os.environ.get('BRIDGE_EWMA_DECAY', 10))
+# Consecutive failures ejecting a target
+EJECTION_CONSECUTIVE_FAILURES = int(os.environ.get('BRIDGE_EJECTION_CONSECUTIVE_FAILURES', 5))
+# Seconds of the first ejection of a target (multiplied for the next ones)
+EJECTION_BASE_TIME = float(os.environ.get('BRIDGE_EJECTION_BASE_TIME', 30))
+# Longest ejection in seconds
+EJECTION_MAX_TIME = float(os.environ.get('BRIDGE_EJECTION_MAX_TIME', 300))
+# Largest share of the targets of a service ejected at once
+EJECTION_MAX_PERCENT = float(os.environ.get('BRIDGE_EJECTION_MAX_PERCENT', 50))
+
+ALGORITHMS = ('round_robin', 'least_outstanding', 'p2c_ewma')
+
+
+class TargetState:
+    """Load, latency and health of one target of a service"""
+
+    def __init__(self, url):
+        self.url = url
+        self.outstanding = 0
+        self.ewma = 0.0
+        self.sampled_at = None
+        self.requests = 0
+        self.failures = 0
+        self.consecutive_failures = 0
+        self.ejections = 0
+        self.ejected_until = None
+
+    def is_ejected(self, now):
+        return self.ejected_until is not None and now < self.ejected_until
+
+    def cost(self):
+        return self.ewma * (self.outstanding + 1)
+
+    def snapshot(self, now):
+        return {
+            'url': self.url,
+            'outstanding': self.outstanding,
+            'ewma_ms': round(self.ewma * 1000, 3),
+            'requests': self.requests,
+            'failures': self.failures,
+            'ejected': self.is_ejected(now),
+            'ejections': self.ejections
+        }
+
+
+class Balancer:
+    """Target states of every service and the balancing algorithms"""
+
+    def __init__(self, algorithm=LOAD_BALANCING, ewma_decay=EWMA_DECAY,
+                 consecutive_failures=EJECTION_CONSECUTIVE_FAILURES, base_ejection_time=EJECTION_BASE_TIME,
+                 max_ejection_time=EJECTION_MAX_TIME, max_ejection_percent=EJECTION_MAX_PERCENT, rng=None):
+        self.algorithm = algorithm
+        self.ewma_decay = ewma_decay
+        self.consecutive_failures = consecutive_failures
+        self.base_ejection_time = base_ejection_time
+        self.max_ejection_time = max_ejection_time
+        self.max_ejection_percent = max_ejection_percent
+        self.rng = rng or random.Random()
+        self._lock = threading.Lock()
+        # service id -> {url: TargetState}
+        self._targets = {}
+        self._next = {}
+
+    def _states(self, service):
+        # Targets of the service as currently configured, keeping the state
+        # of the ones it already had
+        urls = service.get('targets') or [service['target_url']]
+        states = self._targets.get(service['id'], {})
+        if list(states) != urls:
+            states = self._targets[service['id']] = {url: states.get(url) or TargetState(url) for url in urls}
+        return list(states.values())
+
+    def pick(self, service, now=None, exclude=()):
+        """Target for the next request of `service`, counted as outstanding
+
+        Targets whose URL is in `exclude` (already tried) are avoided unless
+        no other one is available.
+        """
+        now = time.monotonic() if now is None else now
+        algorithm = service.get('load_balancing') or self.algorithm
+        with self._lock:
+            targets = self._states(service)
+            healthy = [target for target in targets if not target.is_ejected(now)] or targets
+            available = [target for target in healthy if target.url not in exclude] or healthy
+            if len(available) == 1:
+                target = available[0]
+            elif algorithm == 'least_outstanding':
+                fewest = min(target.outstanding for target in available)
+                candidates = [target for target in available if target.outstanding == fewest]
+                target = candidates[self._advance(service['id']) % len(candidates)]
+            elif algorithm == 'p2c_ewma':
+                first, second = self.rng.sample(available, 2)
+                target = first if first.cost() <= second.cost() else second
+            else:
+                target = available[self._advance(service['id']) % len(available)]
+            target.outstanding += 1
+            target.requests += 1
+            return target
+
+    def _advance(self, service_id):
+        position = self._next.get(service_id, 0)
+        self._next[service_id] = position + 1
+        return position
+
+    def observe(self, service, target, latency, failed, now=None):
+        """Record the latency and outcome of a request sent to `target`"""
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            if target.sampled_at is None:
+                target.ewma = latency
+            else:
+                weight = math.exp(-max(now - target.sampled_at, 0) / self.ewma_decay)
+                target.ewma = target.ewma * weight + latency * (1 - weight)
+            target.sampled_at = now
+            if not failed:
+                target.consecutive_failures = 0
+                return
+            target.failures += 1
+            target.consecutive_failures += 1
+            if target.consecutive_failures >= self.consecutive_failures and not target.is_ejected(now):
+                self._eject(service['id'], target, now)
+
+    def _eject(self, service_id, target, now):
+        targets = list(self._targets.get(service_id, {}).values())
+        ejected = sum(1 for other in targets if other.is_ejected(now))
+        if (ejected + 1) * 100 > self.max_ejection_percent * len(targets):
+            return
+        target.ejections += 1
+        target.ejected_until = now + min(self.base_ejection_time * target.ejections, self.max_ejection_time)
+        target.consecutive_failures = 0
+
+    def release(self, target):
+        """The request sent to `target` is over"""
+        with self._lock:
+            target.outstanding -= 1
+
+    def reset(self):
+        with self._lock:
+            self._targets.clear()
+            self._next.clear()
+
+    def stats(self, now=None):
+        """Target states by service id"""
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            return {service_id: [target.snapshot(now) for target in states.values()]
+                    for service_id, states in self._targets.items()}
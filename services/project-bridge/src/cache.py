@@ -0,0 +1,377 @@
+"""Shared HTTP cache for GET responses of services with `cache_enabled`
+
+Follows the shared cache rules of RFC 9111 where they matter here:
+responses are stored unless `no-store`/`private` (or the request carried
+Authorization without `public`/`s-maxage`), their freshness comes from
+`s-maxage`, `max-age` or `Expires`, and `Vary` selects the variant
+matching the request headers. A stale entry (or one marked `no-cache`)
+with an ETag or Last-Modified is revalidated with If-None-Match /
+If-Modified-Since; a 304 refreshes it instead of transferring the body
+again. Successful unsafe requests invalidate the cached URL.
+
+Bodies are kept in a memory LRU bounded to CACHE_MEMORY_SIZE bytes. With
+CACHE_DIR set, bodies larger than CACHE_MEMORY_ENTRY_SIZE go to a second
+LRU of files there, bounded to CACHE_DISK_SIZE bytes. Responses are
+copied into the cache while they are streamed to the client, and only
+stored once complete.
+"""
+import io
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from email.utils import parsedate_to_datetime
+
+from werkzeug.datastructures import Headers
+from werkzeug.wsgi import FileWrapper
+
+# Bytes of bodies kept in memory
+CACHE_MEMORY_SIZE = int(os.environ.get('BRIDGE_CACHE_MEMORY_SIZE', 64 * 1024 * 1024))
+# Bodies larger than this go to the disk tier (or are not cached without one)
+CACHE_MEMORY_ENTRY_SIZE = int(os.environ.get('BRIDGE_CACHE_MEMORY_ENTRY_SIZE', 1024 * 1024))
+# Directory of the disk tier (disabled when unset)
+CACHE_DIR = os.environ.get('BRIDGE_CACHE_DIR')
+# Bytes of bodies kept on disk
+CACHE_DISK_SIZE = int(os.environ.get('BRIDGE_CACHE_DISK_SIZE', 1024 * 1024 * 1024))
+# Largest body cached at all
+CACHE_MAX_ENTRY_SIZE = int(os.environ.get('BRIDGE_CACHE_MAX_ENTRY_SIZE', 64 * 1024 * 1024))
+
+# Statuses cacheable by default (RFC 9110, section 15.1), except 206: partial
+# content is not stored, nor are ranges served from stored responses
+CACHEABLE_STATUSES = frozenset((200, 203, 204, 300, 301, 308, 404, 405, 410, 414, 501))
+
+# Request headers asking for part of a response
+RANGE_HEADERS = ('Range', 'If-Range')
+
+# Response headers not stored with the entry
+UNCACHED_HEADERS = frozenset(('age', 'set-cookie'))
+
+
+def parse_cache_control(value):
+    """Cache-Control directives as a dict (valueless ones map to True)"""
+    directives = {}
+    for part in (value or '').split(','):
+        name, _, argument = part.strip().partition('=')
+        if name:
+            directives[name.lower()] = argument.strip('"') if argument else True
+    return directives
+
+
+def _seconds(value):
+    try:
+        return max(int(value), 0)
+    except (TypeError, ValueError):
+        return 0
+
+
+def _http_date(value):
+    try:
+        return parsedate_to_datetime(value).timestamp()
+    except (TypeError, ValueError, IndexError):
+        return None
+
+
+def freshness_lifetime(headers, now):
+    """Seconds a response stays fresh, or None without explicit freshness"""
+    directives = parse_cache_control(headers.get('Cache-Control'))
+    if 's-maxage' in directives:
+        return _seconds(directives['s-maxage'])
+    if 'max-age' in directives:
+        return _seconds(directives['max-age'])
+    if 'Expires' in headers:
+        expires = _http_date(headers['Expires'])
+        date = _http_date(headers.get('Date')) or now
+        # An invalid Expires means already expired
+        return max(expires - date, 0) if expires is not None else 0
+    return None
+
+
+def vary_names(headers):
+    """Lower-cased request header names listed in Vary"""
+    names = []
+    for value in headers.getlist('Vary'):
+        names.extend(name.strip().lower() for name in value.split(',') if name.strip())
+    return tuple(sorted(set(names)))
+
+
+class CacheEntry:
+    """A stored response; `body` is bytes (memory tier) or None (on disk at `path`)"""
+
+    __slots__ = ('key', 'status', 'headers', 'body', 'path', 'size', 'stored_at', 'initial_age', 'lifetime')
+
+    def __init__(self, key, status, headers, body, path, size, stored_at, initial_age, lifetime):
+        self.key = key
+        self.status = status
+        self.headers = headers
+        self.body = body
+        self.path = path
+        self.size = size
+        self.stored_at = stored_at
+        self.initial_age = initial_age
+        self.lifetime = lifetime
+
+    def age(self, now):
+        return self.initial_age + max(now - self.stored_at, 0)
+
+    def is_fresh(self, now, request_directives=None):
+        if self.lifetime is None or 'no-cache' in parse_cache_control(self.headers.get('Cache-Control')):
+            return False
+        request_directives = request_directives or {}
+        if 'no-cache' in request_directives:
+            return False
+        lifetime = self.lifetime
+        if 'max-age' in request_directives:
+            lifetime = min(lifetime, _seconds(request_directives['max-age']))
+        return self.age(now) < lifetime
+
+    @property
+    def etag(self):
+        return self.headers.get('ETag')
+
+    @property
+    def last_modified(self):
+        return self.headers.get('Last-Modified')
+
+    def validators(self):
+        """Conditional request headers revalidating this entry"""
+        validators = {}
+        if self.etag:
+            validators['If-None-Match'] = self.etag
+        if self.last_modified:
+            validators['If-Modified-Since'] = self.last_modified
+        return validators
+
+
+class CacheFill:
+    """Copy of a response body being streamed, stored once complete"""
+
+    def __init__(self, cache, key, status, headers, now, lifetime, initial_age):
+        self.cache = cache
+        self.key = key
+        self.status = status
+        self.headers = headers
+        self.now = now
+        self.lifetime = lifetime
+        self.initial_age = initial_age
+        self.size = 0
+        self._chunks = []
+        self._file = None
+        self.abandoned = False
+
+    def write(self, chunk):
+        if self.abandoned:
+            return
+        self.size += len(chunk)
+        if self.size > self.cache.max_entry_size:
+            self.abort()
+            return
+        if self._file is None and self.size > self.cache.memory_entry_size:
+            if self.cache.disk_dir is None:
+                self.abort()
+                return
+            # Too large for the memory tier: continue on disk
+            self._file = tempfile.NamedTemporaryFile(dir=self.cache.disk_dir, prefix='fill-', delete=False)
+            self._file.writelines(self._chunks)
+            self._chunks = []
+        if self._file is not None:
+            self._file.write(chunk)
+        else:
+            self._chunks.append(chunk)
+
+    def relay(self, chunks):
+        """Yield `chunks`, keeping a copy stored once they are exhausted"""
+        for chunk in chunks:
+            self.write(chunk)
+            yield chunk
+        self.finish()
+
+    def finish(self):
+        """Store the complete response"""
+        if self.abandoned:
+            return
+        if self._file is not None:
+            self._file.close()
+            body, path = None, self._file.name
+        else:
+            body, path = b''.join(self._chunks), None
+        self.abandoned = True
+        self.cache.store(CacheEntry(self.key, self.status, self.headers, body, path, self.size, self.now,
+                                    self.initial_age, self.lifetime))
+
+    def abort(self):
+        """Drop the partial copy (client went away, body too large)"""
+        if self.abandoned:
+            return
+        self.abandoned = True
+        self._chunks = []
+        if self._file is not None:
+            self._file.close()
+            os.unlink(self._file.name)
+
+
+class ResponseCache:
+    """Memory and disk LRUs of responses keyed by URL and Vary'd request headers"""
+
+    def __init__(self, memory_size=CACHE_MEMORY_SIZE, memory_entry_size=CACHE_MEMORY_ENTRY_SIZE, disk_dir=CACHE_DIR,
+                 disk_size=CACHE_DISK_SIZE, max_entry_size=CACHE_MAX_ENTRY_SIZE):
+        self.memory_size = memory_size
+        self.memory_entry_size = memory_entry_size
+        self.disk_dir = disk_dir
+        self.disk_size = disk_size
+        self.max_entry_size = max_entry_size if disk_dir else min(max_entry_size, memory_entry_size)
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        self._memory = OrderedDict()
+        self._disk = OrderedDict()
+        self._memory_bytes = 0
+        self._disk_bytes = 0
+        # URL -> Vary'd header names of its stored responses
+        self._vary = {}
+        self.counts = {'hits': 0, 'misses': 0, 'revalidated': 0, 'stores': 0, 'evictions': 0}
+
+    def key(self, url, request_headers, names):
+        return (url,) + tuple(request_headers.get(name, '') for name in names)
+
+    def count(self, outcome):
+        with self._lock:
+            self.counts[outcome] += 1
+
+    def lookup(self, url, request_headers):
+        """Entry stored for this URL and request headers, or None"""
+        if any(name in request_headers for name in RANGE_HEADERS):
+            return None
+        with self._lock:
+            names = self._vary.get(url)
+            if names is None:
+                return None
+            key = self.key(url, request_headers, names)
+            for tier in (self._memory, self._disk):
+                entry = tier.get(key)
+                if entry is not None:
+                    tier.move_to_end(key)
+                    return entry
+            return None
+
+    def begin(self, url, request_headers, status, response_headers, now):
+        """CacheFill for a response about to be streamed, or None if it cannot be stored"""
+        request_directives = parse_cache_control(request_headers.get('Cache-Control'))
+        directives = parse_cache_control(response_headers.get('Cache-Control'))
+        if status not in CACHEABLE_STATUSES or 'no-store' in request_directives:
+            return None
+        if any(name in request_headers for name in RANGE_HEADERS):
+            return None
+        if 'no-store' in directives or 'private' in directives:
+            return None
+        if 'Authorization' in request_headers and not ({'public', 's-maxage', 'must-revalidate'} & set(directives)):
+            return None
+        names = vary_names(response_headers)
+        if '*' in names:
+            return None
+        lifetime = freshness_lifetime(response_headers, now)
+        if lifetime is None and 'ETag' not in response_headers and 'Last-Modified' not in response_headers:
+            return None
+        length = response_headers.get('Content-Length')
+        if length is not None and length.isdigit() and int(length) > self.max_entry_size:
+            return None
+
+        headers = Headers([(name, value) for name, value in response_headers.items()
+                           if name.lower() not in UNCACHED_HEADERS])
+        with self._lock:
+            self._vary[url] = names
+        return CacheFill(self, self.key(url, request_headers, names), status, headers, now, lifetime,
+                         _seconds(response_headers.get('Age')))
+
+    def store(self, entry):
+        replaced, evicted = [], []
+        with self._lock:
+            self._remove(entry.key, replaced)
+            if entry.path is None:
+                self._memory[entry.key] = entry
+                self._memory_bytes += entry.size
+                while self._memory_bytes > self.memory_size and self._memory:
+                    evicted.append(self._memory.popitem(last=False)[1])
+                    self._memory_bytes -= evicted[-1].size
+            else:
+                self._disk[entry.key] = entry
+                self._disk_bytes += entry.size
+                while self._disk_bytes > self.disk_size and self._disk:
+                    evicted.append(self._disk.popitem(last=False)[1])
+                    self._disk_bytes -= evicted[-1].size
+            self.counts['stores'] += 1
+            self.counts['evictions'] += len(evicted)
+        self._discard(replaced + evicted)
+
+    def revalidated(self, entry, response_headers, now):
+        """Refresh `entry` from the headers of a 304 response"""
+        with self._lock:
+            for name, value in response_headers.items():
+                if name.lower() not in UNCACHED_HEADERS and name.lower() != 'content-length':
+                    entry.headers.set(name, value)
+            entry.stored_at = now
+            entry.initial_age = _seconds(response_headers.get('Age'))
+            entry.lifetime = freshness_lifetime(entry.headers, now)
+            self.counts['revalidated'] += 1
+
+    def invalidate(self, url):
+        """Drop every stored variant of `url`"""
+        evicted = []
+        with self._lock:
+            self._vary.pop(url, None)
+            for key in [key for key in list(self._memory) + list(self._disk) if key[0] == url]:
+                self._remove(key, evicted)
+        self._discard(evicted)
+
+    def _remove(self, key, evicted):
+        for tier in (self._memory, self._disk):
+            entry = tier.pop(key, None)
+            if entry is not None:
+                evicted.append(entry)
+                if tier is self._memory:
+                    self._memory_bytes -= entry.size
+                else:
+                    self._disk_bytes -= entry.size
+
+    def _discard(self, entries):
+        for entry in entries:
+            if entry.path is not None:
+                try:
+                    os.unlink(entry.path)
+                except FileNotFoundError:
+                    pass
+
+    def open_body(self, entry, chunk_size=64 * 1024):
+        """Iterable of the chunks of a stored body, or None if evicted meanwhile
+
+        Disk bodies are opened right away: the open file survives a later
+        eviction of the entry.
+        """
+        if entry.path is None:
+            return FileWrapper(io.BytesIO(entry.body), chunk_size)
+        try:
+            return FileWrapper(open(entry.path, 'rb'), chunk_size)
+        except FileNotFoundError:
+            return None
+
+    def clear(self):
+        with self._lock:
+            entries = list(self._memory.values()) + list(self._disk.values())
+            self._memory.clear()
+            self._disk.clear()
+            self._memory_bytes = self._disk_bytes = 0
+            self._vary.clear()
+            for outcome in self.counts:
+                self.counts[outcome] = 0
+        self._discard(entries)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.counts['hits'] + self.counts['misses'] + self.counts['revalidated']
+            return {
+                **self.counts,
+                'hit_ratio': (self.counts['hits'] + self.counts['revalidated']) / lookups if lookups else None,
+                'memory_entries': len(self._memory),
+                'memory_bytes': self._memory_bytes,
+                'disk_entries': len(self._disk),
+                'disk_bytes': self._disk_bytes
+            }
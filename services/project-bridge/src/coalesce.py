@@ -0,0 +1,257 @@
+"""Coalescing of identical concurrent GETs into a single upstream request
+
+Requests with the same target URL and the same values of the varying
+headers (the service's `coalesce_headers`, else COALESCE_HEADERS, plus the
+conditional and range headers, which always vary) join the request already
+in flight for that key instead of sending their own. The first one is the
+leader and sends the request; the followers wait for its response and are
+fanned out from it. A response meant for the leader alone (one setting
+cookies, or `Cache-Control: private`) is not shared: the followers send
+their own request instead.
+
+The streamed body is shared through a buffer of chunks: whichever client
+needs the next chunk pulls it from the upstream, and chunks every client
+has relayed are dropped. Fast clients wait while slower ones are
+COALESCE_BUFFER_SIZE bytes behind. A flight takes no new followers once
+its first chunk has been dropped, and hands its upstream response back
+(closing it) once the body is exhausted or every client went away.
+"""
+import os
+import threading
+
+from werkzeug.datastructures import Headers
+
+# Coalesce identical concurrent GETs (0 to disable)
+COALESCE_ENABLED = os.environ.get('BRIDGE_COALESCE', '1') != '0'
+# Request headers that make two GETs different, unless the service sets coalesce_headers
+COALESCE_HEADERS = os.environ.get('BRIDGE_COALESCE_HEADERS',
+                                  'Accept, Accept-Encoding, Accept-Language, Authorization, Cookie')
+# Bytes of body buffered between the fastest and the slowest client of a flight
+COALESCE_BUFFER_SIZE = int(os.environ.get('BRIDGE_COALESCE_BUFFER_SIZE', 4 * 1024 * 1024))
+
+# Headers that change the upstream response and are always part of the key
+CONDITIONAL_HEADERS = ('if-match', 'if-none-match', 'if-modified-since', 'if-unmodified-since', 'if-range', 'range')
+
+
+def shareable(headers):
+    """Whether a response may be fanned out to other clients than the leader"""
+    headers = Headers(headers)
+    directives = {part.split('=', 1)[0].strip().lower() for part in headers.get('Cache-Control', '').split(',')}
+    return 'Set-Cookie' not in headers and 'private' not in directives
+
+
+def header_names(value):
+    """Lower-cased header names of a comma-separated list"""
+    return tuple(name.strip().lower() for name in (value or '').split(',') if name.strip())
+
+
+class FlightReader:
+    """One client's position in the body of a flight"""
+
+    def __init__(self, flight):
+        self.flight = flight
+        self.position = 0
+        self.closed = False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        chunk = self.flight.read(self)
+        if chunk is None:
+            raise StopIteration
+        return chunk
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self.flight.leave(self)
+
+
+class Flight:
+    """A single upstream request shared by the clients asking for the same key"""
+
+    def __init__(self, coalescer, key, buffer_size):
+        self.coalescer = coalescer
+        self.key = key
+        self.buffer_size = buffer_size
+        self.status = self.headers = self.error = None
+        self.joinable = True
+        self.shared = True
+        self._cond = threading.Condition()
+        self._readers = set()
+        # Buffered chunks, the first one being chunk number _base of the body
+        self._chunks = []
+        self._base = 0
+        self._buffered = 0
+        self._ready = False
+        self._pumping = False
+        self._done = False
+        self._chunk_iter = None
+        self._close = None
+
+    def join(self):
+        """Reader for a new client, or None if the flight takes no more"""
+        with self._cond:
+            if not self.joinable:
+                return None
+            reader = FlightReader(self)
+            self._readers.add(reader)
+            return reader
+
+    def start(self, status, headers, chunks, close):
+        """Share the leader's upstream response; `close` releases it"""
+        shared = shareable(headers)
+        with self._cond:
+            self.status, self.headers = status, headers
+            self._chunk_iter, self._close = chunks, close
+            self._ready = True
+            if not shared:
+                self.shared = self.joinable = False
+            closed = not self._readers
+            self._cond.notify_all()
+        if not shared:
+            self.coalescer.forget(self)
+        if closed:
+            self._finish()
+
+    def fail(self, error):
+        """Pass the leader's error on to the followers"""
+        with self._cond:
+            self.error = error
+            self._ready = self._done = True
+            self.joinable = False
+            self._cond.notify_all()
+        self.coalescer.forget(self)
+
+    def wait(self):
+        """(status, headers) of the shared response, None if it is the leader's alone
+
+        The leader's error is raised.
+        """
+        with self._cond:
+            while not self._ready:
+                self._cond.wait()
+            if self.status is None:
+                raise self.error
+            return (self.status, self.headers) if self.shared else None
+
+    def read(self, reader):
+        """Next chunk for `reader`, None at the end of the body"""
+        while True:
+            with self._cond:
+                while True:
+                    index = reader.position - self._base
+                    if index < len(self._chunks):
+                        reader.position += 1
+                        chunk = self._chunks[index]
+                        self._trim()
+                        return chunk
+                    if self._done:
+                        if self.error is not None:
+                            raise self.error
+                        return None
+                    if not self._pumping and self._buffered < self.buffer_size:
+                        self._pumping = True
+                        break
+                    self._cond.wait()
+
+            # Pull the next chunk without holding the lock
+            try:
+                chunk = next(self._chunk_iter, None)
+            except BaseException as e:
+                with self._cond:
+                    self.error = e
+                    self._done = True
+                    self._pumping = False
+                    self._cond.notify_all()
+                self._finish()
+                raise
+
+            with self._cond:
+                self._pumping = False
+                if chunk is None:
+                    self._done = True
+                else:
+                    self._chunks.append(chunk)
+                    self._buffered += len(chunk)
+                self._cond.notify_all()
+            if chunk is None:
+                self._finish()
+
+    def leave(self, reader):
+        with self._cond:
+            self._readers.discard(reader)
+            self._trim()
+            abandoned = not self._readers
+            if abandoned:
+                self.joinable = False
+            self._cond.notify_all()
+        if abandoned:
+            self._finish()
+
+    def _trim(self):
+        # Drop the chunks every reader is past (called with the lock held)
+        position = min((reader.position for reader in self._readers), default=self._base + len(self._chunks))
+        dropped = position - self._base
+        if dropped > 0:
+            self._buffered -= sum(len(chunk) for chunk in self._chunks[:dropped])
+            del self._chunks[:dropped]
+            self._base = position
+            self.joinable = False
+
+    def _finish(self):
+        # Release the upstream response once, and stop taking followers
+        with self._cond:
+            close, self._close = self._close, None
+            self.joinable = False
+        self.coalescer.forget(self)
+        if close is not None:
+            close()
+
+
+class Coalescer:
+    """Flights in progress by key"""
+
+    def __init__(self, enabled=COALESCE_ENABLED, headers=COALESCE_HEADERS, buffer_size=COALESCE_BUFFER_SIZE):
+        self.enabled = enabled
+        self.headers = header_names(headers)
+        self.buffer_size = buffer_size
+        self._lock = threading.Lock()
+        self._flights = {}
+        self.counts = {'leaders': 0, 'followers': 0}
+
+    def key(self, url, headers, names=None):
+        """Key of a GET of `url` with the upstream request `headers`"""
+        headers = Headers(headers)
+        names = sorted(set(header_names(names) if names is not None else self.headers) | set(CONDITIONAL_HEADERS))
+        return (url,) + tuple(headers.get(name, '') for name in names)
+
+    def join(self, key):
+        """(flight, reader, leader): join the flight for `key`, or start one"""
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is not None:
+                reader = flight.join()
+                if reader is not None:
+                    self.counts['followers'] += 1
+                    return flight, reader, False
+            flight = Flight(self, key, self.buffer_size)
+            self._flights[key] = flight
+            self.counts['leaders'] += 1
+            return flight, flight.join(), True
+
+    def forget(self, flight):
+        with self._lock:
+            if self._flights.get(flight.key) is flight:
+                del self._flights[flight.key]
+
+    def reset(self):
+        with self._lock:
+            self._flights.clear()
+            for name in self.counts:
+                self.counts[name] = 0
+
+    def stats(self):
+        with self._lock:
+            return {**self.counts, 'in_flight': len(self._flights)}
@@ -0,0 +1,155 @@
+"""Pooled long-lived SQLite connections
+
+Routes used to open a new connection per request, paying for the file open,
+schema parsing and statement compilation every time. `connect()` instead
+checks out a long-lived connection (pragmas already applied, prepared
+statements cached) and `close()` returns it to the pool.
+
+Each service image only ships its own src/, so this module is copied as is
+in healthcheck-api and project-bridge: change both copies together.
+"""
+import os
+import sqlite3
+import threading
+
+# Prepared statements kept per connection (sqlite3's LRU statement cache)
+STATEMENT_CACHE_SIZE = int(os.environ.get('SQLITE_STATEMENT_CACHE_SIZE', 256))
+# Idle connections kept per database file
+MAX_IDLE_CONNECTIONS = int(os.environ.get('SQLITE_MAX_IDLE_CONNECTIONS', 16))
+BUSY_TIMEOUT_MS = int(os.environ.get('SQLITE_BUSY_TIMEOUT_MS', 5000))
+
+PRAGMAS = (
+    'PRAGMA journal_mode=WAL',
+    'PRAGMA synchronous=NORMAL',
+    f'PRAGMA busy_timeout={BUSY_TIMEOUT_MS}',
+    'PRAGMA temp_store=MEMORY',
+    'PRAGMA cache_size=-8000',
+)
+
+_idle = {}
+# sqlite3 connection -> [(on_commit, on_rollback)] of its current transaction
+_callbacks = {}
+_lock = threading.Lock()
+
+
+def _open(database):
+    conn = sqlite3.connect(
+        database,
+        timeout=BUSY_TIMEOUT_MS / 1000,
+        cached_statements=STATEMENT_CACHE_SIZE,
+        check_same_thread=False
+    )
+    for pragma in PRAGMAS:
+        conn.execute(pragma)
+    return conn
+
+
+class PooledConnection:
+    """sqlite3.Connection proxy whose close() returns it to the pool"""
+
+    def __init__(self, database, conn):
+        self._database = database
+        self._conn = conn
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.commit()
+        self.close()
+
+    def commit(self):
+        self._conn.commit()
+        _run_callbacks(self._conn, committed=True)
+
+    def rollback(self):
+        self._conn.rollback()
+        _run_callbacks(self._conn, committed=False)
+
+    def close(self):
+        """Roll back anything uncommitted and hand the connection back"""
+        conn, self._conn = self._conn, None
+        if conn is None:
+            return
+        _release(self._database, conn)
+
+    def __del__(self):
+        # A route that raised before close() must not leak its checkout
+        if getattr(self, '_conn', None) is not None:
+            self.close()
+
+
+def _release(database, conn):
+    try:
+        if conn.in_transaction:
+            conn.rollback()
+    except sqlite3.Error:
+        conn.close()
+        return
+    finally:
+        # Callbacks still registered belong to a transaction that never committed
+        _run_callbacks(conn, committed=False)
+
+    with _lock:
+        idle = _idle.setdefault(database, [])
+        if len(idle) < MAX_IDLE_CONNECTIONS:
+            idle.append(conn)
+            return
+    conn.close()
+
+
+def connect(database):
+    """Check out a pooled connection to `database`
+
+    A checked-out connection belongs to the calling thread until close().
+    Idle connections are reused most-recently-released first, so long-lived
+    worker threads keep getting the same warm connection, and short-lived
+    request threads (the development server starts one per request) reuse
+    connections instead of opening new ones.
+    """
+    with _lock:
+        idle = _idle.get(database)
+        conn = idle.pop() if idle else None
+    if conn is None:
+        conn = _open(database)
+    return PooledConnection(database, conn)
+
+
+def after_transaction(cursor, on_commit=None, on_rollback=None):
+    """Call `on_commit()` once the transaction of `cursor` commits, else `on_rollback()`
+
+    In-memory state that mirrors uncommitted writes is updated from these
+    callbacks so that a rolled back transaction cannot leave it pointing at
+    rows that do not exist. Only pooled connections run them.
+    """
+    with _lock:
+        _callbacks.setdefault(cursor.connection, []).append((on_commit, on_rollback))
+
+
+def _run_callbacks(conn, committed):
+    with _lock:
+        callbacks = _callbacks.pop(conn, ())
+    for on_commit, on_rollback in callbacks:
+        callback = on_commit if committed else on_rollback
+        if callback is not None:
+            callback()
+
+
+def ensure_column(cursor, table, column, definition):
+    """Add a column to an existing table if it is missing"""
+    cursor.execute(f'PRAGMA table_info({table})')
+    if column not in [row[1] for row in cursor.fetchall()]:
+        cursor.execute(f'ALTER TABLE {table} ADD COLUMN {column} {definition}')
+
+
+def close_all():
+    """Close every idle pooled connection (tests, shutdown)"""
+    with _lock:
+        for idle in _idle.values():
+            for conn in idle:
+                conn.close()
+        _idle.clear()
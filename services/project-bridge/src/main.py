@@ -1,9 +1,35 @@
-from flask import Flask, jsonify, request, redirect
+import atexit
+import os
+import sys
+sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
+
+from flask import Flask, Response, jsonify, request, redirect
 from flask_cors import CORS
 import requests
 import json
+import time
+from contextlib import ExitStack
 from datetime import datetime
-import sqlite3
+from functools import partial
+from urllib3.exceptions import EmptyPoolError
+from werkzeug.datastructures import Headers
+from werkzeug.http import unquote_etag
+from werkzeug.wsgi import ClosingIterator
+from src import db
+from src.balancing import ALGORITHMS, Balancer
+from src.cache import ResponseCache, parse_cache_control
+from src.coalesce import Coalescer
+from src.db import ensure_column
+from src.metrics import (
+    CONTENT_TYPE as METRICS_CONTENT_TYPE, cache_families, coalesce_families, pool_families, rate_limit_families,
+    render_metrics, request_log_families, retry_families, target_families
+)
+from src.proxy import MAX_BODY_SIZE, BodyTooLarge, iter_body, request_body, request_headers, response_headers
+from src.rate_limit import RateLimiter, create_rate_limit_table
+from src.request_log import RequestLogWriter
+from src.retry import RetryPolicy, upstream_timeout
+from src.routing import RouteTable, create_route_version_table, create_service_targets_table
+from src.upstream import UpstreamPools
 
 app = Flask(__name__)
 CORS(app, origins="*")  # Allow all origins for development
@@ -11,9 +37,36 @@ CORS(app, origins="*")  # Allow all origins for development
 # Database setup
 DATABASE = 'src/database/app.db'
 
+# Enabled services compiled into a path prefix trie
+route_table = RouteTable()
+
+# Pooled keep-alive HTTP clients, one per upstream service
+upstream_pools = UpstreamPools()
+
+# Batched background writer of request_logs
+request_log = RequestLogWriter()
+
+# Per-service and per-client token buckets enforcing services.rate_limit
+rate_limiter = RateLimiter()
+
+# Shared cache of GET responses for services with cache_enabled
+response_cache = ResponseCache()
+
+# Target selection and outlier ejection for services with several targets
+balancer = Balancer()
+
+# Retries after connect errors and hedged requests, within per-service budgets
+retry_policy = RetryPolicy()
+
+# Identical concurrent GETs sharing one upstream request
+coalescer = Coalescer()
+
+# Methods that leave cached responses valid
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
 def init_db():
     """Initialize the database with required tables"""
-    conn = sqlite3.connect(DATABASE)
+    conn = db.connect(DATABASE)
     cursor = conn.cursor()
     
     # Create services table
@@ -47,6 +100,28 @@ def init_db():
         )
     ''')
     
+    # Columns added after the initial schema
+    ensure_column(cursor, 'services', 'pool_size', 'INTEGER')
+    ensure_column(cursor, 'services', 'max_body_size', 'INTEGER')
+    ensure_column(cursor, 'services', 'log_sample_rate', 'REAL')
+    ensure_column(cursor, 'services', 'cache_enabled', 'BOOLEAN DEFAULT 0')
+    ensure_column(cursor, 'services', 'coalesce_headers', 'TEXT')
+    ensure_column(cursor, 'services', 'load_balancing', 'TEXT')
+    ensure_column(cursor, 'services', 'timeout', 'REAL')
+    ensure_column(cursor, 'services', 'max_retries', 'INTEGER')
+    ensure_column(cursor, 'services', 'hedge', 'BOOLEAN DEFAULT 0')
+    ensure_column(cursor, 'services', 'retry_budget', 'REAL')
+    ensure_column(cursor, 'request_logs', 'sample_weight', 'REAL DEFAULT 1')
+    
+    # Create the shared token bucket table (sqlite rate limit backend)
+    create_rate_limit_table(cursor)
+    
+    # Create the route table version stamp (bumped by triggers on services)
+    create_route_version_table(cursor)
+    
+    # Create the additional upstream targets of services
+    create_service_targets_table(cursor)
+    
     # Insert sample services if table is empty
     cursor.execute('SELECT COUNT(*) FROM services')
     if cursor.fetchone()[0] == 0:
@@ -66,47 +141,33 @@ def init_db():
     
     conn.commit()
     conn.close()
-
-def log_request(service_id, method, path, status_code, response_time, user_agent, ip_address):
-    """Log request details"""
-    conn = sqlite3.connect(DATABASE)
-    cursor = conn.cursor()
     
-    cursor.execute('''
-        INSERT INTO request_logs (service_id, method, path, status_code, response_time, user_agent, ip_address)
-        VALUES (?, ?, ?, ?, ?, ?, ?)
-    ''', (service_id, method, path, status_code, response_time, user_agent, ip_address))
-    
-    conn.commit()
-    conn.close()
+    route_table.reload(DATABASE)
+    request_log.open(DATABASE)
+    rate_limiter.open(DATABASE)
+    response_cache.clear()
+    coalescer.reset()
+    balancer.reset()
+    retry_policy.reset()
+
+def log_request(service_id, method, path, status_code, response_time, user_agent, ip_address, sample_rate=None):
+    """Queue request details for the background log writer"""
+    request_log.log(service_id, method, path, status_code, response_time, user_agent, ip_address, sample_rate)
+
+@atexit.register
+def flush_request_logs():
+    """Write the queued request logs on shutdown"""
+    request_log.flush()
 
 def find_service_by_path(path):
-    """Find service by path prefix"""
-    conn = sqlite3.connect(DATABASE)
-    cursor = conn.cursor()
-    
-    cursor.execute('''
-        SELECT id, name, target_url, path_prefix, enabled, auth_required, rate_limit
-        FROM services
-        WHERE ? LIKE path_prefix || '%' AND enabled = 1
-        ORDER BY LENGTH(path_prefix) DESC
-        LIMIT 1
-    ''', (path,))
-    
-    result = cursor.fetchone()
-    conn.close()
-    
-    if result:
-        return {
-            'id': result[0],
-            'name': result[1],
-            'target_url': result[2],
-            'path_prefix': result[3],
-            'enabled': result[4],
-            'auth_required': result[5],
-            'rate_limit': result[6]
-        }
-    return None
+    """Find the enabled service with the longest path prefix of `path`"""
+    return route_path(path)[0]
+
+def route_path(path):
+    """(service, rest of `path` after its prefix) of the longest match, or (None, None)"""
+    if route_table.database != DATABASE:
+        route_table.reload(DATABASE)
+    return route_table.route(path)
 
 @app.route('/api/bridge/health', methods=['GET'])
 def bridge_health():
@@ -120,11 +181,13 @@ def bridge_health():
 @app.route('/api/bridge/services', methods=['GET'])
 def get_services():
     """Get all registered services"""
-    conn = sqlite3.connect(DATABASE)
+    conn = db.connect(DATABASE)
     cursor = conn.cursor()
     
     cursor.execute('''
-        SELECT id, name, type, target_url, path_prefix, enabled, auth_required, rate_limit, created_at
+        SELECT id, name, type, target_url, path_prefix, enabled, auth_required, rate_limit, created_at, pool_size,
+               max_body_size, log_sample_rate, cache_enabled, coalesce_headers, load_balancing, timeout, max_retries,
+               hedge, retry_budget
         FROM services
         ORDER BY name
     ''')
@@ -140,7 +203,17 @@ def get_services():
             'enabled': bool(row[5]),
             'auth_required': bool(row[6]),
             'rate_limit': row[7],
-            'created_at': row[8]
+            'created_at': row[8],
+            'pool_size': row[9],
+            'max_body_size': row[10],
+            'log_sample_rate': row[11],
+            'cache_enabled': bool(row[12]),
+            'coalesce_headers': row[13],
+            'load_balancing': row[14],
+            'timeout': row[15],
+            'max_retries': row[16],
+            'hedge': bool(row[17]),
+            'retry_budget': row[18]
         })
     
     conn.close()
@@ -155,12 +228,17 @@ def add_service():
     if not all(field in data for field in required_fields):
         return jsonify({'error': 'Missing required fields'}), 400
     
-    conn = sqlite3.connect(DATABASE)
+    if data.get('load_balancing') not in (None,) + ALGORITHMS:
+        return jsonify({'error': 'Invalid load_balancing', 'allowed': list(ALGORITHMS)}), 400
+    
+    conn = db.connect(DATABASE)
     cursor = conn.cursor()
     
     cursor.execute('''
-        INSERT INTO services (name, type, target_url, path_prefix, enabled, auth_required, rate_limit)
-        VALUES (?, ?, ?, ?, ?, ?, ?)
+        INSERT INTO services (name, type, target_url, path_prefix, enabled, auth_required, rate_limit, pool_size,
+                              max_body_size, log_sample_rate, cache_enabled, coalesce_headers, load_balancing,
+                              timeout, max_retries, hedge, retry_budget)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
     ''', (
         data['name'],
         data['type'],
@@ -168,12 +246,23 @@ def add_service():
         data['path_prefix'],
         data.get('enabled', True),
         data.get('auth_required', False),
-        data.get('rate_limit', 100)
+        data.get('rate_limit', 100),
+        data.get('pool_size'),
+        data.get('max_body_size'),
+        data.get('log_sample_rate'),
+        data.get('cache_enabled', False),
+        data.get('coalesce_headers'),
+        data.get('load_balancing'),
+        data.get('timeout'),
+        data.get('max_retries'),
+        data.get('hedge', False),
+        data.get('retry_budget')
     ))
     
     service_id = cursor.lastrowid
     conn.commit()
     conn.close()
+    route_table.reload()
     
     return jsonify({'id': service_id, 'message': 'Service added successfully'}), 201
 
@@ -182,7 +271,10 @@ def update_service(service_id):
     """Update a service"""
     data = request.get_json()
     
-    conn = sqlite3.connect(DATABASE)
+    if data.get('load_balancing') not in (None,) + ALGORITHMS:
+        return jsonify({'error': 'Invalid load_balancing', 'allowed': list(ALGORITHMS)}), 400
+    
+    conn = db.connect(DATABASE)
     cursor = conn.cursor()
     
     # Check if service exists
@@ -195,7 +287,9 @@ def update_service(service_id):
     update_fields = []
     values = []
     
-    for field in ['name', 'type', 'target_url', 'path_prefix', 'enabled', 'auth_required', 'rate_limit']:
+    for field in ['name', 'type', 'target_url', 'path_prefix', 'enabled', 'auth_required', 'rate_limit', 'pool_size',
+                  'max_body_size', 'log_sample_rate', 'cache_enabled', 'coalesce_headers', 'load_balancing', 'timeout',
+                  'max_retries', 'hedge', 'retry_budget']:
         if field in data:
             update_fields.append(f'{field} = ?')
             values.append(data[field])
@@ -211,12 +305,98 @@ def update_service(service_id):
         conn.commit()
     
     conn.close()
+    if update_fields:
+        route_table.reload()
     return jsonify({'message': 'Service updated successfully'})
 
+@app.route('/api/bridge/services/<int:service_id>/targets', methods=['GET'])
+def get_service_targets(service_id):
+    """Get the upstream targets of a service with their balancing state"""
+    conn = db.connect(DATABASE)
+    cursor = conn.cursor()
+    
+    cursor.execute('SELECT target_url, load_balancing FROM services WHERE id = ?', (service_id,))
+    service = cursor.fetchone()
+    if not service:
+        conn.close()
+        return jsonify({'error': 'Service not found'}), 404
+    
+    cursor.execute('''
+        SELECT id, url, enabled, created_at FROM service_targets
+        WHERE service_id = ?
+        ORDER BY id
+    ''', (service_id,))
+    
+    targets = [{'id': None, 'url': service[0], 'enabled': True, 'created_at': None}]
+    for row in cursor.fetchall():
+        targets.append({
+            'id': row[0],
+            'url': row[1],
+            'enabled': bool(row[2]),
+            'created_at': row[3]
+        })
+    
+    conn.close()
+    
+    states = {state['url']: state for state in balancer.stats().get(service_id, [])}
+    for target in targets:
+        state = states.get(target['url'], {})
+        target.update({key: value for key, value in state.items() if key != 'url'})
+    
+    return jsonify({
+        'load_balancing': service[1] or balancer.algorithm,
+        'targets': targets
+    })
+
+@app.route('/api/bridge/services/<int:service_id>/targets', methods=['POST'])
+def add_service_target(service_id):
+    """Add an upstream target to a service"""
+    data = request.get_json()
+    
+    if 'url' not in data:
+        return jsonify({'error': 'Missing required fields'}), 400
+    
+    conn = db.connect(DATABASE)
+    cursor = conn.cursor()
+    
+    cursor.execute('SELECT id FROM services WHERE id = ?', (service_id,))
+    if not cursor.fetchone():
+        conn.close()
+        return jsonify({'error': 'Service not found'}), 404
+    
+    cursor.execute(
+        'INSERT INTO service_targets (service_id, url, enabled) VALUES (?, ?, ?)',
+        (service_id, data['url'], data.get('enabled', True))
+    )
+    
+    target_id = cursor.lastrowid
+    conn.commit()
+    conn.close()
+    route_table.reload()
+    
+    return jsonify({'id': target_id, 'message': 'Target added successfully'}), 201
+
+@app.route('/api/bridge/services/<int:service_id>/targets/<int:target_id>', methods=['DELETE'])
+def delete_service_target(service_id, target_id):
+    """Remove an upstream target from a service"""
+    conn = db.connect(DATABASE)
+    cursor = conn.cursor()
+    
+    cursor.execute('DELETE FROM service_targets WHERE id = ? AND service_id = ?', (target_id, service_id))
+    deleted = cursor.rowcount
+    conn.commit()
+    conn.close()
+    
+    if not deleted:
+        return jsonify({'error': 'Target not found'}), 404
+    
+    route_table.reload()
+    return jsonify({'message': 'Target deleted successfully'})
+
 @app.route('/api/bridge/stats', methods=['GET'])
 def get_bridge_stats():
     """Get bridge statistics"""
-    conn = sqlite3.connect(DATABASE)
+    conn = db.connect(DATABASE)
     cursor = conn.cursor()
     
     # Total services
@@ -227,23 +407,23 @@ def get_bridge_stats():
     cursor.execute('SELECT COUNT(*) FROM services WHERE enabled = 1')
     active_services = cursor.fetchone()[0]
     
-    # Total requests (last 24 hours)
+    # Total requests (last 24 hours), sampled rows weighted back up
     cursor.execute('''
-        SELECT COUNT(*) FROM request_logs 
+        SELECT CAST(ROUND(COALESCE(SUM(COALESCE(sample_weight, 1)), 0)) AS INTEGER) FROM request_logs 
         WHERE timestamp > datetime('now', '-1 day')
     ''')
     requests_24h = cursor.fetchone()[0]
     
     # Average response time (last 24 hours)
     cursor.execute('''
-        SELECT AVG(response_time) FROM request_logs 
+        SELECT SUM(response_time * COALESCE(sample_weight, 1)) / SUM(COALESCE(sample_weight, 1)) FROM request_logs 
         WHERE timestamp > datetime('now', '-1 day') AND response_time IS NOT NULL
     ''')
     avg_response_time = cursor.fetchone()[0]
     
     # Requests by service (last 24 hours)
     cursor.execute('''
-        SELECT s.name, COUNT(r.id) as request_count
+        SELECT s.name, CAST(ROUND(COALESCE(SUM(COALESCE(r.sample_weight, 1)), 0)) AS INTEGER) as request_count
         FROM services s
         LEFT JOIN request_logs r ON s.id = r.service_id 
             AND r.timestamp > datetime('now', '-1 day')
@@ -265,13 +445,65 @@ def get_bridge_stats():
         'active_services': active_services,
         'requests_24h': requests_24h,
         'average_response_time': avg_response_time,
-        'requests_by_service': requests_by_service
+        'requests_by_service': requests_by_service,
+        'request_log': request_log.stats(),
+        'cache': response_cache.stats(),
+        'coalescing': coalescer.stats()
     })
 
 @app.route('/metrics', methods=['GET'])
 def metrics():
-    """API metrics endpoint"""
-    return jsonify({})
+    """Prometheus metrics (upstream pools, targets and retries, request log, rate limiting, cache, coalescing)"""
+    families = (pool_families(upstream_pools.stats()) + request_log_families(request_log.stats())
+                + rate_limit_families(rate_limiter.stats()) + cache_families(response_cache.stats())
+                + coalesce_families(coalescer.stats()) + target_families(balancer.stats())
+                + retry_families(retry_policy.stats()))
+    return Response(render_metrics(families), content_type=METRICS_CONTENT_TYPE)
+
+def upstream_attempt(service, method, path, headers, body, params, tried):
+    """Send one request to a target of `service` not in `tried`; returns (response, stack, latency)"""
+    stack = ExitStack()
+    try:
+        # Spread the service's requests over its targets
+        target = balancer.pick(service, exclude=tried)
+        tried.append(target.url)
+        stack.callback(balancer.release, target)
+        session = stack.enter_context(upstream_pools.client(service))
+        sent_at = time.time()
+        try:
+            response = session.request(
+                method=method,
+                url=target.url.rstrip('/') + '/' + path.lstrip('/'),
+                headers=headers,
+                data=body,
+                params=params,
+                timeout=upstream_timeout(service),
+                allow_redirects=False,
+                stream=True
+            )
+        except requests.exceptions.RequestException:
+            balancer.observe(service, target, time.time() - sent_at, True)
+            raise
+        stack.callback(response.close)
+        latency = time.time() - sent_at
+        balancer.observe(service, target, latency, response.status_code >= 500)
+        return response, stack, latency
+    except BaseException:
+        stack.close()
+        raise
+
+def cached_response(entry, body, outcome, now):
+    """Response served from a cache entry, or 304 if the client already has it"""
+    headers = Headers(entry.headers)
+    headers['Age'] = str(int(entry.age(now)))
+    headers['X-Cache'] = outcome
+    if entry.etag and request.if_none_match.contains_weak(unquote_etag(entry.etag)[0]):
+        body.close()
+        return Response(status=304, headers=[(name, value) for name, value in headers.items()
+                                             if name.lower() not in ('content-length', 'content-type')])
+    if entry.status != 204:
+        headers['Content-Length'] = str(entry.size)
+    return Response(body, status=entry.status, headers=headers, direct_passthrough=True)
 
 @app.route('/health', methods=['GET'])
 def health():
@@ -281,46 +513,205 @@ def health():
 @app.route('/<path:path>', methods=['GET', 'POST', 'PUT', 'DELETE', 'PATCH'])
 def proxy_request(path):
     """Proxy requests to appropriate services"""
-    import time
     start_time = time.time()
     
     # Find matching service
-    service = find_service_by_path('/' + path)
+    service, remaining_path = route_path('/' + path)
     
     if not service:
         return jsonify({'error': 'Service not found'}), 404
     
-    # Build target URL
-    remaining_path = path[len(service['path_prefix'].lstrip('/')):]
+    # Token buckets, before reading the body or contacting the upstream
+    retry_after = rate_limiter.check(service, request.remote_addr)
+    if retry_after:
+        log_request(
+            service['id'],
+            request.method,
+            '/' + path,
+            429,
+            time.time() - start_time,
+            request.headers.get('User-Agent', ''),
+            request.remote_addr,
+            sample_rate=service['log_sample_rate']
+        )
+        limited = jsonify({'error': 'Rate limit exceeded', 'retry_after': retry_after})
+        limited.headers['Retry-After'] = str(retry_after)
+        return limited, 429
+    
+    # Build target URL (the service's target_url keys the cache and
+    # coalescing whichever target serves the request)
     target_url = service['target_url'].rstrip('/') + '/' + remaining_path.lstrip('/')
     
+    # Fresh cached responses are served without contacting the upstream,
+    # stale ones with validators are revalidated
+    request_url = target_url + ('?' + request.query_string.decode('latin-1') if request.query_string else '')
+    cache_url = request_url if service['cache_enabled'] else None
+    entry = cached_body = None
+    if cache_url is not None and request.method == 'GET':
+        directives = parse_cache_control(request.headers.get('Cache-Control'))
+        if 'no-store' not in directives:
+            entry = response_cache.lookup(cache_url, request.headers)
+        if entry is not None:
+            cached_body = response_cache.open_body(entry)
+            if cached_body is None:
+                entry = None
+        if entry is not None and entry.is_fresh(time.time(), directives):
+            response_cache.count('hits')
+            cached = cached_response(entry, cached_body, 'HIT', time.time())
+            log_request(
+                service['id'],
+                request.method,
+                '/' + path,
+                cached.status_code,
+                time.time() - start_time,
+                request.headers.get('User-Agent', ''),
+                request.remote_addr,
+                sample_rate=service['log_sample_rate']
+            )
+            return cached
+        if entry is not None and not entry.validators():
+            entry = None
+        if entry is None and cached_body is not None:
+            cached_body.close()
+    
+    # Checkout of the service's pooled connections (and the request body),
+    # held until the response body has been relayed
+    checkout = ExitStack()
+    flight = reader = None
+    leader = True
     try:
-        # Forward request
-        response = requests.request(
-            method=request.method,
-            url=target_url,
-            headers={k: v for k, v in request.headers if k.lower() != 'host'},
-            data=request.get_data(),
-            params=request.args,
-            timeout=30,
-            allow_redirects=False
+        try:
+            # Declared lengths are checked before reading anything, chunked
+            # bodies while they are spooled, before contacting the upstream
+            max_body_size = service['max_body_size'] if service['max_body_size'] is not None else MAX_BODY_SIZE
+            body = request_body(
+                request.stream,
+                request.content_length,
+                'chunked' in request.headers.get('Transfer-Encoding', '').lower(),
+                max_body_size
+            )
+            if body is not None:
+                checkout.callback(body.close)
+            headers = request_headers(request.headers)
+            if entry is not None:
+                headers.update(entry.validators())
+            
+            # Identical GETs in flight share one upstream request
+            if body is None and request.method == 'GET' and coalescer.enabled:
+                flight, reader, leader = coalescer.join(
+                    coalescer.key(request_url, headers, service['coalesce_headers'])
+                )
+                if not leader and flight.wait() is None:
+                    # The leader's response is its own (cookies, private): send ours
+                    reader.close()
+                    flight = reader = None
+                    leader = True
+            
+            if leader:
+                # Retried after connect errors, hedged past the service's p95
+                response, attempt, _ = retry_policy.send(
+                    service,
+                    request.method,
+                    body,
+                    partial(upstream_attempt, service, request.method, remaining_path, headers, body, request.args)
+                )
+                checkout.enter_context(attempt)
+                status_code, relayed_headers = response.status_code, response_headers(response)
+            else:
+                status_code, relayed_headers = flight.wait()
+        except BaseException as e:
+            if flight is not None and leader:
+                flight.fail(e)
+            if reader is not None:
+                reader.close()
+            checkout.close()
+            if cached_body is not None:
+                cached_body.close()
+            raise
+        
+        # The request context is gone by the time the body has been relayed
+        method, user_agent, remote_addr = request.method, request.headers.get('User-Agent', ''), request.remote_addr
+        revalidated = entry is not None and status_code == 304
+        
+        if leader:
+            # Relay the body chunk by chunk, still encoded, as the client
+            # reads it (copied into the cache on the way when storable)
+            fill = None
+            if cache_url is not None and request.method == 'GET' and not revalidated:
+                fill = response_cache.begin(cache_url, request.headers, status_code, Headers(relayed_headers),
+                                            time.time())
+            chunks = fill.relay(iter_body(response)) if fill is not None else iter_body(response)
+            if fill is not None:
+                checkout.callback(fill.abort)
+            upstream = checkout.pop_all()
+            if flight is not None:
+                flight.start(status_code, relayed_headers, chunks, upstream.close)
+        if flight is not None:
+            # Followers (and the leader) read the body from the flight
+            chunks, upstream = reader, reader
+        
+        if revalidated:
+            # Still valid: refresh the entry and serve it
+            upstream.close()
+            response_cache.revalidated(entry, Headers(relayed_headers), time.time())
+            cached = cached_response(entry, cached_body, 'REVALIDATED', time.time())
+            log_request(
+                service['id'],
+                request.method,
+                '/' + path,
+                cached.status_code,
+                time.time() - start_time,
+                user_agent,
+                remote_addr,
+                sample_rate=service['log_sample_rate']
+            )
+            return cached
+        elif cache_url is not None and request.method == 'GET':
+            if cached_body is not None:
+                cached_body.close()
+            response_cache.count('misses')
+        elif cache_url is not None and request.method not in SAFE_METHODS and status_code < 400:
+            response_cache.invalidate(cache_url)
+        
+        def finish():
+            # Runs once the client got the whole body or went away
+            upstream.close()
+            log_request(
+                service['id'],
+                method,
+                '/' + path,
+                status_code,
+                time.time() - start_time,
+                user_agent,
+                remote_addr,
+                sample_rate=service['log_sample_rate']
+            )
+        
+        # The WSGI server closes a passed-through body itself, never the
+        # Response: call_on_close() callbacks would not run
+        proxied = Response(
+            ClosingIterator(chunks, [finish]),
+            status=status_code,
+            headers=relayed_headers,
+            direct_passthrough=True
         )
+        if cache_url is not None and request.method == 'GET':
+            proxied.headers['X-Cache'] = 'MISS'
+        return proxied
         
+    except BodyTooLarge as e:
         response_time = time.time() - start_time
-        
-        # Log request
         log_request(
             service['id'],
             request.method,
             '/' + path,
-            response.status_code,
+            413,
             response_time,
             request.headers.get('User-Agent', ''),
-            request.remote_addr
+            request.remote_addr,
+            sample_rate=service['log_sample_rate']
         )
-        
-        # Return response
-        return response.content, response.status_code, dict(response.headers)
+        return jsonify({'error': 'Request body too large', 'max_body_size': e.limit}), 413
         
     except requests.exceptions.Timeout:
         response_time = time.time() - start_time
@@ -331,7 +722,8 @@ def proxy_request(path):
             504,
             response_time,
             request.headers.get('User-Agent', ''),
-            request.remote_addr
+            request.remote_addr,
+            sample_rate=service['log_sample_rate']
         )
         return jsonify({'error': 'Gateway timeout'}), 504
         
@@ -344,10 +736,25 @@ def proxy_request(path):
             502,
             response_time,
             request.headers.get('User-Agent', ''),
-            request.remote_addr
+            request.remote_addr,
+            sample_rate=service['log_sample_rate']
         )
         return jsonify({'error': 'Bad gateway'}), 502
         
+    except EmptyPoolError:
+        response_time = time.time() - start_time
+        log_request(
+            service['id'],
+            request.method,
+            '/' + path,
+            503,
+            response_time,
+            request.headers.get('User-Agent', ''),
+            request.remote_addr,
+            sample_rate=service['log_sample_rate']
+        )
+        return jsonify({'error': 'No upstream connection available'}), 503
+        
     except Exception as e:
         response_time = time.time() - start_time
         log_request(
@@ -357,7 +764,8 @@ def proxy_request(path):
             500,
             response_time,
             request.headers.get('User-Agent', ''),
-            request.remote_addr
+            request.remote_addr,
+            sample_rate=service['log_sample_rate']
         )
         return jsonify({'error': 'Internal server error'}), 500
 
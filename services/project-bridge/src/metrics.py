@@ -0,0 +1,148 @@
+"""Prometheus text exposition of the bridge metrics
+
+A metric family is a (name, type, help, samples) tuple where samples is a
+list of (labels dict, value).
+"""
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def format_value(value):
+    if value is None:
+        return 'NaN'
+    return repr(float(value))
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{key}="{escape_label(value)}"' for key, value in labels.items()) + '}'
+
+
+def render_metrics(families):
+    """Render metric families as Prometheus text"""
+    lines = []
+    for name, metric_type, help_text, samples in families:
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} {metric_type}')
+        lines.extend(f'{name}{format_labels(labels)} {format_value(value)}' for labels, value in samples)
+    return '\n'.join(lines) + '\n'
+
+
+def pool_families(pool_stats):
+    """Metric families of the upstream connection pools (UpstreamPools.stats())"""
+    def samples(key):
+        return [({'service_id': service_id, 'service': entry['service']}, entry[key])
+                for service_id, entry in sorted(pool_stats.items())]
+
+    return [
+        ('bridge_upstream_requests_total', 'counter',
+         'Upstream requests (connection checkouts) per service', samples('requests')),
+        ('bridge_upstream_connections_opened_total', 'counter',
+         'New upstream connections opened per service', samples('connections_opened')),
+        ('bridge_upstream_connection_reuse_ratio', 'gauge',
+         'Share of upstream requests sent on an already open connection', samples('reuse_ratio')),
+        ('bridge_upstream_pool_wait_seconds_total', 'counter',
+         'Time spent waiting for a free pooled connection', samples('pool_wait_seconds')),
+        ('bridge_upstream_pool_wait_seconds_max', 'gauge',
+         'Longest wait for a free pooled connection', samples('max_pool_wait_seconds')),
+    ]
+
+
+def request_log_families(log_stats):
+    """Metric families of the request log writer (RequestLogWriter.stats())"""
+    return [
+        ('bridge_request_log_queued', 'gauge', 'Request log entries waiting to be written',
+         [({}, log_stats['queued'])]),
+        ('bridge_request_log_written_total', 'counter', 'Request log entries written',
+         [({}, log_stats['written'])]),
+        ('bridge_request_log_dropped_total', 'counter', 'Request log entries dropped because the queue was full',
+         [({}, log_stats['dropped'])]),
+        ('bridge_request_log_sampled_out_total', 'counter', 'Successful requests not logged because of sampling',
+         [({}, log_stats['sampled_out'])]),
+        ('bridge_request_log_batches_total', 'counter', 'Request log write transactions',
+         [({}, log_stats['batches'])]),
+    ]
+
+
+def rate_limit_families(rate_limit_stats):
+    """Metric families of the rate limiter (RateLimiter.stats())"""
+    def samples(key):
+        return [({'service_id': service_id, 'service': entry['service']}, entry[key])
+                for service_id, entry in sorted(rate_limit_stats.items())]
+
+    return [
+        ('bridge_rate_limit_allowed_total', 'counter', 'Requests let through by the rate limiter', samples('allowed')),
+        ('bridge_rate_limited_total', 'counter', 'Requests rejected with 429 by the rate limiter', samples('limited')),
+    ]
+
+
+def cache_families(cache_stats):
+    """Metric families of the response cache (ResponseCache.stats())"""
+    return [
+        ('bridge_cache_hits_total', 'counter', 'GET requests served from a fresh cached response',
+         [({}, cache_stats['hits'])]),
+        ('bridge_cache_misses_total', 'counter', 'Cacheable GET requests sent upstream for a full response',
+         [({}, cache_stats['misses'])]),
+        ('bridge_cache_revalidated_total', 'counter', 'Stale cached responses confirmed by a 304 from the upstream',
+         [({}, cache_stats['revalidated'])]),
+        ('bridge_cache_stores_total', 'counter', 'Responses stored in the cache', [({}, cache_stats['stores'])]),
+        ('bridge_cache_evictions_total', 'counter', 'Cached responses evicted to stay within the size bounds',
+         [({}, cache_stats['evictions'])]),
+        ('bridge_cache_entries', 'gauge', 'Cached responses per storage tier',
+         [({'tier': 'memory'}, cache_stats['memory_entries']), ({'tier': 'disk'}, cache_stats['disk_entries'])]),
+        ('bridge_cache_bytes', 'gauge', 'Bytes of cached bodies per storage tier',
+         [({'tier': 'memory'}, cache_stats['memory_bytes']), ({'tier': 'disk'}, cache_stats['disk_bytes'])]),
+    ]
+
+
+def coalesce_families(coalesce_stats):
+    """Metric families of request coalescing (Coalescer.stats())"""
+    return [
+        ('bridge_coalesce_leaders_total', 'counter', 'GETs that sent the upstream request of their key',
+         [({}, coalesce_stats['leaders'])]),
+        ('bridge_coalesce_followers_total', 'counter', 'GETs served from the upstream request of an identical one',
+         [({}, coalesce_stats['followers'])]),
+        ('bridge_coalesce_in_flight', 'gauge', 'Upstream GETs currently open to followers',
+         [({}, coalesce_stats['in_flight'])]),
+    ]
+
+
+def target_families(target_stats):
+    """Metric families of the service targets (Balancer.stats())"""
+    def samples(key):
+        return [({'service_id': service_id, 'target': target['url']}, target[key])
+                for service_id, targets in sorted(target_stats.items()) for target in targets]
+
+    return [
+        ('bridge_target_requests_total', 'counter', 'Requests sent to each upstream target', samples('requests')),
+        ('bridge_target_failures_total', 'counter', 'Connection errors, timeouts and 5xx responses of each target',
+         samples('failures')),
+        ('bridge_target_outstanding', 'gauge', 'Requests in progress on each target', samples('outstanding')),
+        ('bridge_target_latency_ewma_ms', 'gauge', 'Moving average latency of each target', samples('ewma_ms')),
+        ('bridge_target_ejected', 'gauge', 'Whether each target is currently ejected', samples('ejected')),
+        ('bridge_target_ejections_total', 'counter', 'Ejections of each target', samples('ejections')),
+    ]
+
+
+def retry_families(retry_stats):
+    """Metric families of retries and hedged requests (RetryPolicy.stats())"""
+    def samples(key):
+        return [({'service_id': service_id, 'service': entry['service']}, entry[key])
+                for service_id, entry in sorted(retry_stats.items())]
+
+    return [
+        ('bridge_upstream_retries_total', 'counter', 'Requests sent again after a connect error', samples('retries')),
+        ('bridge_upstream_hedges_total', 'counter', 'Second requests sent past the service p95 latency',
+         samples('hedges')),
+        ('bridge_upstream_hedge_wins_total', 'counter', 'Hedged requests answered before the original one',
+         samples('hedge_wins')),
+        ('bridge_retry_budget_exhausted_total', 'counter', 'Retries and hedges refused by the retry budget',
+         samples('budget_exhausted')),
+        ('bridge_upstream_latency_p95_seconds', 'gauge', 'p95 latency of the last upstream responses',
+         [(labels, None if value is None else value / 1000) for labels, value in samples('p95_ms')]),
+    ]
@@ -0,0 +1,152 @@
+"""Helpers for forwarding requests and streaming responses
+
+Upstream bodies are relayed chunk by chunk as the client reads them (the
+WSGI server only pulls the next chunk once the previous one was written,
+which gives backpressure), so a worker holds at most one chunk of a
+response in memory. Bodies are relayed as received: a gzip or br encoded
+response keeps its Content-Encoding and Content-Length.
+
+Request bodies are not read up front either. A body with a Content-Length
+is streamed to the upstream as it arrives; a chunked body (unknown length)
+is first spooled, in memory up to SPOOL_THRESHOLD bytes and to a temporary
+file beyond, so that it can be sent with a Content-Length and checked
+against the size limit before anything goes upstream.
+"""
+import os
+import tempfile
+
+# Bytes read from the upstream per chunk
+STREAM_CHUNK_SIZE = int(os.environ.get('BRIDGE_STREAM_CHUNK_SIZE', 64 * 1024))
+# Default maximum request body size (bytes, 0 for no limit), overridden
+# by services.max_body_size
+MAX_BODY_SIZE = int(os.environ.get('BRIDGE_MAX_BODY_SIZE', 100 * 1024 * 1024))
+# Chunked request bodies larger than this are spooled to disk
+SPOOL_THRESHOLD = int(os.environ.get('BRIDGE_SPOOL_THRESHOLD', 1024 * 1024))
+
+# Headers that only concern one connection (RFC 9110, section 7.6.1)
+HOP_BY_HOP_HEADERS = frozenset((
+    'connection', 'keep-alive', 'proxy-authenticate', 'proxy-authorization', 'proxy-connection',
+    'te', 'trailer', 'trailers', 'transfer-encoding', 'upgrade'
+))
+
+
+def strip_hop_by_hop(headers):
+    """(name, value) pairs of `headers` without hop-by-hop headers
+
+    Headers listed in Connection are hop-by-hop too. Repeated headers
+    (Set-Cookie) are kept as separate pairs.
+    """
+    headers = list(headers)
+    dropped = set(HOP_BY_HOP_HEADERS)
+    for name, value in headers:
+        if name.lower() == 'connection':
+            dropped.update(option.strip().lower() for option in value.split(',') if option.strip())
+    return [(name, value) for name, value in headers if name.lower() not in dropped]
+
+
+def request_headers(headers):
+    """Client request headers to forward upstream"""
+    return {name: value for name, value in strip_hop_by_hop(headers.items()) if name.lower() != 'host'}
+
+
+def response_headers(upstream_response):
+    """Upstream response headers to relay, repeated headers included"""
+    return strip_hop_by_hop(upstream_response.raw.headers.items())
+
+
+def iter_body(upstream_response, chunk_size=STREAM_CHUNK_SIZE):
+    """Raw (still encoded) body chunks of a streamed requests response"""
+    for chunk in upstream_response.raw.stream(chunk_size, decode_content=False):
+        if chunk:
+            yield chunk
+
+
+class BodyTooLarge(Exception):
+    def __init__(self, limit):
+        super().__init__(f'Request body exceeds {limit} bytes')
+        self.limit = limit
+
+
+class RequestBody:
+    """File-like request body of known length, read on demand
+
+    Having a length keeps requests from falling back to chunked encoding
+    or probing the file (which would roll a spooled body over to disk).
+    """
+
+    def __init__(self, fileobj, length, chunk_size=STREAM_CHUNK_SIZE):
+        self._fileobj = fileobj
+        self._length = length
+        self._remaining = length
+        self.chunk_size = chunk_size
+
+    def __len__(self):
+        return self._length
+
+    def read(self, size=-1):
+        if self._remaining <= 0:
+            return b''
+        if size is None or size < 0 or size > self._remaining:
+            size = self._remaining
+        data = self._fileobj.read(size)
+        self._remaining -= len(data)
+        return data
+
+    def __iter__(self):
+        while True:
+            chunk = self.read(self.chunk_size)
+            if not chunk:
+                return
+            yield chunk
+
+    def rewind(self):
+        """Get ready to send the body again; False if it cannot be replayed"""
+        if self._remaining == self._length:
+            return True
+        if not self._fileobj.seekable():
+            return False
+        self._fileobj.seek(0)
+        self._remaining = self._length
+        return True
+
+    def close(self):
+        self._fileobj.close()
+
+
+def spool(stream, limit, threshold=SPOOL_THRESHOLD, chunk_size=STREAM_CHUNK_SIZE):
+    """Copy a body of unknown length to a spooled file; returns (file, length)
+
+    Raises BodyTooLarge as soon as more than `limit` bytes were read.
+    """
+    spooled = tempfile.SpooledTemporaryFile(max_size=threshold)
+    length = 0
+    try:
+        while True:
+            chunk = stream.read(chunk_size)
+            if not chunk:
+                break
+            length += len(chunk)
+            if limit and length > limit:
+                raise BodyTooLarge(limit)
+            spooled.write(chunk)
+    except BaseException:
+        spooled.close()
+        raise
+    spooled.seek(0)
+    return spooled, length
+
+
+def request_body(stream, content_length, chunked, limit):
+    """Body to forward for a client request, or None if it has none
+
+    Raises BodyTooLarge, before reading anything when the declared length
+    is over `limit` (0 for no limit).
+    """
+    if content_length is not None:
+        if limit and content_length > limit:
+            raise BodyTooLarge(limit)
+        return RequestBody(stream, content_length) if content_length else None
+    if not chunked:
+        return None
+    spooled, length = spool(stream, limit)
+    return RequestBody(spooled, length)
@@ -0,0 +1,198 @@
+"""Token bucket rate limiting of proxied requests
+
+`services.rate_limit` is the number of requests a service accepts per
+RATE_LIMIT_WINDOW seconds, from all its clients together. A single client IP
+may send as many, so SERVICE_RATE_MULTIPLIER (1 by default) opts into a
+service-wide limit that many times larger than the per-client one. Each (service, client) pair and each
+service has a bucket holding up to one window worth of tokens, refilled
+lazily from the time elapsed since it was last touched, so a check costs
+O(1) whatever the number of clients.
+
+Buckets live either in process memory (`memory`, an LRU of about
+RATE_LIMIT_MAX_KEYS buckets) or in the SQLite database shared by every
+worker (`sqlite`). An idle bucket refills completely, after which dropping
+it is lossless: the memory backend evicts the least recently used buckets
+once full (every bucket idle for a window is), and the sqlite backend
+deletes the ones already full. The memory backend may thus briefly hold
+more than RATE_LIMIT_MAX_KEYS buckets, those touched in the last window.
+"""
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from src import db
+
+# Seconds over which `rate_limit` requests are allowed
+RATE_LIMIT_WINDOW = float(os.environ.get('BRIDGE_RATE_LIMIT_WINDOW', 60))
+# Service-wide limit as a multiple of the per-client limit (1: both are rate_limit)
+SERVICE_RATE_MULTIPLIER = float(os.environ.get('BRIDGE_SERVICE_RATE_MULTIPLIER', 1))
+# 'memory' (per process) or 'sqlite' (shared by the workers)
+RATE_LIMIT_BACKEND = os.environ.get('BRIDGE_RATE_LIMIT_BACKEND', 'memory')
+# Buckets kept by the memory backend
+RATE_LIMIT_MAX_KEYS = int(os.environ.get('BRIDGE_RATE_LIMIT_MAX_KEYS', 100000))
+# Seconds between two purges of full buckets by the sqlite backend
+RATE_LIMIT_PURGE_INTERVAL = float(os.environ.get('BRIDGE_RATE_LIMIT_PURGE_INTERVAL', 60))
+
+
+def create_rate_limit_table(cursor):
+    """Create the bucket table of the sqlite backend"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS rate_limit_buckets (
+            key TEXT PRIMARY KEY,
+            tokens REAL NOT NULL,
+            updated_at REAL NOT NULL,
+            full_at REAL NOT NULL
+        )
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_rate_limit_buckets_full_at ON rate_limit_buckets (full_at)')
+
+
+def refill(tokens, updated_at, rate, capacity, now):
+    """Tokens of a bucket last left with `tokens` at `updated_at`"""
+    return min(capacity, tokens + max(now - updated_at, 0) * rate)
+
+
+def take(buckets, limits, now):
+    """Take one token from every bucket of `limits`, or none of them
+
+    `buckets` maps keys to (tokens, updated_at) and is updated in place;
+    `limits` lists (key, rate, capacity). Returns the seconds to wait
+    before retrying (0 when the tokens were taken).
+    """
+    levels = []
+    retry_after = 0.0
+    for key, rate, capacity in limits:
+        state = buckets.get(key)
+        tokens = capacity if state is None else refill(state[0], state[1], rate, capacity, now)
+        levels.append(tokens)
+        if tokens < 1:
+            retry_after = max(retry_after, (1 - tokens) / rate)
+    if retry_after:
+        return retry_after
+    for (key, _, _), tokens in zip(limits, levels):
+        buckets[key] = (tokens - 1, now)
+    return 0.0
+
+
+class MemoryBuckets:
+    """Per-process buckets in an LRU dict, evicted once full"""
+
+    def __init__(self, max_keys=RATE_LIMIT_MAX_KEYS):
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()
+        # key -> time the bucket is full again
+        self._full_at = {}
+        self._lock = threading.Lock()
+
+    def acquire(self, limits, now):
+        with self._lock:
+            for key, _, _ in limits:
+                if key in self._buckets:
+                    self._buckets.move_to_end(key)
+            retry_after = take(self._buckets, limits, now)
+            if not retry_after:
+                for key, rate, capacity in limits:
+                    self._full_at[key] = now + (capacity - self._buckets[key][0]) / rate
+            while len(self._buckets) > self.max_keys:
+                key = next(iter(self._buckets))
+                if self._full_at.get(key, now) > now:
+                    break
+                del self._buckets[key]
+                self._full_at.pop(key, None)
+            return retry_after
+
+    def __len__(self):
+        return len(self._buckets)
+
+
+class SQLiteBuckets:
+    """Buckets in a SQLite table, shared by every process using the database"""
+
+    def __init__(self, database, purge_interval=RATE_LIMIT_PURGE_INTERVAL):
+        self.database = database
+        self.purge_interval = purge_interval
+        self._purged_at = 0.0
+
+    def acquire(self, limits, now):
+        conn = db.connect(self.database)
+        cursor = conn.cursor()
+        try:
+            # The write lock up front keeps concurrent workers from both
+            # taking the last token
+            cursor.execute('BEGIN IMMEDIATE')
+            keys = [key for key, _, _ in limits]
+            cursor.execute(f'SELECT key, tokens, updated_at FROM rate_limit_buckets '
+                           f'WHERE key IN ({", ".join("?" for _ in keys)})', keys)
+            buckets = {key: (tokens, updated_at) for key, tokens, updated_at in cursor.fetchall()}
+            retry_after = take(buckets, limits, now)
+            if not retry_after:
+                cursor.executemany('''
+                    INSERT OR REPLACE INTO rate_limit_buckets (key, tokens, updated_at, full_at)
+                    VALUES (?, ?, ?, ?)
+                ''', [(key, buckets[key][0], now, now + (capacity - buckets[key][0]) / rate)
+                      for key, rate, capacity in limits])
+            if now - self._purged_at >= self.purge_interval:
+                self._purged_at = now
+                cursor.execute('DELETE FROM rate_limit_buckets WHERE full_at <= ?', (now,))
+            conn.commit()
+            return retry_after
+        finally:
+            conn.close()
+
+    def __len__(self):
+        conn = db.connect(self.database)
+        try:
+            return conn.execute('SELECT COUNT(*) FROM rate_limit_buckets').fetchone()[0]
+        finally:
+            conn.close()
+
+
+class RateLimiter:
+    """Per-service and per-client token buckets over a bucket backend"""
+
+    def __init__(self, backend=RATE_LIMIT_BACKEND, window=RATE_LIMIT_WINDOW,
+                 service_multiplier=SERVICE_RATE_MULTIPLIER, max_keys=RATE_LIMIT_MAX_KEYS):
+        self.backend = backend
+        self.window = window
+        self.service_multiplier = service_multiplier
+        self.max_keys = max_keys
+        self.buckets = MemoryBuckets(max_keys)
+        self._lock = threading.Lock()
+        self._counts = {}
+
+    def open(self, database):
+        """Start from empty buckets, kept in `database` for the sqlite backend"""
+        if self.backend == 'sqlite':
+            self.buckets = SQLiteBuckets(database)
+        else:
+            self.buckets = MemoryBuckets(self.max_keys)
+        with self._lock:
+            self._counts.clear()
+
+    def limits(self, service, client_ip):
+        """(key, rate per second, capacity) of the buckets a request draws from"""
+        per_client = service['rate_limit']
+        if not per_client or per_client <= 0:
+            return []
+        per_service = per_client * self.service_multiplier
+        return [
+            (f'client:{service["id"]}:{client_ip}', per_client / self.window, per_client),
+            (f'service:{service["id"]}', per_service / self.window, per_service),
+        ]
+
+    def check(self, service, client_ip, now=None):
+        """Seconds the client has to wait (rounded up), or 0 if the request may go"""
+        now = time.time() if now is None else now
+        limits = self.limits(service, client_ip)
+        retry_after = self.buckets.acquire(limits, now) if limits else 0.0
+        with self._lock:
+            counts = self._counts.setdefault(service['id'], {'service': service['name'], 'allowed': 0, 'limited': 0})
+            counts['limited' if retry_after else 'allowed'] += 1
+        return math.ceil(retry_after) if retry_after else 0
+
+    def stats(self):
+        """Allowed and limited requests per service id"""
+        with self._lock:
+            return {service_id: dict(counts) for service_id, counts in self._counts.items()}
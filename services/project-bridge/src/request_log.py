@@ -0,0 +1,143 @@
+"""Background batched writer for request_logs
+
+Proxied requests used to insert and commit their log row inline, tying
+proxy latency to the disk. Entries are now put on a bounded in-memory queue
+and a writer thread inserts them in multi-row transactions, once
+LOG_BATCH_SIZE entries are pending or LOG_FLUSH_INTERVAL seconds after the
+first one. When the queue is full, entries are dropped (and counted) rather
+than making the request wait.
+
+High-volume services can be sampled: a success is kept with probability
+`sample_rate` and stored with a `sample_weight` of 1 / sample_rate, so
+weighted counts stay unbiased. Errors (status >= 400) are always kept.
+"""
+import logging
+import os
+import queue
+import random
+import threading
+import time
+
+from src import db
+
+# Entries waiting to be written before new ones are dropped
+LOG_QUEUE_SIZE = int(os.environ.get('BRIDGE_LOG_QUEUE_SIZE', 10000))
+# Entries written per transaction
+LOG_BATCH_SIZE = int(os.environ.get('BRIDGE_LOG_BATCH_SIZE', 500))
+# Seconds an entry may wait for its batch to fill
+LOG_FLUSH_INTERVAL = float(os.environ.get('BRIDGE_LOG_FLUSH_INTERVAL', 1))
+# Share of successful requests logged (overridden by services.log_sample_rate)
+LOG_SAMPLE_RATE = float(os.environ.get('BRIDGE_LOG_SAMPLE_RATE', 1))
+
+logger = logging.getLogger(__name__)
+
+
+class RequestLogWriter:
+    """Bounded queue of request log entries drained by a writer thread"""
+
+    def __init__(self, queue_size=LOG_QUEUE_SIZE, batch_size=LOG_BATCH_SIZE, flush_interval=LOG_FLUSH_INTERVAL,
+                 sample_rate=LOG_SAMPLE_RATE):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.sample_rate = sample_rate
+        self.database = None
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._pending = []
+        self._first_pending_at = None
+        self._write_lock = threading.Lock()
+        self._counter_lock = threading.Lock()
+        self._thread = None
+        self.written = 0
+        self.dropped = 0
+        self.sampled_out = 0
+        self.batches = 0
+
+    def open(self, database):
+        """Write to `database` from now on, starting the writer thread"""
+        self.flush()
+        self.database = database
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='request-log-writer', daemon=True)
+            self._thread.start()
+
+    def log(self, service_id, method, path, status_code, response_time, user_agent, ip_address, sample_rate=None):
+        """Queue an entry; returns False if it was sampled out or dropped"""
+        rate = self.sample_rate if sample_rate is None else sample_rate
+        weight = 1.0
+        if status_code is None or status_code < 400:
+            if rate <= 0 or (rate < 1 and random.random() >= rate):
+                with self._counter_lock:
+                    self.sampled_out += 1
+                return False
+            weight = 1 / min(rate, 1)
+        try:
+            self._queue.put_nowait((service_id, method, path, status_code, response_time, user_agent, ip_address,
+                                    weight, time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime())))
+        except queue.Full:
+            with self._counter_lock:
+                self.dropped += 1
+            return False
+        return True
+
+    def _run(self):
+        while True:
+            timeout = self.flush_interval
+            if self._first_pending_at is not None:
+                timeout = max(self._first_pending_at + self.flush_interval - time.monotonic(), 0)
+            try:
+                entry = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                entry = None
+            try:
+                with self._write_lock:
+                    if entry is not None:
+                        self._add(entry)
+                    due = (self._first_pending_at is not None
+                           and time.monotonic() - self._first_pending_at >= self.flush_interval)
+                    if len(self._pending) >= self.batch_size or due:
+                        self._write()
+            except Exception:
+                logger.exception('Writing request logs failed')
+
+    def _add(self, entry):
+        if not self._pending:
+            self._first_pending_at = time.monotonic()
+        self._pending.append(entry)
+
+    def _write(self):
+        batch, self._pending, self._first_pending_at = self._pending, [], None
+        if not batch or self.database is None:
+            return
+        conn = db.connect(self.database)
+        try:
+            conn.executemany('''
+                INSERT INTO request_logs (service_id, method, path, status_code, response_time, user_agent,
+                                          ip_address, sample_weight, timestamp)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ''', batch)
+            conn.commit()
+        finally:
+            conn.close()
+        with self._counter_lock:
+            self.written += len(batch)
+            self.batches += 1
+
+    def flush(self):
+        """Write every queued entry now (shutdown, tests)"""
+        with self._write_lock:
+            while True:
+                try:
+                    self._add(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            self._write()
+
+    def stats(self):
+        with self._counter_lock:
+            return {
+                'queued': self._queue.qsize() + len(self._pending),
+                'written': self.written,
+                'dropped': self.dropped,
+                'sampled_out': self.sampled_out,
+                'batches': self.batches
+            }
@@ -0,0 +1,260 @@
+"""Retries and hedged requests to upstream targets
+
+Requests with an idempotent method are retried, on another target when
+the service has several, after a connect error (nothing reached the
+upstream), up to the service's `max_retries` (else MAX_RETRIES) times. A
+body is only replayed when it was not read yet or was spooled.
+
+With `hedge` set, a GET/HEAD/OPTIONS without body still waiting for its
+response after the service's p95 latency (over its last LATENCY_WINDOW
+responses, once it has HEDGE_MIN_SAMPLES of them) is sent a second time to
+another target. The first response wins and the other one is closed. The
+first request of a hedged pair gets a thread of its own, so it never waits
+behind other requests; hedges go through a pool of HEDGE_THREADS threads
+and are dropped if still queued when the first request is answered.
+
+Retries and hedges are extra load on the upstream, capped by a budget per
+service: over the last RETRY_BUDGET_WINDOW seconds, at most `retry_budget`
+(else RETRY_BUDGET) percent of the requests, or RETRY_MIN_PER_SECOND per
+second for services with little traffic.
+"""
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, TimeoutError, wait
+
+import requests
+from urllib3.exceptions import ConnectTimeoutError, NewConnectionError
+
+# Seconds waited for an upstream response (overridden by services.timeout)
+UPSTREAM_TIMEOUT = float(os.environ.get('BRIDGE_UPSTREAM_TIMEOUT', 30))
+# Seconds waited for an upstream connection
+CONNECT_TIMEOUT = float(os.environ.get('BRIDGE_CONNECT_TIMEOUT', 5))
+# Retries after connect errors (overridden by services.max_retries)
+MAX_RETRIES = int(os.environ.get('BRIDGE_MAX_RETRIES', 2))
+# Retries and hedges as a percentage of requests (overridden by services.retry_budget)
+RETRY_BUDGET = float(os.environ.get('BRIDGE_RETRY_BUDGET', 10))
+# Retries and hedges per second allowed whatever the traffic
+RETRY_MIN_PER_SECOND = float(os.environ.get('BRIDGE_RETRY_MIN_PER_SECOND', 1))
+# Seconds over which the retry budget is computed
+RETRY_BUDGET_WINDOW = int(os.environ.get('BRIDGE_RETRY_BUDGET_WINDOW', 10))
+# Latencies kept per service for its p95
+LATENCY_WINDOW = int(os.environ.get('BRIDGE_LATENCY_WINDOW', 1000))
+# Latencies a service needs before its requests are hedged
+HEDGE_MIN_SAMPLES = int(os.environ.get('BRIDGE_HEDGE_MIN_SAMPLES', 20))
+# Threads sending hedges (the second request of a hedged pair)
+HEDGE_THREADS = int(os.environ.get('BRIDGE_HEDGE_THREADS', 64))
+
+IDEMPOTENT_METHODS = frozenset(('GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE'))
+HEDGED_METHODS = frozenset(('GET', 'HEAD', 'OPTIONS'))
+
+
+def upstream_timeout(service):
+    """(connect, read) timeout of requests sent to `service`"""
+    timeout = service.get('timeout') or UPSTREAM_TIMEOUT
+    return (min(CONNECT_TIMEOUT, timeout), timeout)
+
+
+def is_connect_error(error):
+    """Whether `error` happened before the request reached the upstream"""
+    if isinstance(error, requests.exceptions.ConnectTimeout):
+        return True
+    if not isinstance(error, requests.exceptions.ConnectionError) or not error.args:
+        return False
+    reason = getattr(error.args[0], 'reason', error.args[0])
+    return isinstance(reason, (NewConnectionError, ConnectTimeoutError))
+
+
+class RetryBudget:
+    """Requests and retries of one service over a sliding window of seconds"""
+
+    def __init__(self, percent, min_per_second=RETRY_MIN_PER_SECOND, window=RETRY_BUDGET_WINDOW):
+        self.percent = percent
+        self.min_per_second = min_per_second
+        self.window = window
+        # [second, requests, retries]
+        self._buckets = deque()
+
+    def _bucket(self, now):
+        second = int(now)
+        if not self._buckets or self._buckets[-1][0] != second:
+            self._buckets.append([second, 0, 0])
+        while self._buckets[0][0] <= second - self.window:
+            self._buckets.popleft()
+        return self._buckets[-1]
+
+    def record_request(self, now):
+        self._bucket(now)[1] += 1
+
+    def withdraw(self, now):
+        """Count one retry if the budget allows it"""
+        bucket = self._bucket(now)
+        requests_count = sum(entry[1] for entry in self._buckets)
+        retries = sum(entry[2] for entry in self._buckets)
+        if retries + 1 > max(self.min_per_second * self.window, requests_count * self.percent / 100):
+            return False
+        bucket[2] += 1
+        return True
+
+
+class LatencyWindow:
+    """Last response latencies of one service"""
+
+    def __init__(self, size=LATENCY_WINDOW):
+        self._samples = deque(maxlen=size)
+        self._p95 = None
+
+    def record(self, latency):
+        self._samples.append(latency)
+        self._p95 = None
+
+    def p95(self, min_samples=HEDGE_MIN_SAMPLES):
+        if len(self._samples) < max(min_samples, 1):
+            return None
+        if self._p95 is None:
+            samples = sorted(self._samples)
+            self._p95 = samples[int(0.95 * (len(samples) - 1))]
+        return self._p95
+
+
+class RetryPolicy:
+    """Sends upstream requests with retries and hedging, per service budgets"""
+
+    def __init__(self, max_retries=MAX_RETRIES, budget=RETRY_BUDGET, min_per_second=RETRY_MIN_PER_SECOND,
+                 window=RETRY_BUDGET_WINDOW, hedge_min_samples=HEDGE_MIN_SAMPLES, hedge_threads=HEDGE_THREADS):
+        self.max_retries = max_retries
+        self.budget = budget
+        self.min_per_second = min_per_second
+        self.window = window
+        self.hedge_min_samples = hedge_min_samples
+        self.hedge_threads = hedge_threads
+        self._lock = threading.Lock()
+        self._budgets = {}
+        self._latencies = {}
+        self._counts = {}
+        self._executor = None
+
+    def _service(self, service):
+        budget = self._budgets.get(service['id'])
+        if budget is None:
+            budget = self._budgets[service['id']] = RetryBudget(0, self.min_per_second, self.window)
+            self._latencies[service['id']] = LatencyWindow()
+            self._counts[service['id']] = {'service': service['name'], 'retries': 0, 'hedges': 0, 'hedge_wins': 0,
+                                           'budget_exhausted': 0}
+        percent = service.get('retry_budget')
+        budget.percent = self.budget if percent is None else percent
+        return budget, self._latencies[service['id']], self._counts[service['id']]
+
+    def _withdraw(self, service, kind):
+        with self._lock:
+            budget, _, counts = self._service(service)
+            if not budget.withdraw(time.monotonic()):
+                counts['budget_exhausted'] += 1
+                return False
+            counts[kind] += 1
+            return True
+
+    def hedge_delay(self, service):
+        """Seconds after which a request of `service` is hedged, or None"""
+        with self._lock:
+            return self._service(service)[1].p95(self.hedge_min_samples)
+
+    def send(self, service, method, body, attempt):
+        """Result of `attempt(tried)` under the retry policy of `service`
+
+        `attempt` sends one request to a target whose URL is not in `tried`
+        (appending the one it picked) and returns (response, stack, latency)
+        where closing the ExitStack `stack` releases the response.
+        """
+        with self._lock:
+            budget, latencies, _ = self._service(service)
+            budget.record_request(time.monotonic())
+        max_retries = service.get('max_retries')
+        max_retries = self.max_retries if max_retries is None else max_retries
+        hedge = service.get('hedge') and method in HEDGED_METHODS and body is None
+        tried = []
+        retries = 0
+        while True:
+            try:
+                delay = self.hedge_delay(service) if hedge else None
+                result = self._hedged(service, attempt, tried, delay) if delay is not None else attempt(tried)
+            except requests.exceptions.ConnectionError as e:
+                if (method not in IDEMPOTENT_METHODS or retries >= max_retries or not is_connect_error(e)
+                        or (body is not None and not body.rewind())):
+                    raise
+                if not self._withdraw(service, 'retries'):
+                    raise
+                retries += 1
+                continue
+            with self._lock:
+                latencies.record(result[2])
+            return result
+
+    def _hedged(self, service, attempt, tried, delay):
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(self.hedge_threads, thread_name_prefix='bridge-hedge')
+        primary = _start(attempt, tried)
+        try:
+            return primary.result(timeout=delay)
+        except TimeoutError:
+            pass
+        if not self._withdraw(service, 'hedges'):
+            return primary.result()
+        hedge = self._executor.submit(attempt, tried)
+
+        pending = {primary, hedge}
+        error = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            winners = [future for future in done if future.exception() is None]
+            if winners:
+                if winners[0] is hedge:
+                    with self._lock:
+                        self._service(service)[2]['hedge_wins'] += 1
+                for future in winners[1:]:
+                    future.result()[1].close()
+                for future in pending:
+                    if not future.cancel():
+                        future.add_done_callback(_discard)
+                return winners[0].result()
+            error = done.pop().exception()
+        raise error
+
+    def reset(self):
+        with self._lock:
+            self._budgets.clear()
+            self._latencies.clear()
+            self._counts.clear()
+
+    def stats(self):
+        """Retry and hedge counters, and p95 latency, by service id"""
+        with self._lock:
+            stats = {}
+            for service_id, counts in self._counts.items():
+                p95 = self._latencies[service_id].p95(1)
+                stats[service_id] = {**counts, 'p95_ms': None if p95 is None else round(p95 * 1000, 3)}
+            return stats
+
+
+def _start(attempt, tried):
+    # Future of `attempt(tried)` run on a new thread, never queued
+    future = Future()
+
+    def run():
+        if future.set_running_or_notify_cancel():
+            try:
+                future.set_result(attempt(tried))
+            except BaseException as e:
+                future.set_exception(e)
+
+    threading.Thread(target=run, name='bridge-hedged-primary', daemon=True).start()
+    return future
+
+
+def _discard(future):
+    # Close the response of a hedged request that lost the race
+    if future.exception() is None:
+        future.result()[1].close()
@@ -0,0 +1,216 @@
+"""In-memory route table: longest path prefix match over enabled services
+
+Services are compiled into a trie keyed by path segments, so a lookup walks
+at most one node per segment of the request path, whatever the number of
+registered prefixes. Matching respects segment boundaries: `/api/chat`
+matches `/api/chat` and `/api/chat/x`, not `/api/chatbot`. The part of the
+path forwarded upstream is what follows the matched segments, however
+many slashes separate them.
+
+Each service carries its upstream targets: `target_url` followed by the
+enabled rows of `service_targets`.
+
+Every change to the services and service_targets tables bumps `route_table_version` (triggers),
+and workers compare it with the version their trie was built from at most
+once per ROUTE_REFRESH_INTERVAL, rebuilding the whole trie and swapping it
+in one assignment when it moved.
+"""
+import os
+import threading
+import time
+
+from src import db
+
+# Seconds between two checks of the version stamp for changes made by
+# other processes (changes made by this process apply immediately)
+ROUTE_REFRESH_INTERVAL = float(os.environ.get('BRIDGE_ROUTE_REFRESH_INTERVAL', 1))
+
+SERVICE_COLUMNS = ('id', 'name', 'target_url', 'path_prefix', 'enabled', 'auth_required', 'rate_limit', 'pool_size',
+                   'max_body_size', 'log_sample_rate', 'cache_enabled', 'coalesce_headers', 'load_balancing',
+                   'timeout', 'max_retries', 'hedge', 'retry_budget')
+
+
+def create_route_version_table(cursor):
+    """Create the version stamp bumped by every change to services"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS route_table_version (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            version INTEGER NOT NULL
+        )
+    ''')
+    cursor.execute('INSERT OR IGNORE INTO route_table_version (id, version) VALUES (1, 0)')
+    for event in ('INSERT', 'UPDATE', 'DELETE'):
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS services_route_version_{event.lower()}
+            AFTER {event} ON services
+            BEGIN
+                UPDATE route_table_version SET version = version + 1 WHERE id = 1;
+            END
+        ''')
+
+
+def create_service_targets_table(cursor):
+    """Create the additional upstream targets of services"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS service_targets (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            service_id INTEGER NOT NULL,
+            url TEXT NOT NULL,
+            enabled BOOLEAN DEFAULT 1,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (service_id) REFERENCES services (id)
+        )
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_service_targets_service_id ON service_targets (service_id)')
+    for event in ('INSERT', 'UPDATE', 'DELETE'):
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS service_targets_route_version_{event.lower()}
+            AFTER {event} ON service_targets
+            BEGIN
+                UPDATE route_table_version SET version = version + 1 WHERE id = 1;
+            END
+        ''')
+
+
+def split_path(path):
+    return [segment for segment in path.split('/') if segment]
+
+
+def strip_segments(path, count):
+    """`path` without its first `count` segments, the rest kept as it is"""
+    index = 0
+    for _ in range(count):
+        while index < len(path) and path[index] == '/':
+            index += 1
+        index = path.find('/', index)
+        if index < 0:
+            return ''
+    return path[index:]
+
+
+class _Node:
+    __slots__ = ('children', 'service')
+
+    def __init__(self):
+        self.children = {}
+        self.service = None
+
+
+class RouteTrie:
+    """Path segment trie mapping prefixes to services"""
+
+    def __init__(self):
+        self._root = _Node()
+        self.size = 0
+
+    def insert(self, prefix, service):
+        """Register `service` under `prefix` (the first one registered wins)"""
+        node = self._root
+        for segment in split_path(prefix):
+            child = node.children.get(segment)
+            if child is None:
+                child = node.children[segment] = _Node()
+            node = child
+        if node.service is None:
+            node.service = service
+            self.size += 1
+
+    def longest_match(self, path):
+        """Service with the longest prefix matching whole segments of `path`"""
+        return self.match(path)[0]
+
+    def match(self, path):
+        """(service, number of segments of its prefix) of the longest match of `path`"""
+        node = self._root
+        match, depth = node.service, 0
+        for i, segment in enumerate(split_path(path)):
+            node = node.children.get(segment)
+            if node is None:
+                break
+            if node.service is not None:
+                match, depth = node.service, i + 1
+        return match, depth
+
+
+def build_trie(rows, targets=None):
+    """Trie of the enabled services among `rows` (SERVICE_COLUMNS tuples)
+
+    `targets` maps service ids to the URLs of their additional targets.
+    """
+    trie = RouteTrie()
+    targets = targets or {}
+    # Lowest id first, so duplicated prefixes resolve like before
+    for row in sorted(rows, key=lambda row: row[0]):
+        service = dict(zip(SERVICE_COLUMNS, row))
+        service['targets'] = list(dict.fromkeys([service['target_url']] + targets.get(service['id'], [])))
+        if service['enabled']:
+            trie.insert(service['path_prefix'], service)
+    return trie
+
+
+class RouteTable:
+    """Current route trie of a database and the version it was built from"""
+
+    def __init__(self, refresh_interval=ROUTE_REFRESH_INTERVAL):
+        self.refresh_interval = refresh_interval
+        self.database = None
+        self.version = None
+        self._trie = RouteTrie()
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+
+    def reload(self, database=None):
+        """Rebuild the trie from the services table and swap it in"""
+        with self._lock:
+            if database is not None:
+                self.database = database
+            conn = db.connect(self.database)
+            cursor = conn.cursor()
+            try:
+                # Version and rows from the same snapshot
+                cursor.execute('BEGIN')
+                cursor.execute('SELECT version FROM route_table_version WHERE id = 1')
+                version = cursor.fetchone()[0]
+                cursor.execute(f'SELECT {", ".join(SERVICE_COLUMNS)} FROM services')
+                rows = cursor.fetchall()
+                cursor.execute('SELECT service_id, url FROM service_targets WHERE enabled = 1 ORDER BY id')
+                targets = {}
+                for service_id, url in cursor.fetchall():
+                    targets.setdefault(service_id, []).append(url)
+                trie = build_trie(rows, targets)
+            finally:
+                conn.close()
+            self._trie, self.version = trie, version
+            self._checked_at = time.monotonic()
+
+    def refresh(self, now=None):
+        """Reload if another process changed the services since the last check"""
+        now = time.monotonic() if now is None else now
+        if self.database is None or now - self._checked_at < self.refresh_interval:
+            return False
+        self._checked_at = now
+        conn = db.connect(self.database)
+        try:
+            version = conn.execute('SELECT version FROM route_table_version WHERE id = 1').fetchone()[0]
+        finally:
+            conn.close()
+        if version == self.version:
+            return False
+        self.reload()
+        return True
+
+    def lookup(self, path):
+        """Service routing `path`, or None"""
+        return self.route(path)[0]
+
+    def route(self, path):
+        """(service routing `path`, rest of `path` after the prefix), or (None, None)"""
+        self.refresh()
+        service, depth = self._trie.match(path)
+        if service is None:
+            return None, None
+        return dict(service), strip_segments(path, depth)
+
+    @property
+    def size(self):
+        return self._trie.size
@@ -0,0 +1,199 @@
+"""Pooled keep-alive HTTP clients for upstream services
+
+Every service gets its own requests.Session whose adapter keeps up to
+`pool_size` connections open to each of its upstream targets (at most
+POOL_TARGETS of them), so proxied requests reuse a warm TCP/TLS connection
+instead of connecting each time. When every connection is busy, requests
+wait for one to come back (up to POOL_WAIT_TIMEOUT). A service pool unused
+for POOL_IDLE_TIMEOUT seconds is closed along with its connections, and
+so is one replaced after a `pool_size` change, once its last request ends.
+
+Sessions are shared by every client of a service, so they keep no cookies:
+a Set-Cookie only reaches the client it was meant for.
+
+Each pool counts its checkouts, the new connections it had to open and the
+time spent waiting for a free connection.
+"""
+import os
+import threading
+import time
+from contextlib import contextmanager
+from http.cookiejar import DefaultCookiePolicy
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+# Connections kept open per service (overridden by services.pool_size)
+POOL_SIZE = int(os.environ.get('BRIDGE_POOL_SIZE', 10))
+# Seconds without requests after which a service pool is closed
+POOL_IDLE_TIMEOUT = float(os.environ.get('BRIDGE_POOL_IDLE_TIMEOUT', 60))
+# Seconds a request waits for a free connection of an exhausted pool
+POOL_WAIT_TIMEOUT = float(os.environ.get('BRIDGE_POOL_WAIT_TIMEOUT', 10))
+# Targets of a service keeping their own connections in its pool
+POOL_TARGETS = int(os.environ.get('BRIDGE_POOL_TARGETS', 16))
+# Keep upstream connections open between requests
+KEEPALIVE = os.environ.get('BRIDGE_KEEPALIVE', '1') == '1'
+
+
+class PoolStats:
+    """Checkout counters of one service pool"""
+
+    def __init__(self, name):
+        self.name = name
+        self.requests = 0
+        self.connections_opened = 0
+        self.wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+        self._lock = threading.Lock()
+
+    def record_checkout(self, waited, new_connection):
+        with self._lock:
+            self.requests += 1
+            self.connections_opened += new_connection
+            self.wait_seconds += waited
+            self.max_wait_seconds = max(self.max_wait_seconds, waited)
+
+    def snapshot(self):
+        with self._lock:
+            reused = self.requests - self.connections_opened
+            return {
+                'service': self.name,
+                'requests': self.requests,
+                'connections_opened': self.connections_opened,
+                'reuse_ratio': reused / self.requests if self.requests else None,
+                'pool_wait_seconds': self.wait_seconds,
+                'max_pool_wait_seconds': self.max_wait_seconds
+            }
+
+
+class _CountingPool:
+    """Connection pool mixin timing checkouts and spotting new connections"""
+
+    stats = None
+    wait_timeout = POOL_WAIT_TIMEOUT
+
+    def _get_conn(self, timeout=None):
+        started = time.perf_counter()
+        conn = super()._get_conn(timeout=self.wait_timeout if timeout is None else timeout)
+        # Dropped or never used connections come back without a socket
+        self.stats.record_checkout(time.perf_counter() - started, conn.sock is None)
+        return conn
+
+
+class PooledAdapter(HTTPAdapter):
+    """HTTPAdapter with blocking pools that report to a PoolStats"""
+
+    def __init__(self, stats, pool_size, wait_timeout=POOL_WAIT_TIMEOUT):
+        self.stats = stats
+        self.wait_timeout = wait_timeout
+        super().__init__(pool_connections=POOL_TARGETS, pool_maxsize=pool_size, pool_block=True)
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        attributes = {'stats': self.stats, 'wait_timeout': self.wait_timeout}
+        self.poolmanager.pool_classes_by_scheme = {
+            'http': type('CountingHTTPConnectionPool', (_CountingPool, HTTPConnectionPool), attributes),
+            'https': type('CountingHTTPSConnectionPool', (_CountingPool, HTTPSConnectionPool), attributes),
+        }
+
+
+class _ServicePool:
+    def __init__(self, session, size):
+        self.session = session
+        self.size = size
+        self.last_used = time.monotonic()
+        self.in_flight = 0
+        # Replaced (pool_size changed) while in flight: closed by its last checkout
+        self.replaced = False
+
+
+class UpstreamPools:
+    """One pooled session per service id, closed after an idle period"""
+
+    def __init__(self, pool_size=POOL_SIZE, idle_timeout=POOL_IDLE_TIMEOUT, keepalive=KEEPALIVE,
+                 wait_timeout=POOL_WAIT_TIMEOUT):
+        self.pool_size = pool_size
+        self.idle_timeout = idle_timeout
+        self.keepalive = keepalive
+        self.wait_timeout = wait_timeout
+        self._lock = threading.Lock()
+        self._pools = {}
+        self._stats = {}
+        self._swept_at = time.monotonic()
+
+    def _new_session(self, stats, size):
+        session = requests.Session()
+        # Proxied requests carry the client's headers, not the environment's
+        session.trust_env = False
+        # nor cookies set by responses to other clients
+        session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+        if not self.keepalive:
+            session.headers['Connection'] = 'close'
+        adapter = PooledAdapter(stats, size, self.wait_timeout)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        return session
+
+    @contextmanager
+    def client(self, service):
+        """Check out the pooled session of `service` for one request"""
+        size = service.get('pool_size') or self.pool_size
+        now = time.monotonic()
+        with self._lock:
+            stats = self._stats.get(service['id'])
+            if stats is None:
+                stats = self._stats[service['id']] = PoolStats(service['name'])
+            stats.name = service['name']
+            pool = self._pools.get(service['id'])
+            if pool is None or pool.size != size:
+                if pool is not None:
+                    if pool.in_flight:
+                        pool.replaced = True
+                    else:
+                        pool.session.close()
+                pool = self._pools[service['id']] = _ServicePool(self._new_session(stats, size), size)
+            pool.in_flight += 1
+            pool.last_used = now
+        try:
+            yield pool.session
+        finally:
+            with self._lock:
+                pool.in_flight -= 1
+                pool.last_used = time.monotonic()
+                retired = pool.replaced and not pool.in_flight
+            if retired:
+                pool.session.close()
+            self.close_idle()
+
+    def close_idle(self, now=None):
+        """Close the pools of services idle for longer than idle_timeout"""
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            if now - self._swept_at < min(self.idle_timeout, 1):
+                return []
+            self._swept_at = now
+            idle = [service_id for service_id, pool in self._pools.items()
+                    if not pool.in_flight and now - pool.last_used >= self.idle_timeout]
+            sessions = [self._pools.pop(service_id).session for service_id in idle]
+        for session in sessions:
+            session.close()
+        return idle
+
+    def stats(self):
+        """Counters of every service pool, by service id"""
+        with self._lock:
+            open_pools = {service_id: pool.size for service_id, pool in self._pools.items()}
+            stats = dict(self._stats)
+        return {
+            service_id: {**entry.snapshot(), 'pool_size': open_pools.get(service_id), 'open': service_id in open_pools}
+            for service_id, entry in stats.items()
+        }
+
+    def close_all(self):
+        with self._lock:
+            sessions = [pool.session for pool in self._pools.values()]
+            self._pools.clear()
+            self._stats.clear()
+        for session in sessions:
+            session.close()
@@ -0,0 +1,209 @@
+import pytest
+import sys
+import os
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from src import main
+from src.balancing import Balancer
+from collections import Counter
+import http.server
+import random
+import threading
+import time
+
+@pytest.fixture(autouse=True)
+def balancer(monkeypatch):
+    """Use a balancer with a seeded random source."""
+    monkeypatch.setattr(main, 'balancer', Balancer(rng=random.Random(0)))
+
+@pytest.fixture
+def stubs(client):
+    """Start local upstreams answering with an injected latency and status."""
+    servers = []
+
+    def start(delay=0.0, status=200):
+        class Handler(http.server.BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                time.sleep(delay)
+                body = str(server.server_port).encode()
+                self.send_response(status)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        return f'http://127.0.0.1:{server.server_port}'
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+def add_service(client, urls, load_balancing):
+    response = client.post('/api/bridge/services', json={
+        'name': 'Stub', 'type': 'api', 'target_url': urls[0], 'path_prefix': '/api/stub',
+        'load_balancing': load_balancing
+    })
+    service_id = response.get_json()['id']
+    for url in urls[1:]:
+        assert client.post(f'/api/bridge/services/{service_id}/targets', json={'url': url}).status_code == 201
+    return service_id
+
+def served_by(client, count, parallel=1):
+    """(status, upstream port) of `count` GETs sent by `parallel` concurrent clients."""
+    results = []
+    lock = threading.Lock()
+
+    def worker(first):
+        for i in range(first, count, parallel):
+            # Distinct paths, so that concurrent requests are not coalesced
+            response = main.app.test_client().get(f'/api/stub/items/{i}')
+            with lock:
+                results.append((response.status_code, response.data.decode()))
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(parallel)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+def service(targets, load_balancing):
+    return {'id': 1, 'target_url': targets[0], 'targets': targets, 'load_balancing': load_balancing}
+
+class TestBalancer:
+    """Test target selection and ejection."""
+
+    def test_round_robin(self):
+        """Targets are picked in turn."""
+        balancer = Balancer()
+        picks = [balancer.pick(service(['a', 'b', 'c'], 'round_robin')).url for _ in range(6)]
+        assert picks == ['a', 'b', 'c', 'a', 'b', 'c']
+
+    def test_least_outstanding(self):
+        """The target with the fewest requests in progress is picked."""
+        balancer = Balancer()
+        busy = balancer.pick(service(['a', 'b'], 'least_outstanding'))
+        assert balancer.pick(service(['a', 'b'], 'least_outstanding')).url != busy.url
+        balancer.release(busy)
+        assert balancer.pick(service(['a', 'b'], 'least_outstanding')).url == busy.url
+
+    def test_p2c_ewma_prefers_fast_targets(self):
+        """Two random choices settle on the targets with the lowest latency."""
+        balancer = Balancer(rng=random.Random(0))
+        latencies = {'fast': 0.01, 'medium': 0.05, 'slow': 0.5}
+        picks = Counter()
+        for i in range(300):
+            target = balancer.pick(service(list(latencies), 'p2c_ewma'), now=i)
+            balancer.observe({'id': 1}, target, latencies[target.url], False, now=i)
+            balancer.release(target)
+            picks[target.url] += 1
+
+        assert picks['fast'] > picks['medium'] > picks['slow']
+        assert picks['slow'] < 10
+
+    def test_ejection_and_reintroduction(self):
+        """Consecutive failures eject a target until its ejection time passed."""
+        balancer = Balancer(consecutive_failures=3, base_ejection_time=30)
+        targets = service(['a', 'b', 'c'], 'round_robin')
+        for _ in range(3):
+            balancer.observe(targets, balancer.pick(targets, now=0), 0.01, False, now=0)
+        bad = balancer.pick(targets, now=0)
+        for _ in range(3):
+            balancer.observe(targets, bad, 0.01, True, now=0)
+
+        assert bad.url not in {balancer.pick(targets, now=10).url for _ in range(6)}
+        assert bad.url in {balancer.pick(targets, now=31).url for _ in range(6)}
+        assert balancer.stats(now=10)[1][0]['ejections'] == 1
+
+    def test_max_ejection_percent(self):
+        """No more than max_ejection_percent of the targets are ejected at once."""
+        balancer = Balancer(consecutive_failures=1, max_ejection_percent=50)
+        targets = service(['a', 'b', 'c', 'd'], 'round_robin')
+        for _ in range(4):
+            balancer.observe(targets, balancer.pick(targets, now=0), 0.01, True, now=0)
+
+        assert sum(target['ejected'] for target in balancer.stats(now=0)[1]) == 2
+
+class TestBalancingAPI:
+    """Test balanced proxying against stub upstreams with injected latency."""
+
+    def test_round_robin_spreads_evenly(self, client, stubs):
+        """Sequential requests are spread evenly over the targets."""
+        urls = [stubs() for _ in range(3)]
+        add_service(client, urls, 'round_robin')
+
+        counts = Counter(port for _, port in served_by(client, 30))
+        assert sorted(counts.values()) == [10, 10, 10]
+
+    def test_least_outstanding_avoids_slow_target(self, client, stubs):
+        """Under concurrency, the slow target holds requests and gets fewer new ones."""
+        urls = [stubs(), stubs(), stubs(delay=0.3)]
+        add_service(client, urls, 'least_outstanding')
+
+        counts = Counter(port for _, port in served_by(client, 40, parallel=4))
+        slow_port = urls[2].rsplit(':', 1)[1]
+        assert counts[slow_port] < min(counts[url.rsplit(':', 1)[1]] for url in urls[:2])
+
+    def test_p2c_ewma_avoids_slow_target(self, client, stubs):
+        """Power of two choices over EWMA latency sends little traffic to the slow target."""
+        urls = [stubs(delay=0.005), stubs(delay=0.005), stubs(delay=0.2)]
+        add_service(client, urls, 'p2c_ewma')
+
+        counts = Counter(port for _, port in served_by(client, 40))
+        assert counts[urls[2].rsplit(':', 1)[1]] <= 3
+
+    def test_failing_target_is_ejected(self, client, stubs, monkeypatch):
+        """A target answering 503 is ejected, then reintroduced after its ejection time."""
+        monkeypatch.setattr(main.balancer, 'base_ejection_time', 0.5)
+        urls = [stubs(), stubs(status=503)]
+        service_id = add_service(client, urls, 'round_robin')
+
+        statuses = [status for status, _ in served_by(client, 10)]
+        assert statuses.count(503) == 5
+        assert [status for status, _ in served_by(client, 10)] == [200] * 10
+
+        targets = client.get(f'/api/bridge/services/{service_id}/targets').get_json()['targets']
+        assert [target['ejected'] for target in targets] == [False, True]
+
+        time.sleep(0.6)
+        assert 503 in [status for status, _ in served_by(client, 4)]
+
+    def test_unreachable_target_is_ejected(self, client, stubs):
+        """Connection errors count as failures."""
+        urls = [stubs(), 'http://127.0.0.1:9']
+        add_service(client, urls, 'round_robin')
+
+        served_by(client, 10)
+        assert [status for status, _ in served_by(client, 6)] == [200] * 6
+
+    def test_target_management(self, client, stubs):
+        """Targets are listed with their state, and can be removed."""
+        urls = [stubs(), stubs()]
+        service_id = add_service(client, urls, 'round_robin')
+        served_by(client, 4)
+
+        listing = client.get(f'/api/bridge/services/{service_id}/targets').get_json()
+        assert listing['load_balancing'] == 'round_robin'
+        assert [target['url'] for target in listing['targets']] == urls
+        assert [target['requests'] for target in listing['targets']] == [2, 2]
+
+        target_id = listing['targets'][1]['id']
+        assert client.delete(f'/api/bridge/services/{service_id}/targets/{target_id}').status_code == 200
+        assert client.delete(f'/api/bridge/services/{service_id}/targets/{target_id}').status_code == 404
+        assert {port for _, port in served_by(client, 4)} == {urls[0].rsplit(':', 1)[1]}
+
+        metrics = client.get('/metrics').data.decode()
+        assert f'bridge_target_requests_total{{service_id="{service_id}",target="{urls[0]}"}} 6.0' in metrics
+
+    def test_invalid_load_balancing(self, client):
+        """Unknown balancing algorithms are rejected."""
+        response = client.put('/api/bridge/services/1', json={'load_balancing': 'random'})
+        assert response.status_code == 400
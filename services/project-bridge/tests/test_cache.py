@@ -0,0 +1,218 @@
+import pytest
+import sys
+import os
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from src import main
+from src.cache import ResponseCache, freshness_lifetime
+from werkzeug.datastructures import Headers
+import http.server
+import threading
+
+@pytest.fixture(autouse=True)
+def response_cache(tmp_path, monkeypatch):
+    """Use a cache with small memory entries and its own disk directory."""
+    monkeypatch.setattr(main, 'response_cache', ResponseCache(memory_entry_size=1024, disk_dir=str(tmp_path / 'cache')))
+
+def fetch(client, path, **kwargs):
+    """GET through the bridge, reading the whole body like a real client would."""
+    response = client.get(path, **kwargs)
+    response.data
+    return response
+
+@pytest.fixture
+def upstream(client):
+    """Local upstream with cacheable, validated, varying and uncacheable responses."""
+    seen = []
+
+    class Handler(http.server.BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def reply(self, status, headers, body=b''):
+            self.send_response(status)
+            for name, value in headers:
+                self.send_header(name, value)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            seen.append((self.path, dict(self.headers)))
+            if self.path.startswith('/fresh'):
+                self.reply(200, [('Cache-Control', 'max-age=60')], f'fresh {len(seen)}'.encode())
+            elif self.path == '/etag':
+                if self.headers.get('If-None-Match') == '"v1"':
+                    self.reply(304, [('ETag', '"v1"'), ('Cache-Control', 'max-age=0')])
+                else:
+                    self.reply(200, [('ETag', '"v1"'), ('Cache-Control', 'max-age=0')], b'validated body')
+            elif self.path == '/vary':
+                language = self.headers.get('Accept-Language', '')
+                self.reply(200, [('Cache-Control', 'max-age=60'), ('Vary', 'Accept-Language')],
+                           f'hello {language}'.encode())
+            elif self.path == '/private':
+                self.reply(200, [('Cache-Control', 'private, max-age=60')], b'private')
+            elif self.path == '/ranged':
+                if self.headers.get('Range') == 'bytes=0-1':
+                    self.reply(206, [('Cache-Control', 'max-age=60'), ('Content-Range', 'bytes 0-1/10')], b'01')
+                else:
+                    self.reply(200, [('Cache-Control', 'max-age=60')], b'0123456789')
+            elif self.path == '/large':
+                self.reply(200, [('Cache-Control', 'max-age=60')], b'x' * 100000)
+
+        def do_POST(self):
+            seen.append((self.path, dict(self.headers)))
+            self.reply(204, [])
+
+        def log_message(self, *args):
+            pass
+
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    client.put('/api/bridge/services/1', json={
+        'target_url': f'http://127.0.0.1:{server.server_port}',
+        'cache_enabled': True
+    })
+    yield seen
+    server.shutdown()
+    server.server_close()
+
+class TestFreshness:
+    """Test freshness lifetimes and the storage tiers."""
+
+    def test_freshness_lifetime(self):
+        """s-maxage wins over max-age, which wins over Expires."""
+        assert freshness_lifetime(Headers([('Cache-Control', 'max-age=30, s-maxage=10')]), 0) == 10
+        assert freshness_lifetime(Headers([('Cache-Control', 'max-age=30')]), 0) == 30
+        assert freshness_lifetime(Headers([
+            ('Date', 'Mon, 19 Oct 2026 10:00:00 GMT'),
+            ('Expires', 'Mon, 19 Oct 2026 10:05:00 GMT')
+        ]), 0) == 300
+        assert freshness_lifetime(Headers([('Expires', '0')]), 0) == 0
+        assert freshness_lifetime(Headers(), 0) is None
+
+    def test_memory_lru_is_bounded(self):
+        """The least recently used responses are evicted beyond memory_size."""
+        cache = ResponseCache(memory_size=3000, memory_entry_size=1000)
+        request_headers = Headers()
+        for i in range(5):
+            fill = cache.begin(f'http://upstream/{i}', request_headers, 200,
+                               Headers([('Cache-Control', 'max-age=60')]), 0)
+            fill.write(b'x' * 1000)
+            fill.finish()
+
+        stats = cache.stats()
+        assert stats['memory_entries'] == 3
+        assert stats['memory_bytes'] == 3000
+        assert stats['evictions'] == 2
+        assert cache.lookup('http://upstream/0', request_headers) is None
+        assert cache.lookup('http://upstream/4', request_headers) is not None
+
+    def test_incomplete_bodies_are_not_stored(self):
+        """An aborted copy (client gone) leaves nothing in the cache."""
+        cache = ResponseCache()
+        fill = cache.begin('http://upstream/a', Headers(), 200, Headers([('Cache-Control', 'max-age=60')]), 0)
+        fill.write(b'partial')
+        fill.abort()
+        assert cache.lookup('http://upstream/a', Headers()) is None
+
+class TestCacheAPI:
+    """Test cached GET traffic through the proxy."""
+
+    def test_fresh_response_is_served_from_cache(self, client, upstream):
+        """A second GET within max-age does not reach the upstream."""
+        first = fetch(client, '/api/ecommerce/fresh?page=1')
+        second = fetch(client, '/api/ecommerce/fresh?page=1')
+        other = fetch(client, '/api/ecommerce/fresh?page=2')
+
+        assert first.headers['X-Cache'] == 'MISS'
+        assert second.headers['X-Cache'] == 'HIT'
+        assert second.data == first.data == b'fresh 1'
+        assert 'Age' in second.headers
+        assert other.data == b'fresh 2'
+        assert len(upstream) == 2
+
+    def test_stale_response_is_revalidated(self, client, upstream):
+        """A stale entry with an ETag is revalidated and served on 304."""
+        assert fetch(client, '/api/ecommerce/etag').data == b'validated body'
+        response = fetch(client, '/api/ecommerce/etag')
+
+        assert response.status_code == 200
+        assert response.headers['X-Cache'] == 'REVALIDATED'
+        assert response.data == b'validated body'
+        assert upstream[1][1]['If-None-Match'] == '"v1"'
+
+        # A client holding the same ETag gets a 304 itself
+        response = fetch(client, '/api/ecommerce/etag', headers={'If-None-Match': '"v1"'})
+        assert response.status_code == 304
+
+    def test_vary_selects_variant(self, client, upstream):
+        """Responses varying on a request header are cached per value."""
+        english = fetch(client, '/api/ecommerce/vary', headers={'Accept-Language': 'en'})
+        french = fetch(client, '/api/ecommerce/vary', headers={'Accept-Language': 'fr'})
+        again = fetch(client, '/api/ecommerce/vary', headers={'Accept-Language': 'fr'})
+
+        assert english.data == b'hello en'
+        assert french.data == again.data == b'hello fr'
+        assert again.headers['X-Cache'] == 'HIT'
+        assert len(upstream) == 2
+
+    def test_private_and_no_store_are_not_cached(self, client, upstream):
+        """Private responses and no-store requests always go upstream."""
+        fetch(client, '/api/ecommerce/private')
+        fetch(client, '/api/ecommerce/private')
+        fetch(client, '/api/ecommerce/fresh', headers={'Cache-Control': 'no-store'})
+        fetch(client, '/api/ecommerce/fresh', headers={'Cache-Control': 'no-store'})
+        assert len(upstream) == 4
+
+    def test_ranges_are_not_cached(self, client, upstream):
+        """Partial responses are not stored, and ranges are not served from full ones."""
+        ranged = fetch(client, '/api/ecommerce/ranged', headers={'Range': 'bytes=0-1'})
+        plain = fetch(client, '/api/ecommerce/ranged')
+        assert (ranged.status_code, ranged.data) == (206, b'01')
+        assert (plain.status_code, plain.data, plain.headers['X-Cache']) == (200, b'0123456789', 'MISS')
+
+        assert fetch(client, '/api/ecommerce/ranged').headers['X-Cache'] == 'HIT'
+        ranged = fetch(client, '/api/ecommerce/ranged', headers={'Range': 'bytes=0-1', 'If-Range': '"v1"'})
+        assert (ranged.status_code, ranged.data) == (206, b'01')
+        assert len(upstream) == 3
+
+    def test_large_bodies_use_disk_tier(self, client, upstream):
+        """Bodies above the memory entry size are stored on disk."""
+        first = fetch(client, '/api/ecommerce/large')
+        second = fetch(client, '/api/ecommerce/large')
+
+        assert second.headers['X-Cache'] == 'HIT'
+        assert second.data == first.data == b'x' * 100000
+        stats = main.response_cache.stats()
+        assert stats['disk_entries'] == 1
+        assert stats['disk_bytes'] == 100000
+
+    def test_unsafe_request_invalidates(self, client, upstream):
+        """A successful POST to a cached URL drops it."""
+        fetch(client, '/api/ecommerce/fresh')
+        client.post('/api/ecommerce/fresh', data=b'update')
+        assert fetch(client, '/api/ecommerce/fresh').headers['X-Cache'] == 'MISS'
+
+    def test_cache_is_opt_in(self, client, upstream):
+        """Services without cache_enabled are never cached."""
+        client.put('/api/bridge/services/1', json={'cache_enabled': False})
+        fetch(client, '/api/ecommerce/fresh')
+        response = fetch(client, '/api/ecommerce/fresh')
+        assert 'X-Cache' not in response.headers
+        assert len(upstream) == 2
+
+    def test_stats_and_metrics(self, client, upstream):
+        """Hit, miss and revalidation counts are exposed."""
+        fetch(client, '/api/ecommerce/fresh')
+        fetch(client, '/api/ecommerce/fresh')
+        fetch(client, '/api/ecommerce/etag')
+        fetch(client, '/api/ecommerce/etag')
+
+        stats = client.get('/api/bridge/stats').get_json()['cache']
+        assert (stats['hits'], stats['misses'], stats['revalidated']) == (1, 2, 1)
+        assert stats['hit_ratio'] == 0.5
+
+        metrics = client.get('/metrics').data.decode()
+        assert 'bridge_cache_hits_total 1.0' in metrics
+        assert 'bridge_cache_revalidated_total 1.0' in metrics
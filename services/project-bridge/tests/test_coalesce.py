@@ -0,0 +1,199 @@
+import pytest
+import sys
+import os
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from src import main
+from src.coalesce import Coalescer
+import http.server
+import threading
+import time
+
+@pytest.fixture(autouse=True)
+def coalescer(monkeypatch):
+    """Enable request coalescing."""
+    monkeypatch.setattr(main, 'coalescer', Coalescer(enabled=True))
+
+@pytest.fixture
+def upstream(client):
+    """Local upstream holding its responses until released; yields (requests seen, release event)."""
+    seen = []
+    release = threading.Event()
+
+    class Handler(http.server.BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def send_chunk(self, data):
+            self.wfile.write(f'{len(data):x}\r\n'.encode() + data + b'\r\n')
+            self.wfile.flush()
+
+        def do_GET(self):
+            seen.append((self.path, self.headers.get('Accept-Language')))
+            release.wait(5)
+            if self.path == '/broken':
+                self.close_connection = True
+                return
+            self.send_response(200)
+            if self.path == '/session':
+                self.send_header('Set-Cookie', f'session={len(seen)}')
+            elif self.path == '/private':
+                self.send_header('Cache-Control', 'private, max-age=60')
+            self.send_header('Transfer-Encoding', 'chunked')
+            self.end_headers()
+            for i in range(5):
+                self.send_chunk(f'{self.path} part {i}\n'.encode())
+                time.sleep(0.01)
+            self.send_chunk(b'')
+
+        def log_message(self, *args):
+            pass
+
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    client.put('/api/bridge/services/1', json={'target_url': f'http://127.0.0.1:{server.server_port}'})
+    yield seen, release
+    release.set()
+    server.shutdown()
+    server.server_close()
+
+def concurrent_gets(upstream, requests, followers):
+    """Send `requests` (path, headers) at once; release the upstream once `followers` joined."""
+    results = [None] * len(requests)
+
+    def get(i):
+        path, headers = requests[i]
+        response = main.app.test_client().get(path, headers=headers)
+        results[i] = (response.status_code, response.data)
+
+    threads = [threading.Thread(target=get, args=(i,)) for i in range(len(requests))]
+    for thread in threads:
+        thread.start()
+    deadline = time.monotonic() + 5
+    while main.coalescer.stats()['followers'] < followers and time.monotonic() < deadline:
+        time.sleep(0.01)
+    upstream[1].set()
+    for thread in threads:
+        thread.join()
+    return results
+
+def expected_body(path):
+    return b''.join(f'{path} part {i}\n'.encode() for i in range(5))
+
+class TestFlights:
+    """Test the shared chunk buffer of a flight."""
+
+    def test_chunks_are_dropped_once_relayed(self):
+        """Chunks every reader is past are dropped, and the flight closes to newcomers."""
+        coalescer = Coalescer(enabled=True)
+        closed = []
+        flight, first, leader = coalescer.join(('http://upstream/a',))
+        _, second, follower_leads = coalescer.join(('http://upstream/a',))
+        assert leader and not follower_leads
+        flight.start(200, [], iter([b'a', b'b', b'c']), lambda: closed.append(True))
+
+        assert next(first) == b'a'
+        assert flight.joinable
+        assert next(second) == b'a'
+        assert not flight.joinable
+        assert coalescer.join(('http://upstream/a',))[2]
+
+        assert list(first) == [b'b', b'c']
+        assert closed == [True]
+        assert list(second) == [b'b', b'c']
+
+    def test_fast_reader_waits_for_slow_one(self):
+        """A reader a full buffer ahead of another does not pull more chunks."""
+        coalescer = Coalescer(enabled=True, buffer_size=2)
+        flight, fast, _ = coalescer.join(('http://upstream/a',))
+        _, slow, _ = coalescer.join(('http://upstream/a',))
+        pulled = []
+
+        def chunks():
+            for chunk in (b'a', b'b', b'c', b'd'):
+                pulled.append(chunk)
+                yield chunk
+
+        flight.start(200, [], chunks(), lambda: None)
+        assert [next(fast), next(fast)] == [b'a', b'b']
+        reader = threading.Thread(target=lambda: list(fast))
+        reader.start()
+        time.sleep(0.1)
+        assert pulled == [b'a', b'b']
+
+        assert list(slow) == [b'a', b'b', b'c', b'd']
+        reader.join(5)
+        assert not reader.is_alive()
+
+    def test_abandoned_flight_releases_upstream(self):
+        """The upstream response is closed once every reader went away."""
+        coalescer = Coalescer(enabled=True)
+        closed = []
+        flight, first, _ = coalescer.join(('http://upstream/a',))
+        _, second, _ = coalescer.join(('http://upstream/a',))
+        flight.start(200, [], iter([b'a', b'b']), lambda: closed.append(True))
+
+        first.close()
+        assert closed == []
+        second.close()
+        assert closed == [True]
+        assert coalescer.stats()['in_flight'] == 0
+
+class TestCoalescingAPI:
+    """Test coalesced GETs through the proxy."""
+
+    def test_identical_gets_share_one_upstream_request(self, client, upstream):
+        """Concurrent identical GETs reach the upstream once and all get the streamed body."""
+        results = concurrent_gets(upstream, [('/api/ecommerce/popular', {})] * 8, followers=7)
+
+        assert results == [(200, expected_body('/popular'))] * 8
+        assert len(upstream[0]) == 1
+        stats = client.get('/api/bridge/stats').get_json()['coalescing']
+        assert stats == {'leaders': 1, 'followers': 7, 'in_flight': 0}
+
+    def test_varying_headers_split_flights(self, client, upstream):
+        """GETs differing in a varying header get their own upstream request."""
+        results = concurrent_gets(upstream, [
+            ('/api/ecommerce/popular', {'Accept-Language': 'en'}),
+            ('/api/ecommerce/popular', {'Accept-Language': 'en'}),
+            ('/api/ecommerce/popular', {'Accept-Language': 'fr'}),
+            ('/api/ecommerce/popular', {'Accept-Language': 'fr', 'X-Trace': '1'})
+        ], followers=2)
+
+        assert all(result == (200, expected_body('/popular')) for result in results)
+        assert sorted(language for _, language in upstream[0]) == ['en', 'fr']
+
+    def test_service_coalesce_headers(self, client, upstream):
+        """A service can choose the headers that vary."""
+        client.put('/api/bridge/services/1', json={'coalesce_headers': 'X-Tenant'})
+        concurrent_gets(upstream, [
+            ('/api/ecommerce/popular', {'X-Tenant': 'a', 'Accept-Language': 'en'}),
+            ('/api/ecommerce/popular', {'X-Tenant': 'a', 'Accept-Language': 'fr'}),
+            ('/api/ecommerce/popular', {'X-Tenant': 'b'})
+        ], followers=1)
+
+        assert len(upstream[0]) == 2
+
+    def test_leader_error_reaches_followers(self, client, upstream):
+        """Followers get the leader's upstream error."""
+        results = concurrent_gets(upstream, [('/api/ecommerce/broken', {})] * 3, followers=2)
+
+        assert [status for status, _ in results] == [502] * 3
+        assert len(upstream[0]) == 1
+
+    def test_private_responses_are_not_shared(self, client, upstream):
+        """Followers of a response setting cookies or marked private send their own request."""
+        for i, path in enumerate(('/session', '/private')):
+            upstream[1].clear()
+            results = concurrent_gets(upstream, [(f'/api/ecommerce{path}', {})] * 3, followers=2 * (i + 1))
+            assert results == [(200, expected_body(path))] * 3
+        # The followers joined, then each client got its own response (and cookie)
+        assert main.coalescer.stats()['followers'] == 4
+        assert len(upstream[0]) == 6
+
+    def test_coalescing_can_be_disabled(self, client, upstream, monkeypatch):
+        """With coalescing disabled, every GET goes upstream."""
+        monkeypatch.setattr(main.coalescer, 'enabled', False)
+        upstream[1].set()
+        concurrent_gets(upstream, [('/api/ecommerce/popular', {})] * 3, followers=0)
+
+        assert len(upstream[0]) == 3
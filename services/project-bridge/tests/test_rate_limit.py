@@ -0,0 +1,102 @@
+import pytest
+import sys
+import os
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from src import main
+from src.rate_limit import MemoryBuckets, RateLimiter, SQLiteBuckets
+
+def service(rate_limit, service_id=1):
+    return {'id': service_id, 'name': f'Service {service_id}', 'rate_limit': rate_limit}
+
+class TestTokenBuckets:
+    """Test lazy refill, the service-wide bucket and eviction."""
+
+    def test_burst_then_refill(self):
+        """A client gets one window worth of requests, then one per refilled token."""
+        limiter = RateLimiter(window=60, service_multiplier=10)
+        assert [limiter.check(service(3), '10.0.0.1', now=0) for _ in range(3)] == [0, 0, 0]
+        assert limiter.check(service(3), '10.0.0.1', now=0) == 20
+
+        # Other clients have their own bucket
+        assert limiter.check(service(3), '10.0.0.2', now=0) == 0
+        # One token back after 20s
+        assert limiter.check(service(3), '10.0.0.1', now=20) == 0
+        assert limiter.check(service(3), '10.0.0.1', now=20) > 0
+
+    def test_service_wide_limit(self):
+        """Many clients together are capped by the service bucket."""
+        limiter = RateLimiter(window=60, service_multiplier=2)
+        results = [limiter.check(service(2), f'10.0.0.{i}', now=0) for i in range(6)]
+        assert results[:4] == [0, 0, 0, 0]
+        assert all(results[4:])
+        assert limiter.stats()[1] == {'service': 'Service 1', 'allowed': 4, 'limited': 2}
+
+    def test_service_limit_defaults_to_rate_limit(self):
+        """Without a multiplier, the service accepts `rate_limit` requests from all clients."""
+        limiter = RateLimiter(window=60)
+        results = [limiter.check(service(2), f'10.0.0.{i}', now=0) for i in range(3)]
+        assert results[:2] == [0, 0]
+        assert results[2] > 0
+
+    def test_rejected_requests_take_no_tokens(self):
+        """A request refused by one bucket does not drain the other."""
+        limiter = RateLimiter(window=60, service_multiplier=1)
+        assert limiter.check(service(1), '10.0.0.1', now=0) == 0
+        assert limiter.check(service(1), '10.0.0.2', now=0) > 0
+        # The second client's own bucket is still full after the refusal
+        assert limiter.check(service(1), '10.0.0.2', now=60) == 0
+
+    def test_memory_is_bounded(self):
+        """The least recently used buckets are evicted beyond max_keys once full."""
+        buckets = MemoryBuckets(max_keys=100)
+        for i in range(1000):
+            buckets.acquire([(f'client:{i}', 1.0, 5)], now=i)
+        assert len(buckets) == 100
+
+    def test_depleted_buckets_are_not_evicted(self):
+        """A client cannot get its tokens back by pushing its bucket out of the LRU."""
+        buckets = MemoryBuckets(max_keys=1)
+        assert [buckets.acquire([('client:a', 1.0, 2)], now=0) for _ in range(3)] == [0, 0, 1]
+        buckets.acquire([('client:b', 1.0, 2)], now=0)
+        assert len(buckets) == 2
+        assert buckets.acquire([('client:a', 1.0, 2)], now=0) == 1
+
+        # Once refilled, the least recently used bucket goes
+        buckets.acquire([('client:c', 1.0, 2)], now=10)
+        assert len(buckets) == 1
+
+    def test_sqlite_backend_is_shared(self, client):
+        """Workers using the same database draw from the same buckets."""
+        workers = [RateLimiter(backend='sqlite', window=60) for _ in range(2)]
+        for limiter in workers:
+            limiter.open(main.DATABASE)
+
+        results = [workers[i % 2].check(service(4), '10.0.0.1', now=0) for i in range(6)]
+        assert results[:4] == [0, 0, 0, 0]
+        assert all(results[4:])
+
+    def test_sqlite_backend_purges_full_buckets(self, client):
+        """Buckets that refilled completely are deleted."""
+        buckets = SQLiteBuckets(main.DATABASE, purge_interval=0)
+        buckets.acquire([('client:a', 1.0, 5), ('client:b', 1.0, 5)], now=0)
+        assert len(buckets) == 2
+        buckets.acquire([('client:c', 1.0, 5)], now=10)
+        assert len(buckets) == 1
+
+class TestRateLimitAPI:
+    """Test 429 responses from the proxy."""
+
+    def test_over_limit_gets_429_with_retry_after(self, client):
+        """Past `rate_limit` requests, the bridge answers 429 without calling the upstream."""
+        client.put('/api/bridge/services/6', json={'target_url': 'http://127.0.0.1:9', 'rate_limit': 5})
+        statuses = [client.get('/api/video/jobs').status_code for _ in range(6)]
+        assert statuses == [502] * 5 + [429]
+
+        response = client.get('/api/video/jobs')
+        assert response.status_code == 429
+        assert int(response.headers['Retry-After']) == 12
+        assert response.get_json()['error'] == 'Rate limit exceeded'
+
+        metrics = client.get('/metrics').data.decode()
+        assert 'bridge_rate_limited_total{service_id="6",service="Video Processing"} 2.0' in metrics
@@ -0,0 +1,105 @@
+import pytest
+import sys
+import os
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from src import main
+from src.proxy import BodyTooLarge, spool
+import hashlib
+import http.server
+import io
+import threading
+import tracemalloc
+
+@pytest.fixture
+def upstream(client):
+    """Local upstream answering uploads with their length and digest; yields received headers."""
+    received = []
+
+    class Handler(http.server.BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def do_POST(self):
+            received.append(dict(self.headers))
+            remaining = int(self.headers['Content-Length'])
+            digest = hashlib.sha256()
+            while remaining:
+                chunk = self.rfile.read(min(remaining, 65536))
+                digest.update(chunk)
+                remaining -= len(chunk)
+            body = digest.hexdigest().encode()
+            self.send_response(200)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    client.post('/api/bridge/services', json={
+        'name': 'Video Upload', 'type': 'api', 'target_url': f'http://127.0.0.1:{server.server_address[1]}',
+        'path_prefix': '/api/upload', 'max_body_size': 16 * 1024 * 1024
+    })
+    yield received
+    server.shutdown()
+
+def chunked_post(client, data):
+    """POST `data` without a Content-Length, as a chunked upload."""
+    return client.post('/api/upload/video', input_stream=io.BytesIO(data),
+                       headers={'Transfer-Encoding': 'chunked'},
+                       environ_overrides={'wsgi.input_terminated': True})
+
+class TestRequestBodies:
+    """Test streamed and spooled request bodies and size limits."""
+
+    def test_upload_is_streamed(self, client, upstream):
+        """A body with a Content-Length reaches the upstream without being buffered."""
+        data = os.urandom(8 * 1024 * 1024)
+        tracemalloc.start()
+        try:
+            response = client.post('/api/upload/video', data=data)
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+
+        assert response.data.decode() == hashlib.sha256(data).hexdigest()
+        assert upstream[0]['Content-Length'] == str(len(data))
+        assert peak < 2 * 1024 * 1024
+
+    def test_chunked_upload_is_spooled(self, client, upstream):
+        """A chunked body is forwarded whole, with a Content-Length."""
+        data = os.urandom(3 * 1024 * 1024)
+        response = chunked_post(client, data)
+
+        assert response.status_code == 200
+        assert response.data.decode() == hashlib.sha256(data).hexdigest()
+        assert upstream[0]['Content-Length'] == str(len(data))
+        assert 'Transfer-Encoding' not in upstream[0]
+
+    def test_declared_length_over_limit(self, client, upstream):
+        """An oversized Content-Length gets a 413 without contacting the upstream."""
+        response = client.post('/api/upload/video', data=b'x' * (16 * 1024 * 1024 + 1))
+        assert response.status_code == 413
+        assert response.get_json()['max_body_size'] == 16 * 1024 * 1024
+        assert upstream == []
+
+    def test_chunked_body_over_limit(self, client, upstream):
+        """A chunked body growing past the limit gets a 413 before going upstream."""
+        service_id = main.find_service_by_path('/api/upload')['id']
+        client.put(f'/api/bridge/services/{service_id}', json={'max_body_size': 1024})
+        response = chunked_post(client, b'x' * 4096)
+        assert response.status_code == 413
+        assert upstream == []
+
+    def test_spool_threshold(self):
+        """Spooled bodies stay in memory up to the threshold, then go to disk."""
+        small, length = spool(io.BytesIO(b'x' * 100), 0, threshold=1000)
+        assert (length, small._rolled) == (100, False)
+        large, length = spool(io.BytesIO(b'x' * 5000), 0, threshold=1000)
+        assert (length, large._rolled) == (5000, True)
+        assert large.read() == b'x' * 5000
+
+        with pytest.raises(BodyTooLarge):
+            spool(io.BytesIO(b'x' * 5000), 4096)
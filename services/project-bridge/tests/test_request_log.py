@@ -0,0 +1,93 @@
+import pytest
+import sys
+import os
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from src import main
+from src.request_log import RequestLogWriter
+import random
+import sqlite3
+import time
+
+def log_rows(database):
+    conn = sqlite3.connect(database)
+    rows = conn.execute('SELECT service_id, status_code, sample_weight FROM request_logs').fetchall()
+    conn.close()
+    return rows
+
+def log_entries(writer, count, status_code=200, sample_rate=None):
+    for i in range(count):
+        writer.log(1, 'GET', f'/api/chat/{i}', status_code, 0.01, 'pytest', '127.0.0.1', sample_rate)
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+class TestRequestLogWriter:
+    """Test the batched background request log writer."""
+
+    def test_batches_on_size(self, client):
+        """Full batches are written in one transaction each; flush writes the rest."""
+        writer = RequestLogWriter(batch_size=10, flush_interval=60)
+        writer.open(main.DATABASE)
+        log_entries(writer, 25)
+
+        assert wait_for(lambda: writer.stats()['written'] == 20)
+        assert writer.stats()['batches'] == 2
+        writer.flush()
+        assert writer.stats()['written'] == 25
+        assert len(log_rows(main.DATABASE)) == 25
+
+    def test_batches_on_time(self, client):
+        """A partial batch is written once the flush interval elapsed."""
+        writer = RequestLogWriter(batch_size=100, flush_interval=0.1)
+        writer.open(main.DATABASE)
+        log_entries(writer, 3)
+
+        assert wait_for(lambda: writer.stats()['written'] == 3)
+        assert writer.stats()['batches'] == 1
+
+    def test_overflow_drops_entries(self):
+        """A full queue drops and counts entries instead of blocking."""
+        writer = RequestLogWriter(queue_size=5)
+        log_entries(writer, 8)
+
+        stats = writer.stats()
+        assert stats['queued'] == 5
+        assert stats['dropped'] == 3
+
+    def test_sampling_keeps_errors_and_weights(self, client):
+        """Sampled successes carry their weight; errors are always logged."""
+        random.seed(0)
+        writer = RequestLogWriter(flush_interval=60)
+        writer.open(main.DATABASE)
+        log_entries(writer, 1000, sample_rate=0.1)
+        log_entries(writer, 20, status_code=502, sample_rate=0.1)
+        writer.flush()
+
+        rows = log_rows(main.DATABASE)
+        assert len([row for row in rows if row[1] == 502]) == 20
+        successes = [row for row in rows if row[1] == 200]
+        assert len(successes) + writer.stats()['sampled_out'] == 1000
+        assert all(row[2] == pytest.approx(10) for row in successes)
+        assert 700 < sum(row[2] for row in successes) < 1300
+
+class TestProxyLogging:
+    """Test that proxied requests are logged asynchronously."""
+
+    def test_proxied_requests_reach_stats(self, client):
+        """Logged requests show up in the bridge stats once flushed."""
+        client.put('/api/bridge/services/2', json={'target_url': 'http://127.0.0.1:9'})
+        for _ in range(3):
+            assert client.get('/api/chat/rooms').status_code == 502
+
+        main.flush_request_logs()
+        stats = client.get('/api/bridge/stats').get_json()
+        assert stats['requests_24h'] == 3
+        assert stats['request_log']['written'] >= 3
+        assert {'service': 'AI Chat Service', 'requests': 3} in stats['requests_by_service']
+
+        metrics = client.get('/metrics').data.decode()
+        assert '# TYPE bridge_request_log_dropped_total counter' in metrics
@@ -0,0 +1,212 @@
+import pytest
+import sys
+import os
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from src import main
+from src.balancing import Balancer
+from src.retry import LatencyWindow, RetryBudget, RetryPolicy, is_connect_error
+from contextlib import ExitStack
+from functools import partial
+import http.server
+import io
+import requests
+import threading
+import time
+
+DEAD_TARGET = 'http://127.0.0.1:9'
+
+@pytest.fixture(autouse=True)
+def policies(monkeypatch):
+    """Use a fresh balancer and a retry policy hedging after a few samples."""
+    monkeypatch.setattr(main, 'balancer', Balancer())
+    monkeypatch.setattr(main, 'retry_policy', RetryPolicy(hedge_min_samples=5))
+
+@pytest.fixture
+def stubs(client):
+    """Start local upstreams echoing request bodies, with an adjustable latency."""
+    servers = []
+
+    def start(delay=0.0):
+        class Handler(http.server.BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def respond(self, body):
+                time.sleep(server.delay)
+                self.send_response(200)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                self.respond(str(server.server_port).encode())
+
+            def do_PUT(self):
+                self.respond(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+
+            def log_message(self, *args):
+                pass
+
+        server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        server.daemon_threads = True
+        server.delay = delay
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        return server
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+def url(server):
+    return f'http://127.0.0.1:{server.server_port}'
+
+def add_service(client, urls, **fields):
+    response = client.post('/api/bridge/services', json={
+        'name': 'Stub', 'type': 'api', 'target_url': urls[0], 'path_prefix': '/api/stub', **fields
+    })
+    service_id = response.get_json()['id']
+    for target in urls[1:]:
+        client.post(f'/api/bridge/services/{service_id}/targets', json={'url': target})
+    return service_id
+
+class TestRetryPolicy:
+    """Test connect error detection, budgets and latency percentiles."""
+
+    def test_connect_errors(self):
+        """Refused connections are connect errors, read timeouts are not."""
+        with pytest.raises(requests.exceptions.ConnectionError) as refused:
+            requests.get(DEAD_TARGET)
+        assert is_connect_error(refused.value)
+        assert not is_connect_error(requests.exceptions.ReadTimeout())
+
+    def test_budget_is_a_share_of_requests(self):
+        """Retries are capped to a percentage of the requests of the window."""
+        budget = RetryBudget(percent=20, min_per_second=0, window=10)
+        for _ in range(10):
+            budget.record_request(now=0)
+        assert [budget.withdraw(now=1) for _ in range(3)] == [True, True, False]
+        # Requests and retries older than the window no longer count
+        assert not budget.withdraw(now=10)
+        budget.record_request(now=10)
+        assert not budget.withdraw(now=10)
+
+    def test_budget_minimum_rate(self):
+        """Services with little traffic still get a few retries per second."""
+        budget = RetryBudget(percent=10, min_per_second=0.5, window=10)
+        assert [budget.withdraw(now=0) for _ in range(6)] == [True] * 5 + [False]
+
+    def test_p95(self):
+        """The p95 needs enough samples and follows the latest ones."""
+        latencies = LatencyWindow(size=100)
+        for i in range(4):
+            latencies.record(i)
+        assert latencies.p95(min_samples=5) is None
+        for i in range(200):
+            latencies.record(i / 1000)
+        assert latencies.p95(min_samples=5) == pytest.approx(0.194)
+
+    def test_primary_does_not_queue_behind_hedges(self):
+        """A busy hedge pool delays hedges, never the first request of a pair."""
+        policy = RetryPolicy(hedge_min_samples=1, hedge_threads=1)
+        service = {'id': 1, 'name': 'Stub', 'hedge': True, 'retry_budget': 100}
+        release = threading.Event()
+        calls = []
+
+        def attempt(delay, tried):
+            calls.append(delay)
+            if delay is None:
+                release.wait(5)
+            else:
+                time.sleep(delay)
+            return object(), ExitStack(), 0.01
+
+        policy.send(service, 'GET', None, partial(attempt, 0))
+        # Both requests of this pair hang, holding the only hedge thread
+        stuck = threading.Thread(target=policy.send, args=(service, 'GET', None, partial(attempt, None)))
+        stuck.start()
+        while calls.count(None) < 2:
+            time.sleep(0.01)
+
+        started = time.monotonic()
+        policy.send(service, 'GET', None, partial(attempt, 0.1))
+        assert time.monotonic() - started < 0.5
+        # Its hedge was still queued and was dropped
+        assert calls.count(0.1) == 1
+        release.set()
+        stuck.join(5)
+
+class TestRetryAPI:
+    """Test retries, hedging and timeouts through the proxy."""
+
+    def test_connect_error_is_retried_on_another_target(self, client, stubs):
+        """An idempotent request to an unreachable target is sent to the next one."""
+        live = stubs()
+        service_id = add_service(client, [DEAD_TARGET, url(live)])
+
+        for _ in range(4):
+            response = client.get('/api/stub/items')
+            assert response.status_code == 200
+            assert response.data == str(live.server_port).encode()
+        assert main.retry_policy.stats()[service_id]['retries'] >= 2
+
+    def test_bodies_are_replayed(self, client, stubs):
+        """Declared and chunked (spooled) bodies are sent again on retry."""
+        live = stubs()
+        add_service(client, [DEAD_TARGET, url(live)])
+
+        for _ in range(2):
+            assert client.put('/api/stub/items', data=b'declared').data == b'declared'
+            chunked = client.put('/api/stub/items', input_stream=io.BytesIO(b'chunked'),
+                                 headers={'Transfer-Encoding': 'chunked'},
+                                 environ_overrides={'wsgi.input_terminated': True})
+            assert chunked.data == b'chunked'
+
+    def test_non_idempotent_and_disabled_retries(self, client, stubs):
+        """POST is never retried, nor anything with max_retries set to 0."""
+        live = stubs()
+        service_id = add_service(client, [DEAD_TARGET, url(live)])
+        assert client.post('/api/stub/items', data=b'x').status_code == 502
+
+        client.put(f'/api/bridge/services/{service_id}', json={'max_retries': 0})
+        statuses = {client.get('/api/stub/items').status_code for _ in range(2)}
+        assert statuses == {200, 502}
+
+    def test_budget_caps_retries(self, client, stubs, monkeypatch):
+        """With the budget spent, connect errors are returned as they are."""
+        monkeypatch.setattr(main.retry_policy, 'min_per_second', 0)
+        service_id = add_service(client, [DEAD_TARGET, url(stubs())], retry_budget=0)
+
+        statuses = [client.get('/api/stub/items').status_code for _ in range(4)]
+        assert statuses.count(502) == 2
+        stats = main.retry_policy.stats()[service_id]
+        assert (stats['retries'], stats['budget_exhausted']) == (0, 2)
+
+    def test_hedging_beats_slow_target(self, client, stubs):
+        """A request still waiting past the p95 is hedged to another target, and the first answer wins."""
+        slow, fast = stubs(), stubs()
+        service_id = add_service(client, [url(slow), url(fast)], hedge=True)
+        for _ in range(10):
+            assert client.get('/api/stub/warm').status_code == 200
+
+        slow.delay = 1.0
+        for _ in range(2):
+            started = time.monotonic()
+            response = client.get('/api/stub/items')
+            assert response.data == str(fast.server_port).encode()
+            assert time.monotonic() - started < 0.5
+
+        stats = main.retry_policy.stats()[service_id]
+        assert stats['hedges'] >= 1
+        assert stats['hedge_wins'] >= 1
+        metrics = client.get('/metrics').data.decode()
+        assert f'bridge_upstream_hedges_total{{service_id="{service_id}",service="Stub"}}' in metrics
+
+    def test_service_timeout(self, client, stubs):
+        """The service timeout replaces the former fixed 30 seconds."""
+        add_service(client, [url(stubs(delay=0.5))], timeout=0.1)
+
+        started = time.monotonic()
+        assert client.get('/api/stub/items').status_code == 504
+        assert time.monotonic() - started < 0.4
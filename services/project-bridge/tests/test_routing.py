@@ -0,0 +1,125 @@
+import pytest
+import sys
+import os
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from src import main
+from src.routing import RouteTable, RouteTrie, strip_segments
+import http.server
+import sqlite3
+import threading
+import time
+
+class TestRouteTrie:
+    """Test longest prefix matching on path segments."""
+
+    def test_longest_prefix_wins(self):
+        """The most specific registered prefix routes the path."""
+        trie = RouteTrie()
+        trie.insert('/api', 'api')
+        trie.insert('/api/chat', 'chat')
+        trie.insert('/api/chat/admin/', 'admin')
+
+        assert trie.longest_match('/api/chat') == 'chat'
+        assert trie.longest_match('/api/chat/rooms/1') == 'chat'
+        assert trie.longest_match('/api/chat/admin/users') == 'admin'
+        assert trie.longest_match('/api/other') == 'api'
+        assert trie.longest_match('/static/app.js') is None
+
+    def test_segment_boundaries(self):
+        """A prefix never matches part of a segment."""
+        trie = RouteTrie()
+        trie.insert('/api/chat', 'chat')
+
+        assert trie.longest_match('/api/chatbot') is None
+        assert trie.longest_match('/api/cha') is None
+
+    def test_match_counts_segments(self):
+        """The match gives the number of path segments its prefix covers."""
+        trie = RouteTrie()
+        trie.insert('/api/chat/', 'chat')
+
+        assert trie.match('//api///chat//rooms/1') == ('chat', 2)
+        assert trie.match('/static') == (None, 0)
+        assert strip_segments('//api///chat//rooms/1', 2) == '//rooms/1'
+        assert strip_segments('/api/chat', 2) == ''
+
+    def test_lookup_with_10k_prefixes(self):
+        """Lookups stay in the microseconds with many registered prefixes."""
+        trie = RouteTrie()
+        for i in range(10000):
+            trie.insert(f'/api/tenant{i % 100}/service{i}', i)
+
+        started = time.perf_counter()
+        for i in range(10000):
+            assert trie.longest_match(f'/api/tenant{i % 100}/service{i}/items/42') == i
+        per_lookup = (time.perf_counter() - started) / 10000
+        assert per_lookup < 50e-6
+
+class TestRouteTable:
+    """Test route table rebuilds and cross-process refresh."""
+
+    def test_add_and_update_rebuild_routes(self, client):
+        """Service changes through the API apply to the next lookup."""
+        assert main.find_service_by_path('/api/new/items') is None
+
+        response = client.post('/api/bridge/services', json={
+            'name': 'New API', 'type': 'api', 'target_url': 'http://new.example.com', 'path_prefix': '/api/new'
+        })
+        service_id = response.get_json()['id']
+        assert main.find_service_by_path('/api/new/items')['id'] == service_id
+
+        client.put(f'/api/bridge/services/{service_id}', json={'enabled': False})
+        assert main.find_service_by_path('/api/new/items') is None
+
+    def test_changes_from_other_processes(self, client):
+        """Writes outside this process are picked up through the version stamp."""
+        table = RouteTable(refresh_interval=0)
+        table.reload(main.DATABASE)
+        version = table.version
+
+        conn = sqlite3.connect(main.DATABASE)
+        conn.execute("UPDATE services SET path_prefix = '/api/talk' WHERE path_prefix = '/api/chat'")
+        conn.commit()
+        conn.close()
+
+        assert table.lookup('/api/talk/rooms')['name'] == 'AI Chat Service'
+        assert table.lookup('/api/chat/rooms') is None
+        assert table.version == version + 1
+
+class TestForwardedPath:
+    """Test the path forwarded upstream after the service prefix."""
+
+    @pytest.fixture
+    def upstream(self, client):
+        """Local upstream recording request paths; yields the paths received."""
+        received = []
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                received.append(self.path)
+                self.send_response(200)
+                self.send_header('Content-Length', '2')
+                self.end_headers()
+                self.wfile.write(b'ok')
+
+            def log_message(self, *args):
+                pass
+
+        server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        client.post('/api/bridge/services', json={
+            'name': 'Echo', 'type': 'api', 'target_url': f'http://127.0.0.1:{server.server_address[1]}',
+            'path_prefix': '/api/echo'
+        })
+        yield received
+        server.shutdown()
+
+    def test_duplicate_slashes(self, client, upstream):
+        """Only the matched segments are cut, whatever slashes separate them."""
+        response = client.get('/api//echo//items/42')
+
+        assert response.status_code == 200
+        assert upstream == ['/items/42']
@@ -0,0 +1,150 @@
+import pytest
+import sys
+import os
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from src import main
+from src.balancing import Balancer
+from src.proxy import strip_hop_by_hop
+from werkzeug.serving import make_server
+import gzip
+import http.server
+import requests
+import sqlite3
+import threading
+import time
+import tracemalloc
+
+LARGE_BODY_SIZE = 32 * 1024 * 1024
+
+@pytest.fixture
+def upstream(client):
+    """Local upstream with large, slow, compressed and hop-by-hop responses."""
+    release = threading.Event()
+
+    class Handler(http.server.BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def send_chunk(self, data):
+            self.wfile.write(f'{len(data):x}\r\n'.encode() + data + b'\r\n')
+
+        def do_GET(self):
+            if self.path == '/large':
+                self.send_response(200)
+                self.send_header('Transfer-Encoding', 'chunked')
+                self.end_headers()
+                block = b'x' * 65536
+                for _ in range(LARGE_BODY_SIZE // len(block)):
+                    self.send_chunk(block)
+                self.send_chunk(b'')
+            elif self.path == '/slow':
+                self.send_response(200)
+                self.send_header('Transfer-Encoding', 'chunked')
+                self.end_headers()
+                self.send_chunk(b'first')
+                self.wfile.flush()
+                release.wait(5)
+                self.send_chunk(b'second')
+                self.send_chunk(b'')
+            elif self.path == '/gzip':
+                body = gzip.compress(b'hello ' * 1000)
+                self.send_response(200)
+                self.send_header('Content-Encoding', 'gzip')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+            else:
+                self.send_response(200)
+                self.send_header('Connection', 'keep-alive, X-Internal')
+                self.send_header('Keep-Alive', 'timeout=5')
+                self.send_header('X-Internal', 'secret')
+                self.send_header('Set-Cookie', 'a=1')
+                self.send_header('Set-Cookie', 'b=2')
+                self.send_header('Content-Length', '2')
+                self.end_headers()
+                self.wfile.write(b'ok')
+
+        def log_message(self, *args):
+            pass
+
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    client.post('/api/bridge/services', json={
+        'name': 'Stub', 'type': 'api', 'target_url': f'http://127.0.0.1:{server.server_address[1]}',
+        'path_prefix': '/api/stub'
+    })
+    yield release
+    release.set()
+    server.shutdown()
+
+class TestStreamingResponses:
+    """Test chunked relaying of upstream responses."""
+
+    def test_large_body_memory_is_bounded(self, client, upstream):
+        """A body much larger than the chunk size never sits in memory at once."""
+        tracemalloc.start()
+        try:
+            response = client.get('/api/stub/large', buffered=False)
+            received = sum(len(chunk) for chunk in response.response)
+            response.close()
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+
+        assert received == LARGE_BODY_SIZE
+        assert peak < 4 * 1024 * 1024
+
+    def test_first_bytes_before_upstream_finishes(self, client, upstream):
+        """Chunks reach the client while the upstream is still sending."""
+        response = client.get('/api/stub/slow', buffered=False)
+        chunks = iter(response.response)
+        assert next(chunks) == b'first'
+
+        upstream.set()
+        assert b''.join(chunks) == b'second'
+        response.close()
+
+    def test_encoded_body_passes_through(self, client, upstream):
+        """Compressed bodies are relayed as-is with their encoding headers."""
+        response = client.get('/api/stub/gzip')
+        assert response.headers['Content-Encoding'] == 'gzip'
+        assert int(response.headers['Content-Length']) == len(response.data)
+        assert gzip.decompress(response.data) == b'hello ' * 1000
+
+    def test_hop_by_hop_headers_are_stripped(self, client, upstream):
+        """Connection-level headers, and those Connection names, are not relayed."""
+        response = client.get('/api/stub/headers')
+        assert response.data == b'ok'
+        assert 'Keep-Alive' not in response.headers
+        assert 'X-Internal' not in response.headers
+        assert response.headers.getlist('Set-Cookie') == ['a=1', 'b=2']
+
+    def test_request_is_finished_under_a_real_server(self, client, upstream, monkeypatch):
+        """Behind a WSGI server the request is logged and its target released once relayed."""
+        monkeypatch.setattr(main, 'balancer', Balancer())
+        server = make_server('127.0.0.1', 0, main.app, threaded=True)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        try:
+            for path in ('/api/stub/headers', '/api/stub/large'):
+                response = requests.get(f'http://127.0.0.1:{server.port}{path}')
+                assert response.status_code == 200
+        finally:
+            server.shutdown()
+
+        def finished():
+            main.request_log.flush()
+            conn = sqlite3.connect(main.DATABASE)
+            logged = conn.execute('SELECT method, status_code FROM request_logs').fetchall()
+            conn.close()
+            return logged == [('GET', 200)] * 2
+
+        deadline = time.monotonic() + 5
+        while not finished() and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert finished()
+        assert [target['outstanding'] for targets in main.balancer.stats().values() for target in targets] == [0]
+
+    def test_strip_hop_by_hop(self):
+        """Connection options are dropped along with the standard list."""
+        headers = [('Connection', 'close, X-Trace'), ('X-Trace', '1'), ('TE', 'trailers'), ('Accept', '*/*')]
+        assert strip_hop_by_hop(headers) == [('Accept', '*/*')]
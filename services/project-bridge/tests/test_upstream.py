@@ -0,0 +1,125 @@
+import pytest
+import sys
+import os
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from src import main
+import http.server
+import threading
+import time
+
+@pytest.fixture
+def upstream():
+    """Local HTTP/1.1 keep-alive upstream; yields (base URL, accepted connection count)."""
+    connections = []
+
+    class Handler(http.server.BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def setup(self):
+            super().setup()
+            connections.append(self.client_address)
+
+        def do_GET(self):
+            time.sleep(float(self.headers.get('X-Delay', 0)))
+            # The path, or the cookies received for /cookies
+            body = self.headers.get('Cookie', '').encode() if self.path == '/cookies' else self.path.encode()
+            self.send_response(200)
+            if self.path == '/login':
+                self.send_header('Set-Cookie', 'session=alice-secret')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f'http://127.0.0.1:{server.server_address[1]}', connections
+    server.shutdown()
+
+def add_service(client, target_url, **fields):
+    response = client.post('/api/bridge/services', json={
+        'name': 'Stub', 'type': 'api', 'target_url': target_url, 'path_prefix': '/api/stub', **fields
+    })
+    return response.get_json()['id']
+
+class TestUpstreamPools:
+    """Test pooled keep-alive connections to upstream services."""
+
+    def test_connections_are_reused(self, client, upstream):
+        """Sequential proxied requests share one upstream connection."""
+        service_id = add_service(client, upstream[0])
+        for i in range(20):
+            response = client.get(f'/api/stub/items/{i}')
+            assert response.status_code == 200
+            assert response.data == f'/items/{i}'.encode()
+
+        assert len(upstream[1]) == 1
+        stats = main.upstream_pools.stats()[service_id]
+        assert stats['requests'] == 20
+        assert stats['connections_opened'] == 1
+        assert stats['reuse_ratio'] == 0.95
+
+    def test_pool_size_bounds_connections(self, client, upstream):
+        """Concurrent requests beyond the pool size wait for a free connection."""
+        service_id = add_service(client, upstream[0], pool_size=2)
+        def slow_request(i):
+            # Distinct paths, so that the requests are not coalesced
+            main.app.test_client().get(f'/api/stub/slow/{i}', headers={'X-Delay': '0.2'}).data
+
+        threads = [threading.Thread(target=slow_request, args=(i,)) for i in range(6)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        stats = main.upstream_pools.stats()[service_id]
+        assert len(upstream[1]) == 2
+        assert stats['connections_opened'] == 2
+        assert stats['max_pool_wait_seconds'] >= 0.15
+
+    def test_idle_pools_are_closed(self, client, upstream):
+        """A pool unused for the idle timeout reconnects on the next request."""
+        main.upstream_pools.idle_timeout = 0
+        service_id = add_service(client, upstream[0])
+        client.get('/api/stub/a').data
+        client.get('/api/stub/b').data
+
+        assert len(upstream[1]) == 2
+        assert main.upstream_pools.stats()[service_id]['open'] is False
+
+    def test_resized_pool_is_closed_after_its_last_request(self, client, upstream):
+        """A pool replaced while in flight keeps serving its checkouts, then closes."""
+        service = {'id': 1, 'name': 'Stub', 'pool_size': 2}
+        pools = main.upstream_pools
+        with pools.client(service) as old_session:
+            old_session.get(f'{upstream[0]}/a').content
+            with pools.client({**service, 'pool_size': 3}) as new_session:
+                assert new_session is not old_session
+            # Still usable by the request that checked it out
+            assert old_session.get(f'{upstream[0]}/b').content == b'/b'
+            closed = []
+            old_session.close = lambda: closed.append(True)
+        assert closed == [True]
+        assert pools.stats()[1]['pool_size'] == 3
+
+    def test_cookies_are_not_shared_between_clients(self, client, upstream):
+        """A cookie set for one client is never sent upstream with another client's requests."""
+        add_service(client, upstream[0])
+        assert client.get('/api/stub/login').headers['Set-Cookie'].startswith('session=alice-secret')
+
+        assert main.app.test_client().get('/api/stub/cookies').data == b''
+
+    def test_metrics_exposition(self, client, upstream):
+        """Pool counters are exported in the Prometheus text format."""
+        service_id = add_service(client, upstream[0])
+        client.get('/api/stub/a').data
+        client.get('/api/stub/b').data
+
+        response = client.get('/metrics')
+        assert response.content_type.startswith('text/plain')
+        lines = response.data.decode().splitlines()
+        assert f'bridge_upstream_connection_reuse_ratio{{service_id="{service_id}",service="Stub"}} 0.5' in lines
+        assert '# TYPE bridge_upstream_pool_wait_seconds_total counter' in lines